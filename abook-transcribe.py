@@ -33,9 +33,9 @@ from StringIO               import StringIO
 from nltools                import misc
 from nltools.tts            import TTS
 from nltools.tokenizer      import tokenize
-from nltools.sequiturclient import sequitur_gen_ipa
 from nltools.phonetics      import ipa2xsampa, xsampa2ipa
 from speech_lexicon         import Lexicon
+from speech_g2p             import g2p_ipa
 
 #
 # - play back segments
@@ -113,7 +113,7 @@ def lex_gen_ipa (lex_base, locale, engine, voice, speak=False):
     try:
 
         if engine == 'sequitur':
-            ipas = sequitur_gen_ipa (SEQUITUR_MODEL, lex_base)
+            ipas = g2p_ipa (SEQUITUR_MODEL, lex_base)
         
         else:
             tts.locale = locale
@@ -38,6 +38,7 @@ from nltools.tokenizer  import tokenize
 
 from speech_lexicon     import Lexicon
 from speech_transcripts import Transcripts
+from speech_tokenizer_cache import tokenize_cached
 
 #
 # init 
@@ -56,6 +57,9 @@ parser = OptionParser("usage: %prog corpus foo.csv [bar.csv ...])")
 parser.add_option ("-l", "--lang", dest="lang", type = "str", default='de',
                   help="language (default: de)")
 
+parser.add_option ("-c", "--compact", action="store_true", dest="compact", 
+                   help="compact the review journal into the transcript shards afterwards")
+
 parser.add_option ("-f", "--force", action="store_true", dest="force", 
                    help="force: apply quality rating also on already reviewed entries")
 
@@ -111,13 +115,18 @@ for csvfn in args[1:]:
                     continue
            
             transcripts[utt_id]['quality'] = quality
-            transcripts[utt_id]['ts']      = u' '.join(tokenize(transcripts[utt_id]['prompt'], lang=options.lang, keep_punctuation=True))
+            transcripts[utt_id]['ts']      = u' '.join(tokenize_cached(transcripts[utt_id]['prompt'], lang=options.lang, keep_punctuation=True))
 
             cnt += 1
 
 logging.info ('results applied to %d transcripts.' % cnt)
 
-logging.info("saving transcripts...")
-transcripts.save()
-logging.info("saving transcripts...done.")
+logging.info("committing results to the review journal...")
+transcripts.commit()
+logging.info("committing results to the review journal...done.")
+
+if options.compact:
+    logging.info("saving transcripts...")
+    transcripts.save()
+    logging.info("saving transcripts...done.")
 
@@ -39,6 +39,7 @@ from nltools.tokenizer  import tokenize
 
 from speech_lexicon     import Lexicon
 from speech_transcripts import Transcripts
+from speech_tokenizer_cache import tokenize_cached
 
 from kaldiasr.nnet3     import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
 
@@ -68,6 +69,9 @@ parser.add_option ("-a", "--all", action="store_true", dest="do_all",
 parser.add_option ("-f", "--filter", dest="ts_filter", type = "str", 
                    help="filter (default: no filtering)")
 
+parser.add_option ("-j", "--journal", action="store_true", dest="journal", 
+                   help="commit ratings straight to the review journal (safe with parallel workers)")
+
 parser.add_option ("-l", "--lang", dest="lang", type = "str", default="de",
                    help="tokenizer language (default: de)")
 
@@ -116,6 +120,19 @@ else:
 
 wav16_dir   = config.get("speech", "wav16")
 
+def rate(utt_id, ts):
+
+    global num_journal
+
+    outf.write ('%s;%d\n' % (utt_id, options.rating))
+
+    if options.journal:
+        transcripts.journal(utt_id, quality=options.rating,
+                            ts=u' '.join(tokenize_cached(ts['prompt'], lang=options.lang, keep_punctuation=True)))
+        num_journal += 1
+        if num_journal % SAVE_RATE == 0:
+            transcripts.commit()
+
 #
 # load transcripts
 #
@@ -141,17 +158,15 @@ num_rated  = 0
 idx        = 0
 next_idx   = options.offset
 num_failed = 0
+num_journal = 0
 if not options.do_all:
     decoder   = KaldiNNet3OnlineDecoder (kaldi_model)
 
 with open (options.outfn, 'w') as outf:
 
-    for utt_id in transcripts:
-
-        ts = transcripts[utt_id]
+    for ts in transcripts.iter(quality=0):
 
-        if ts['quality'] != 0:
-            continue
+        utt_id = ts['cfn']
 
         if ts_filter and not (ts_filter in utt_id):
             continue
@@ -164,7 +179,7 @@ with open (options.outfn, 'w') as outf:
 
         wavfn = '%s/%s/%s.wav' % (wav16_dir, corpus, utt_id)
 
-        prompt = ' '.join(tokenize(ts['prompt'], lang=options.lang))
+        prompt = ' '.join(tokenize_cached(ts['prompt'], lang=options.lang))
 
         if not prompt:
             logging.info("%7d, # rated: %5d %-20s no prompt." % (idx, num_rated, utt_id))
@@ -174,7 +189,7 @@ with open (options.outfn, 'w') as outf:
 
             logging.info("%7d, # rated: %5d %-20s manual rating: %d" % (idx, num_rated, utt_id, options.rating))
     
-            outf.write ('%s;%d\n' % (utt_id, options.rating))
+            rate(utt_id, ts)
 
             num_rated += 1
     
@@ -190,7 +205,7 @@ with open (options.outfn, 'w') as outf:
 
                     if hyp == prompt:
                         logging.info("%7d, # rated: %5d %-20s *** MATCH ***" % (idx, num_rated, utt_id))
-                        outf.write ('%s;%d\n' % (utt_id, options.rating))
+                        rate(utt_id, ts)
                         outf.flush()
                         logging.debug ('    %s written.' % options.outfn)
                         num_rated += 1
@@ -208,6 +223,8 @@ with open (options.outfn, 'w') as outf:
                     faillog.write('%s\n' % wavfn)
                 num_failed += 1
 
+transcripts.commit()
+
 logging.info ("%s written." % options.outfn)
 
 if num_failed:
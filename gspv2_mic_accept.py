@@ -35,6 +35,7 @@ from nltools.phonetics      import ipa2xsampa
 
 from speech_lexicon         import Lexicon
 from speech_transcripts     import Transcripts
+from speech_tokenizer_cache import tokenize_cached
 
 APP_NAME            = 'gspv2_mic_accept'
 AUDIO_CORPUS        = 'gspv2'
@@ -74,11 +75,9 @@ logging.info ('loading transcripts from %s ... done.' % AUDIO_CORPUS)
 
 accept = set()
 mics = set (['Kinect-RAW', 'Realtek', 'Samson', 'Yamaha', 'Kinect-Beam'])
-for utt_id in transcripts:
+for data in transcripts.iter(min_quality=2):
 
-    data = transcripts[utt_id]
-    if data['quality'] < 2:
-        continue
+    utt_id = data['cfn']
 
     parts = utt_id.split('-')
 
@@ -100,11 +99,9 @@ for utt_id in transcripts:
 #
 
 cnt = 0
-for utt_id in transcripts:
+for data in transcripts.iter(quality=0):
 
-    data = transcripts[utt_id]
-    if data['quality'] != 0 :
-        continue
+    utt_id = data['cfn']
 
     parts = utt_id.split('-')
 
@@ -126,7 +123,7 @@ for utt_id in transcripts:
         logging.info('accepting utt #%5d : %s' % (cnt, utt_id))
 
         transcripts[utt_id]['quality'] = 2
-        transcripts[utt_id]['ts']      = u' '.join(tokenize(transcripts[utt_id]['prompt'], lang='de', keep_punctuation=True))
+        transcripts[utt_id]['ts']      = u' '.join(tokenize_cached(transcripts[utt_id]['prompt'], lang='de', keep_punctuation=True))
 
 logging.info("saving transcripts...")
 transcripts.save()
@@ -32,11 +32,16 @@ import re
 import logging
 import json
 
-from optparse import OptionParser
-from nltools  import misc
+from optparse             import OptionParser
+from nltools              import misc
+from speech_importer      import Importer, add_importer_options
+from speech_archive       import CorpusSource
+from speech_audio_norm    import norm_spec, SPEECH_COMPANDER
 
 PROC_TITLE        = 'ljspeech_to_vf'
-DEFAULT_NUM_CPUS  = 12
+
+# sox ... -r 16000 -b 16 -c 1 ... gain -n -1 compand 0.02,0.20 5:-60,-40,-10 -5 -90 0.1
+AUDIO_SPEC        = norm_spec(peak_db=-1.0, compand=SPEECH_COMPANDER)
 
 #
 # init
@@ -50,8 +55,7 @@ misc.init_app(PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options]")
 
-parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
-                   help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+add_importer_options(parser)
 
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
                    help="verbose output")
@@ -72,64 +76,41 @@ config = misc.load_config('.speechrc')
 speech_arc     = config.get("speech", "speech_arc")
 speech_corpora = config.get("speech", "speech_corpora")
 
-srcdir  = '%s/LJSpeech-1.1' % speech_arc
+source  = CorpusSource(speech_arc, 'LJSpeech-1.1')
 destdir = '%s/ljspeech' % speech_corpora
 
 #
 # audio, prompts
 #
 
-all_utts = set()
-
-cnt = 0
-with open('tmp/run_parallel.sh', 'w') as scriptf:
-
-    folder = 'lindajohnson-11'
-    dstdir = '%s/%s' % (destdir, folder)
-
-    misc.mkdirs('%s/wav' % dstdir)
-    misc.mkdirs('%s/etc' % dstdir)
-
-    promptsfn = '%s/etc/prompts-original' % dstdir
-    logging.debug ('dstdir: %s, promptsfn: %s' % (dstdir, promptsfn))
+importer = Importer(options, AUDIO_SPEC)
 
-    with codecs.open ('%s/metadata.csv' % srcdir, 'r', 'utf8') as metaf:
+folder = 'lindajohnson-11'
+dstdir = '%s/%s' % (destdir, folder)
 
-        with codecs.open (promptsfn, 'w', 'utf8') as promptsf:
+logging.debug ('dstdir: %s' % dstdir)
 
-            for line in metaf:
+def parse_metadata(relpath, data):
 
-                logging.debug(line)
+    utts = []
 
-                parts = line.strip().split('|')
-                if len(parts) != 3:
-                    logging.error('malformed line: %s' % line)
-                    continue
+    for line in data.decode('utf8').splitlines():
 
-                ts_orig = parts[2]
-                uttid = parts[0].replace('_','-').lower()
+        logging.debug(line)
 
-                if uttid in all_utts:
-                    logging.error('utterance id not unique:' % uttid)
-                    continue
-                all_utts.add(uttid)
+        parts = line.strip().split('|')
+        if len(parts) != 3:
+            logging.error('malformed line: %s' % line)
+            continue
 
-                wav_in = '%s/wavs/%s.wav' % (srcdir, parts[0])
+        ts_orig = parts[2]
+        uttid = parts[0].replace('_','-').lower()
 
-                wav_out = '%s/wav/%s.wav' % (dstdir, uttid)
+        utts.append(('wavs/%s.wav' % parts[0], dstdir, uttid, ts_orig))
 
-                cmd = 'sox %s -r 16000 -b 16 -c 1 %s gain -n -1 compand 0.02,0.20 5:-60,-40,-10 -5 -90 0.1 ' % (wav_in, wav_out)
-                logging.debug(cmd)
-                # os.system(cmd)
-                scriptf.write('echo %6d %s &\n' % (cnt, uttid))
-                scriptf.write('%s &\n' % cmd)
+    return utts
 
-                cnt += 1
-                if (cnt % options.num_cpus) == 0:
-                    scriptf.write('wait\n')
+importer.add_source(source, r'^metadata\.csv$', r'^wavs/[^/]+\.wav$', parse_metadata, num_metadata=1)
 
-                promptsf.write(u'%s %s\n' % (uttid, ts_orig))
+importer.close()
 
-cmd = "bash tmp/run_parallel.sh"
-print cmd
-# os.system(cmd)
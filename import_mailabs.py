@@ -32,13 +32,19 @@ import re
 import logging
 import json
 
-from optparse import OptionParser
-from nltools  import misc
+from optparse             import OptionParser
+from nltools              import misc
+from speech_importer      import Importer, add_importer_options
+from speech_archive       import CorpusSource, source_names
+from speech_audio_norm    import norm_spec, SPEECH_COMPANDER
 
 PROC_TITLE        = 'import_mailabs'
-DEFAULT_NUM_CPUS  = 12
 
-GENDERS           = set(['male', 'female'])
+METADATA_PATTERN  = r'^by_book/(male|female)/([^/]+)/([^/]+)/metadata_mls\.json$'
+AUDIO_PATTERN     = r'^by_book/(male|female)/([^/]+)/([^/]+)/wavs/[^/]+\.wav$'
+
+# sox ... -r 16000 -b 16 -c 1 ... gain -n -3 silence -l 0 -1 0.2 0.1% compand 0.02,0.20 5:-60,-40,-10 -5 -90 0.1
+AUDIO_SPEC        = norm_spec(peak_db=-3.0, silence=(0.2, 0.001), compand=SPEECH_COMPANDER)
 
 #
 # init
@@ -52,8 +58,7 @@ misc.init_app(PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options]")
 
-parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
-                   help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+add_importer_options(parser)
 
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
                    help="verbose output")
@@ -80,79 +85,40 @@ srcdir  = '%s/m_ailabs' % speech_arc
 # audio, prompts
 #
 
-all_utts = set()
-
-cnt = 0
-with open('tmp/run_parallel.sh', 'w') as scriptf:
-
-    for localedir in os.listdir(srcdir):
-
-        if not os.path.isdir('%s/%s' % (srcdir, localedir)):
-            continue
-
-        destdir = '%s/m_ailabs_%s' % (speech_corpora, localedir[:2])
-
-        for gender in os.listdir('%s/%s/by_book' % (srcdir, localedir)):
+importer = Importer(options, AUDIO_SPEC)
 
-            if not gender in GENDERS:
-                continue
+def parse_metadata(metafn, data):
 
-            if not os.path.isdir('%s/%s/by_book/%s' % (srcdir, localedir, gender)):
-                continue
+    gender, speaker, book = re.match(METADATA_PATTERN, metafn).groups()
 
-            for speaker in os.listdir('%s/%s/by_book/%s' % (srcdir, localedir, gender)):
-                
-                for book in os.listdir('%s/%s/by_book/%s/%s' % (srcdir, localedir, gender, speaker)):
-                    
-                    if not os.path.isdir('%s/%s/by_book/%s/%s/%s' % (srcdir, localedir, gender, speaker, book)):
-                        continue
+    meta = json.loads(data.decode('utf8'))
 
-                    metafn = '%s/%s/by_book/%s/%s/%s/metadata_mls.json' % (srcdir, localedir, gender, speaker, book)
-                    if not os.path.exists(metafn):
-                        continue
+    logging.debug('localedir: %s, gender: %6s, speaker: %16s, book: %s' % (localedir, gender, speaker, book))
 
-                    with codecs.open(metafn, 'r', 'utf8') as metaf:
-                        meta = json.loads(metaf.read())
+    folder = 'mailabs%s-%s' % (speaker.replace('_','').replace('-',''), book.replace('_','-'))
+    dstdir = '%s/%s' % (destdir, folder)
 
-                    logging.debug('localedir: %s, gender: %6s, speaker: %16s, book: %s' % (localedir, gender, speaker, book))
+    logging.debug ('dstdir: %s' % dstdir)
 
-                    folder = 'mailabs%s-%s' % (speaker.replace('_','').replace('-',''), book.replace('_','-'))
-                    dstdir = '%s/%s' % (destdir, folder)
-                
-                    misc.mkdirs('%s/wav' % dstdir)
-                    misc.mkdirs('%s/etc' % dstdir)
+    utts = []
 
-                    promptsfn = '%s/etc/prompts-original' % dstdir
-                    logging.debug ('dstdir: %s, promptsfn: %s' % (dstdir, promptsfn))
+    for wavfn in meta:
 
-                    with codecs.open (promptsfn, 'w', 'utf8') as promptsf:
-                        for wavfn in meta:
+        ts_orig = meta[wavfn]['clean']
+        uttid = os.path.splitext(wavfn.replace('_','-'))[0]
 
-                            ts_orig = meta[wavfn]['clean']
-                            uttid = os.path.splitext(wavfn.replace('_','-'))[0]
+        utts.append(('by_book/%s/%s/%s/wavs/%s' % (gender, speaker, book, wavfn), dstdir, uttid, ts_orig))
 
-                            if uttid in all_utts:
-                                logging.error('utterance id not unique:' % uttid)
-                                continue
-                            all_utts.add(uttid)
+    return utts
 
-                            wav_in = '%s/%s/by_book/%s/%s/%s/wavs/%s' % (srcdir, localedir, gender, speaker, book, wavfn)
+# one locale per directory or archive (de_DE.tgz, ...)
 
-                            wav_out = '%s/wav/%s.wav' % (dstdir, uttid)
+for localedir in source_names(srcdir):
 
-                            cmd = 'sox %s -r 16000 -b 16 -c 1 %s gain -n -3 silence -l 0 -1 0.2 0.1%% compand 0.02,0.20 5:-60,-40,-10 -5 -90 0.1 ' % (wav_in, wav_out)
-                            logging.debug(cmd)
-                            # os.system(cmd)
-                            scriptf.write('echo %6d %s &\n' % (cnt, uttid))
-                            scriptf.write('%s &\n' % cmd)
-            
-                            cnt += 1
-                            if (cnt % options.num_cpus) == 0:
-                                scriptf.write('wait\n')
+    source  = CorpusSource(srcdir, localedir)
+    destdir = '%s/m_ailabs_%s' % (speech_corpora, localedir[:2])
 
-                            promptsf.write(u'%s %s\n' % (uttid, ts_orig))
+    importer.add_source(source, METADATA_PATTERN, AUDIO_PATTERN, parse_metadata)
 
+importer.close()
 
-cmd = "bash tmp/run_parallel.sh"
-print cmd
-# os.system(cmd)
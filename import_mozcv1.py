@@ -29,9 +29,11 @@ import csv
 
 from optparse               import OptionParser
 from nltools                import misc
+from speech_importer        import Importer, add_importer_options
+from speech_archive         import CorpusSource
+from speech_audio_norm      import BACKEND_FFMPEG, BACKEND_SOX
 
 PROC_TITLE        = 'moz_cv1_to_vf'
-DEFAULT_NUM_CPUS  = 12
 
 #
 # init terminal
@@ -45,8 +47,7 @@ misc.init_app (PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options]")
 
-parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
-                   help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+add_importer_options(parser, backends=[BACKEND_FFMPEG, BACKEND_SOX])
 
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose", 
                    help="enable debug output")
@@ -71,39 +72,30 @@ speech_corpora = config.get("speech", "speech_corpora")
 # (since we have no speaker information)
 #
 
-cnt = 0
-with open('tmp/run_parallel.sh', 'w') as scriptf:
-    for csvfn in ['cv-valid-test.csv', 'cv-valid-train.csv', 'cv-valid-dev.csv']:
-        with codecs.open('%s/cv_corpus_v1/%s' % (speech_arc, csvfn), 'r', 'utf8') as csvfile:
-            r = csv.reader(csvfile, delimiter=',', quotechar='|')
-            first = True
-            for row in r:
-                if first:
-                    first = False
-                    continue
-                print ', '.join(row)
-             
-                uttid = wavfn = row[0].replace('/', '_').replace('.mp3', '').replace('-', '_')
-                spk = uttid
-
-                misc.mkdirs('%s/cv_corpus_v1/%s-v1/etc' % (speech_corpora, spk))
-                misc.mkdirs('%s/cv_corpus_v1/%s-v1/wav' % (speech_corpora, spk))
-
-                with codecs.open ('%s/cv_corpus_v1/%s-v1/etc/prompts-original' % (speech_corpora, spk), 'a', 'utf8') as promptsf:
-                    promptsf.write('%s %s\n' % (uttid, row[1]))
-
-                wavfn = '%s/cv_corpus_v1/%s-v1/wav/%s.wav' % (speech_corpora, spk, uttid)
-                cmd = 'ffmpeg -i %s/cv_corpus_v1/%s %s' % (speech_arc, row[0], wavfn)
-                print cnt, wavfn
-                scriptf.write('echo %6d %s &\n' % (cnt, wavfn))
-                scriptf.write('%s &\n' % cmd)
-
-                cnt += 1
-                if (cnt % options.num_cpus) == 0:
-                    scriptf.write('wait\n')
-
-cmd = "bash tmp/run_parallel.sh"
-print cmd
-# os.system(cmd)
+importer = Importer(options)
+source   = CorpusSource(speech_arc, 'cv_corpus_v1')
+
+def parse_csv(csvfn, data):
+
+    utts  = []
+    r     = csv.reader(data.splitlines(), delimiter=',', quotechar='|')
+    first = True
+    for row in r:
+        if first:
+            first = False
+            continue
+        row = [ col.decode('utf8') for col in row ]
+        logging.debug(', '.join(row))
+
+        uttid = row[0].replace('/', '_').replace('.mp3', '').replace('-', '_')
+        spk = uttid
+
+        utts.append((row[0], '%s/cv_corpus_v1/%s-v1' % (speech_corpora, spk), uttid, row[1]))
+
+    return utts
+
+importer.add_source(source, r'^cv-valid-(test|train|dev)\.csv$', r'^cv-valid-(test|train|dev)/[^/]+\.mp3$', parse_csv, num_metadata=3)
+
+importer.close()
 
 
@@ -29,9 +29,11 @@ import csv
 
 from optparse               import OptionParser
 from nltools                import misc
+from speech_importer        import Importer, add_importer_options
+from speech_archive         import CorpusSource
+from speech_audio_norm      import BACKEND_FFMPEG, BACKEND_SOX
 
 PROC_TITLE        = 'moz_de_to_vf'
-DEFAULT_NUM_CPUS  = 12
 
 #
 # init terminal
@@ -45,8 +47,7 @@ misc.init_app (PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options]")
 
-parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
-                   help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+add_importer_options(parser, backends=[BACKEND_FFMPEG, BACKEND_SOX])
 
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose", 
                    help="enable debug output")
@@ -71,45 +72,30 @@ speech_corpora = config.get("speech", "speech_corpora")
 # (since we have no speaker information)
 #
 
-uttids = set()
-
-cnt = 0
-with open('tmp/run_parallel.sh', 'w') as scriptf:
-    with codecs.open('%s/cv_de/validated.tsv' % speech_arc, 'r', 'utf8') as csvfile:
-        r = csv.reader(csvfile, delimiter='\t', quotechar='|')
-        first = True
-        for row in r:
-            if first:
-                first = False
-                continue
-            # print ', '.join(row)
-         
-            uttid = row[1].replace('.mp3', '')[:12]
-            spk = uttid
-
-            if uttid in uttids:
-                logging.error('uttid %s ist not unique!' % uttid)
-                continue
-            uttids.add(uttid)
-
-            misc.mkdirs('%s/cv_de/%s-de/etc' % (speech_corpora, spk))
-            misc.mkdirs('%s/cv_de/%s-de/wav' % (speech_corpora, spk))
-
-            with codecs.open ('%s/cv_de/%s-de/etc/prompts-original' % (speech_corpora, spk), 'a', 'utf8') as promptsf:
-                promptsf.write('%s %s\n' % (uttid, row[2]))
-
-            wavfn = '%s/cv_de/%s-de/wav/%s.wav' % (speech_corpora, spk, uttid)
-            cmd = 'ffmpeg -i %s/cv_de/clips/%s.mp3 %s' % (speech_arc, row[1], wavfn)
-            logging.info('%6d %s' % (cnt, wavfn))
-            scriptf.write('echo %6d %s &\n' % (cnt, wavfn))
-            scriptf.write('%s &\n' % cmd)
-
-            cnt += 1
-            if (cnt % options.num_cpus) == 0:
-                scriptf.write('wait\n')
-
-cmd = "bash tmp/run_parallel.sh"
-print cmd
-# os.system(cmd)
+importer = Importer(options)
+source   = CorpusSource(speech_arc, 'cv_de')
+
+def parse_tsv(tsvfn, data):
+
+    utts  = []
+    r     = csv.reader(data.splitlines(), delimiter='\t', quotechar='|')
+    first = True
+    for row in r:
+        if first:
+            first = False
+            continue
+        row = [ col.decode('utf8') for col in row ]
+        # print ', '.join(row)
+
+        uttid = row[1].replace('.mp3', '')[:12]
+        spk = uttid
+
+        utts.append(('clips/%s.mp3' % row[1], '%s/cv_de/%s-de' % (speech_corpora, spk), uttid, row[2]))
+
+    return utts
+
+importer.add_source(source, r'^validated\.tsv$', r'^clips/[^/]+\.mp3$', parse_tsv, num_metadata=1)
+
+importer.close()
 
 
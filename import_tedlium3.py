@@ -18,19 +18,160 @@
 #
 # convert TED-LIUM v3 to voxforge-style packages
 #
+# Each talk's .sph is decoded by sph2pipe exactly once into a temporary wav
+# which is mmap'ed, all segments of the talk are then cut from that mapping
+# without copying the samples. Talks are converted in parallel, prompts are
+# collected up front and written once per speaker.
+#
+# TEDLIUM_release-3 can also be read straight from its archive (see
+# speech_archive.py): the .sph of a talk is then spooled to a temporary file
+# just until the talk has been converted. This takes two passes over the
+# archive, one for the stm transcripts and one for the talks: a talk can only
+# be cut once its transcript is known, and should data/sph come before
+# data/stm in the archive, a single pass would have to spool all talks (some
+# 50GB) to disk first. Decompressing the archive twice is the lesser cost.
+#
 
 import sys
 import os
+import mmap
+import wave
+import shutil
+import struct
 import codecs
-import traceback
 import logging
-import csv
+import tempfile
+import threading
+import subprocess
+import multiprocessing
 
 from optparse               import OptionParser
 from nltools                import misc
+from speech_importer        import DEFAULT_NUM_CPUS
+from speech_archive         import CorpusSource
 
 PROC_TITLE        = 'import_tedlium3'
 
+def wav_data(f):
+
+    """(nchannels, sampwidth, framerate, data offset, data length) of RIFF wav file f"""
+
+    riff, size, wave_id = struct.unpack('<4sI4s', f.read(12))
+    if riff != 'RIFF' or wave_id != 'WAVE':
+        raise wave.Error('not a RIFF/WAVE file')
+
+    fmt = None
+    while True:
+
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            raise wave.Error('no data chunk')
+        chunk_id, chunk_size = struct.unpack('<4sI', hdr)
+
+        if chunk_id == 'fmt ':
+            fmt = struct.unpack('<HHIIHH', f.read(16))
+            f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == 'data':
+            if not fmt:
+                raise wave.Error('data chunk before fmt chunk')
+            offset = f.tell()
+            break
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    tag, nchannels, framerate, byterate, blockalign, bits = fmt
+    if tag != 1:
+        raise wave.Error('unsupported format tag %d' % tag)
+
+    # sph2pipe writing to a pipe cannot fill in the size, so trust the file size
+    length = os.fstat(f.fileno()).st_size - offset
+    if chunk_size and chunk_size < length:
+        length = chunk_size
+
+    return nchannels, bits / 8, framerate, offset, length
+
+def convert_talk(job):
+
+    """
+    decode sphfn once, cut all segments [(wavfn, tstart, tend)] from it.
+    Runs in a pool worker, returns (sphfn, number of segments, seconds of audio, error)
+    """
+
+    sphfn, segments, remove_sph = job
+
+    fd, tmpfn = tempfile.mkstemp(suffix='.wav', prefix='tedlium3_')
+    os.close(fd)
+
+    try:
+        subprocess.check_call(['sph2pipe', '-f', 'rif', sphfn, tmpfn])
+
+        with open(tmpfn, 'rb') as f:
+
+            nchannels, sampwidth, framerate, offset, length = wav_data(f)
+
+            framesize = nchannels * sampwidth
+            nframes   = length / framesize
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                secs = 0.0
+                for wavfn, tstart, tend in segments:
+
+                    fstart = min(int(round(tstart * framerate)), nframes)
+                    fend   = min(int(round(tend   * framerate)), nframes)
+                    n      = max(fend - fstart, 0)
+
+                    wavf = wave.open(wavfn, 'wb')
+                    wavf.setparams((nchannels, sampwidth, framerate, n, 'NONE', 'not compressed'))
+                    wavf.writeframesraw(buffer(mm, offset + fstart * framesize, n * framesize))
+                    wavf.close()
+
+                    secs += float(n) / float(framerate)
+            finally:
+                mm.close()
+
+    except Exception as e:
+        return sphfn, 0, 0.0, '%s' % e
+
+    finally:
+        os.unlink(tmpfn)
+        if remove_sph:
+            os.unlink(sphfn)
+
+    return sphfn, len(segments), secs, None
+
+def parse_stm(lines):
+
+    """(speaker, tstart, tend, transcript) of all segments in stm lines"""
+
+    segments = []
+
+    for line in lines:
+        parts = line.strip().split(' ')
+
+        speaker = parts[2].replace('_','-')
+        tstart  = float(parts[3])
+        tend    = float(parts[4])
+
+        ts = u''
+        for lex in parts[6:]:
+            if u'<unk>' in lex:
+                continue
+            if lex.startswith(u"'"):
+                ts = ts + lex
+                continue
+            if ts:
+                ts = ts + u' ' + lex
+            else:
+                ts = lex
+
+        logging.debug(u'%s %f %f %s' % (speaker, tstart, tend, ts))
+
+        segments.append((speaker, tstart, tend, ts))
+
+    return segments
+
 #
 # init terminal
 #
@@ -43,6 +184,9 @@ misc.init_app (PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options]")
 
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                   help="number of talks to convert in parallel, default: %d" % DEFAULT_NUM_CPUS)
+
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose", 
                    help="enable debug output")
 
@@ -74,50 +218,103 @@ logging.info(cmd)
 os.system(cmd)
 
 #
-# create wav files
+# read all transcripts, assign utterance ids
 #
 
-tedlium_dir = '%s/TEDLIUM_release-3' % speech_arc
+source = CorpusSource(speech_arc, 'TEDLIUM_release-3')
+stms   = source.find(r'^data/stm/[^/]+\.stm$')
 
-ddict = {}
-
-for stmfn in os.listdir('%s/data/stm' % tedlium_dir):
-
-    for line in codecs.open('%s/data/stm/%s' % (tedlium_dir, stmfn), 'r', 'utf8'):
-        parts = line.strip().split(' ')
+prompts = {} # speakerdir -> [(audiobn, ts)]
+jobs    = {} # sph relpath -> segments
 
-        speaker = parts[2].replace('_','-')
-        tstart  = float(parts[3])
-        tend    = float(parts[4])
+for stmfn in sorted(stms):
 
-        ts = u''
-        for lex in parts[6:]:
-            if u'<unk>' in lex:
-                continue
-            if lex.startswith(u"'"):
-                ts = ts + lex
-                continue
-            if ts:
-                ts = ts + u' ' + lex
-            else:
-                ts = lex
+    segments = []
 
-        print speaker, tstart, tend, ts
+    for speaker, tstart, tend, ts in parse_stm(stms[stmfn].decode('utf8').splitlines()):
 
         speakerdir = '%s/%s-1' % (dest_dir, speaker)
 
-        if not (speaker in ddict):
-            ddict[speaker] = 0
+        if not (speakerdir in prompts):
+            prompts[speakerdir] = []
             misc.mkdirs('%s/etc' % speakerdir)
             misc.mkdirs('%s/wav' % speakerdir)
-        
-        audiobn = '%09d' % ddict[speaker]
-        ddict[speaker] += 1
 
-        with codecs.open('%s/etc/prompts-original' % speakerdir, 'a', 'utf8') as promptsfn:
-            promptsfn.write(u'%s %s\n' % (audiobn, ts))
+        audiobn = '%09d' % len(prompts[speakerdir])
+        prompts[speakerdir].append((audiobn, ts))
+
+        segments.append(('%s/wav/%s.wav' % (speakerdir, audiobn), tstart, tend))
+
+    jobs['data/sph/%s' % os.path.basename(stmfn).replace('.stm','.sph')] = segments
+
+logging.info('%d talks, %d segments, %d speakers.' % (len(jobs), sum([ len(s) for s in jobs.values() ]), len(prompts)))
+
+#
+# write prompts, once per speaker
+#
+
+for speakerdir in prompts:
+    with codecs.open('%s/etc/prompts-original' % speakerdir, 'w', 'utf8') as promptsf:
+        for audiobn, ts in prompts[speakerdir]:
+            promptsf.write(u'%s %s\n' % (audiobn, ts))
+
+#
+# create wav files. Unpacked: longest talks first so the pool does not end
+# waiting for one, archive: in stream order, spooling at most a few talks ahead
+#
+
+pending  = threading.BoundedSemaphore(options.num_cpus * 2)
+spooldir = tempfile.mkdtemp(prefix='tedlium3_') if source.archive else None
+
+def talk_jobs():
+
+    if not source.archive:
+        for relpath in sorted(jobs, key=lambda relpath: -len(jobs[relpath])):
+            yield '%s/%s' % (source.path, relpath), jobs[relpath], False
+        return
+
+    for relpath, f in source.members(jobs):
+
+        pending.acquire()
+
+        spoolfn = '%s/%s' % (spooldir, os.path.basename(relpath))
+        with open(spoolfn, 'wb') as spoolf:
+            shutil.copyfileobj(f, spoolf)
+
+        yield spoolfn, jobs[relpath], True
+
+pool = multiprocessing.Pool(options.num_cpus)
+
+cnt    = 0
+secs   = 0.0
+failed = []
+
+for sphfn, nsegs, talk_secs, error in pool.imap_unordered(convert_talk, talk_jobs()):
+
+    cnt += 1
+    if source.archive:
+        pending.release()
+
+    if error:
+        logging.error('%s: %s' % (sphfn, error))
+        failed.append(sphfn)
+        continue
+
+    secs += talk_secs
+    logging.info('%4d/%4d %s: %d segments, %.1fs of audio' % (cnt, len(jobs), sphfn, nsegs, talk_secs))
+
+pool.close()
+pool.join()
+
+if spooldir:
+    shutil.rmtree(spooldir)
+
+logging.info('%.1f hours of audio converted.' % (secs / 3600.0))
+
+if cnt < len(jobs):
+    logging.error('%d talks not found in %s' % (len(jobs) - cnt, source.archive))
+
+if failed:
+    logging.error('%d talks failed: %s' % (len(failed), ', '.join(failed)))
+    sys.exit(1)
 
-        cmd = 'sph2pipe -t %f:%f %s/data/sph/%s %s/wav/%s.wav' % (tstart, tend, tedlium_dir, stmfn.replace('.stm','.sph'), speakerdir, audiobn)
-        logging.info(cmd)
-        os.system(cmd)
-        
@@ -29,9 +29,8 @@ import logging
 import readline
 
 from nltools.tts            import TTS
-from nltools.sequiturclient import sequitur_gen_ipa
 from nltools.phonetics      import ipa2xsampa, xsampa2ipa
-from seqif                  import SeqIf
+from speech_g2p             import g2p_ipa
 
 SEQUITUR_MODEL    = 'data/models/sequitur-dict-de.ipa-latest'
 
@@ -47,11 +46,6 @@ class LexEdit(object):
 
         self.tts = TTS ('local', 0, locale='de', voice='bits3', engine='espeak')
 
-        #
-        # sequitur interface
-        #
-
-        self.si = SeqIf(SEQUITUR_MODEL)
 
     def lex_gen_ipa (self, lex_base, locale, engine, voice, speak=False):
 
@@ -59,8 +53,7 @@ class LexEdit(object):
         try:
 
             if engine == 'sequitur':
-                # ipas = sequitur_gen_ipa (SEQUITUR_MODEL, lex_base)
-                ipas = self.si.g2p(lex_base)
+                ipas = g2p_ipa (SEQUITUR_MODEL, lex_base)
             
             else:
                 self.tts.locale = locale
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# read speech corpora from <speech_arc> either unpacked or straight from
+# their .tar.gz / .tar.bz2 / .zip archives
+#
+# A CorpusSource refers to files by their path relative to the corpus root,
+# the same paths work for both layouts. audio() goes over the corpus once:
+# metadata files (transcripts, prompts) are handed to a parser which tells
+# which audio files they refer to, those audio files are then handed out
+# for conversion. Archives are read strictly sequentially (tar streams cannot
+# seek), so each member is decompressed exactly once. Audio which is stored
+# ahead of the metadata referring to it has to be spooled to disk until that
+# metadata shows up: the scratch space needed depends on the archive's member
+# order, from nothing (metadata first) up to MAX_SPOOL. Beyond that, audio is
+# dropped and read in a second pass once all metadata is known. Callers that
+# know how many metadata files there are say so, audio coming after the last
+# of them is then never spooled.
+#
+
+import os
+import re
+import shutil
+import tarfile
+import zipfile
+import logging
+
+ARCHIVE_EXTS = ['.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar', '.zip']
+MAX_SPOOL    = 2 * 1024 * 1024 * 1024 # bytes of audio spooled ahead of its metadata at most
+
+def split_archive_ext(fn):
+
+    """(name, ext) of archive fn, ext is None for unsupported files"""
+
+    for ext in ARCHIVE_EXTS:
+        if fn.endswith(ext):
+            return fn[:-len(ext)], ext
+
+    return fn, None
+
+def find_archive(path):
+
+    """archive file for unpacked corpus dir path, None if there is none"""
+
+    for ext in ARCHIVE_EXTS:
+        if os.path.isfile(path + ext):
+            return path + ext
+
+    return None
+
+def source_names(dirfn):
+
+    """names of all corpora in dirfn, unpacked dirs take precedence over archives"""
+
+    names = set()
+
+    for fn in os.listdir(dirfn):
+
+        if os.path.isdir('%s/%s' % (dirfn, fn)):
+            names.add(fn)
+            continue
+
+        name, ext = split_archive_ext(fn)
+        if ext:
+            names.add(name)
+
+    return sorted(names)
+
+def archive_members(arcfn):
+
+    """(name, file object) of all regular files in arcfn, in stream order"""
+
+    if arcfn.endswith('.zip'):
+
+        with zipfile.ZipFile(arcfn) as zf:
+
+            infos = [ info for info in zf.infolist() if not info.filename.endswith('/') ]
+            infos.sort(key=lambda info: info.header_offset)
+
+            for info in infos:
+                f = zf.open(info)
+                yield info.filename, f
+                f.close()
+
+    else:
+
+        tf = tarfile.open(arcfn, 'r|*')
+        try:
+            for ti in tf:
+                if not ti.isfile():
+                    continue
+                yield ti.name, tf.extractfile(ti)
+        finally:
+            tf.close()
+
+class CorpusSource(object):
+
+    def __init__(self, speech_arc, name):
+
+        """<speech_arc>/<name> if it is a directory, <speech_arc>/<name>.tar.gz etc. otherwise"""
+
+        self.name    = name
+        self.path    = '%s/%s' % (speech_arc, name)
+        self.archive = None
+
+        if not os.path.isdir(self.path):
+            self.archive = find_archive(self.path)
+            if not self.archive:
+                raise IOError('%s: neither a directory nor an archive (%s) found' % (self.path, ', '.join(ARCHIVE_EXTS)))
+
+            logging.info('%s: reading from archive %s' % (name, self.archive))
+
+    def _relpath(self, member):
+
+        # members are stored either with or without the corpus dir as prefix
+
+        if member.startswith('./'):
+            member = member[2:]
+        if member.startswith(self.name + '/'):
+            member = member[len(self.name)+1:]
+
+        return member
+
+    def _members(self):
+
+        for member, f in archive_members(self.archive):
+            yield self._relpath(member), f
+
+    def find(self, pattern):
+
+        """contents of all files whose relpath matches regex pattern, dict relpath -> data"""
+
+        regex = re.compile(pattern)
+        res   = {}
+
+        if not self.archive:
+
+            for dirpath, dirnames, filenames in os.walk(self.path):
+                for fn in filenames:
+                    relpath = os.path.relpath('%s/%s' % (dirpath, fn), self.path)
+                    if regex.match(relpath):
+                        with open('%s/%s' % (dirpath, fn), 'rb') as f:
+                            res[relpath] = f.read()
+
+            return res
+
+        for relpath, f in self._members():
+            if regex.match(relpath):
+                res[relpath] = f.read()
+
+        return res
+
+    def members(self, relpaths):
+
+        """
+        (relpath, file object or file name) for each of relpaths that exists.
+        Unpacked corpora yield file names in the order given, archives yield
+        file objects in stream order which are only valid until the next
+        member is requested.
+        """
+
+        if not self.archive:
+            for relpath in relpaths:
+                fn = '%s/%s' % (self.path, relpath)
+                if os.path.exists(fn):
+                    yield relpath, fn
+            return
+
+        wanted = set(relpaths)
+        for relpath, f in self._members():
+
+            if not relpath in wanted:
+                continue
+
+            yield relpath, f
+
+            wanted.remove(relpath)
+            if not wanted:
+                break
+
+    def _unspool(self, spooled):
+
+        # audio no metadata referred to
+
+        for spoolfn in spooled.values():
+            os.unlink(spoolfn)
+        if spooled:
+            logging.info ('%s: %d audio files without metadata skipped.' % (self.name, len(spooled)))
+        spooled.clear()
+
+    def audio(self, metadata_pattern, audio_pattern, parse, spooldir, num_metadata=None, max_spool=MAX_SPOOL):
+
+        """
+        single pass over the corpus: each metadata file (relpath matching regex
+        metadata_pattern) is handed to parse(relpath, data), which returns the
+        relpaths of the audio files it refers to. Yields (relpath, src, spooled)
+        for each of those audio files which exists. src is a file name or, for
+        archive members, a file object valid until the next item. Audio members
+        (matching audio_pattern) stored before the metadata referring to them
+        are spooled to spooldir meanwhile, these come as file names with
+        spooled set and have to be removed by the caller.
+
+        num_metadata: number of metadata files to expect if known. Once all of
+        them have been parsed, no more audio is spooled and the rest of the
+        archive is only read as far as referred audio is still missing.
+        max_spool: spool at most that many bytes. Audio which did not fit is
+        read in a second pass over the archive after all metadata is known.
+        """
+
+        if not self.archive:
+
+            # no need to stream: read all metadata first
+
+            metas = self.find(metadata_pattern)
+            for metafn in sorted(metas):
+                for relpath in parse(metafn, metas[metafn]):
+                    fn = '%s/%s' % (self.path, relpath)
+                    if os.path.exists(fn):
+                        yield relpath, fn, False
+            return
+
+        metadata_regex = re.compile(metadata_pattern)
+        audio_regex    = re.compile(audio_pattern)
+
+        wanted     = set() # referred to by metadata, not seen yet
+        spooled    = {}    # seen before their metadata: relpath -> spool file
+        cnt        = 0
+        num_parsed = 0
+        spool_size = 0
+        overflow   = False # max_spool reached, audio has been dropped
+
+        try:
+            for relpath, f in self._members():
+
+                if metadata_regex.match(relpath):
+
+                    num_parsed += 1
+
+                    for audio_relpath in parse(relpath, f.read()):
+                        if audio_relpath in spooled:
+                            yield audio_relpath, spooled.pop(audio_relpath), True
+                        else:
+                            wanted.add(audio_relpath)
+
+                    if num_parsed == num_metadata:
+                        self._unspool(spooled)
+                        if not wanted:
+                            break
+
+                elif relpath in wanted:
+
+                    wanted.remove(relpath)
+                    yield relpath, f, False
+
+                    if num_parsed == num_metadata and not wanted:
+                        break
+
+                elif audio_regex.match(relpath) and num_parsed != num_metadata and not overflow:
+
+                    cnt += 1
+                    spoolfn = '%s/%d_%s' % (spooldir, cnt, os.path.basename(relpath))
+                    with open(spoolfn, 'wb') as spoolf:
+                        shutil.copyfileobj(f, spoolf)
+
+                    spool_size += os.path.getsize(spoolfn)
+                    if spool_size > max_spool:
+                        logging.info ('%s: more than %d bytes of audio ahead of its metadata, will read the archive twice.' % (self.name, max_spool))
+                        os.unlink(spoolfn)
+                        overflow = True
+                    else:
+                        spooled[relpath] = spoolfn
+
+        finally:
+            self._unspool(spooled)
+
+        # second pass for the audio dropped when the spool was full
+
+        if overflow and wanted:
+            for relpath, f in self.members(wanted):
+                yield relpath, f, False
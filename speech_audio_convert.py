@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# parallel conversion of audio files to 16kHz mono 16 bit wav
+#
+# AudioConverter runs conversions (sox or numpy, see speech_audio_norm.py) on
+# a process pool. submit() blocks once max_pending conversions are queued, so
+# scanning a huge corpus does not pile up jobs. Idle workers pick up the next
+# file right away, failed conversions can be retried. With skip_valid, files
+# whose output already is a complete wav are skipped, so interrupted runs can
+# simply be restarted. Each file is converted to a temporary name and renamed
+# when done, failures are collected (with the error message) instead of being
+# silently ignored. Sources submitted with remove_src (e.g. audio spooled
+# from an archive) are deleted once they have been converted.
+#
+
+import os
+import time
+import wave
+import logging
+import threading
+import multiprocessing
+
+from collections        import namedtuple
+
+from speech_transcripts import DEFAULT_NUM_CPUS
+from speech_audio_norm  import normalize_file, valid_wav, DEFAULT_SPEC, BACKEND_SOX
+
+STATS_INTERVAL = 500
+
+ConversionResult = namedtuple('ConversionResult', 'srcfn dstfn duration error skipped')
+
+def _duration(wavfn):
+
+    wavef    = wave.open(wavfn, 'rb')
+    duration = float(wavef.getnframes()) / float(wavef.getframerate())
+    wavef.close()
+
+    return duration
+
+def _convert(job):
+
+    # process pool worker, never raises: errors are reported in the result
+
+    srcfn, dstfn, spec, backend, retries, skip_valid, remove_src = job
+
+    try:
+        if skip_valid and valid_wav(dstfn, spec.rate):
+            return ConversionResult(srcfn, dstfn, _duration(dstfn), None, True)
+
+        base, ext = os.path.splitext(dstfn)
+        tmpfn     = '%s.%d.tmp%s' % (base, os.getpid(), ext)
+
+        for attempt in range(retries + 1):
+
+            try:
+                normalize_file(srcfn, tmpfn, spec, backend)
+                duration = _duration(tmpfn)
+                os.rename(tmpfn, dstfn)
+
+            except Exception as e:
+                if os.path.exists(tmpfn):
+                    os.unlink(tmpfn)
+                error = str(e) if not attempt else '%s (%d attempts)' % (e, attempt + 1)
+                continue
+
+            return ConversionResult(srcfn, dstfn, duration, None, False)
+
+        return ConversionResult(srcfn, dstfn, 0.0, error, False)
+
+    except Exception as e:
+        # anything unexpected (e.g. on the skip path) still has to produce a
+        # result, otherwise the callback would never release the semaphore
+        return ConversionResult(srcfn, dstfn, 0.0, '%s' % e, False)
+
+    finally:
+        if remove_src and os.path.exists(srcfn):
+            os.unlink(srcfn)
+
+class AudioConverter(object):
+
+    def __init__(self, num_cpus=DEFAULT_NUM_CPUS, max_pending=0, spec=DEFAULT_SPEC, backend=BACKEND_SOX,
+                 retries=0, skip_valid=False):
+
+        self.num_cpus   = num_cpus
+        self.spec       = spec
+        self.backend    = backend
+        self.retries    = retries
+        self.skip_valid = skip_valid
+        self.pool       = multiprocessing.Pool(num_cpus)
+        self.pending    = threading.BoundedSemaphore(max_pending if max_pending else num_cpus * 4)
+        self.lock       = threading.Lock()
+
+        self.failed     = []
+        self.cnt        = 0
+        self.skipped    = 0
+        self.audio_secs = 0.0
+        self.time_start = time.time()
+
+    def submit(self, srcfn, dstfn, spec=None, remove_src=False):
+
+        """
+        queue conversion of srcfn to dstfn, blocks while too many are pending.
+        remove_src: delete srcfn when done
+        """
+
+        self.pending.acquire()
+        job = (srcfn, dstfn, spec if spec else self.spec, self.backend, self.retries, self.skip_valid, remove_src)
+        self.pool.apply_async(_convert, (job,), callback=self._done)
+
+    def skip(self, srcfn, dstfn):
+
+        """count dstfn as converted by a previous run, without queueing it"""
+
+        self.pending.acquire()
+        self._done(ConversionResult(srcfn, dstfn, 0.0, None, True))
+
+    def _done(self, res):
+
+        # runs in the pool's result handler thread
+
+        with self.lock:
+
+            self.cnt += 1
+
+            if res.error:
+                logging.error ('%s: conversion failed: %s' % (res.srcfn, res.error))
+                self.failed.append(res)
+            elif res.skipped:
+                self.skipped += 1
+            else:
+                logging.debug ('%s => %s (%.1fs)' % (res.srcfn, res.dstfn, res.duration))
+                self.audio_secs += res.duration
+
+            if self.cnt % STATS_INTERVAL == 0:
+                logging.info ('converted %s' % self.stats())
+
+        self.pending.release()
+
+    def stats(self):
+
+        secs = time.time() - self.time_start
+        if secs <= 0.0:
+            secs = 1e-6
+
+        done = self.cnt - self.skipped
+
+        return '%d files (%d failed, %d done before), %.1f hours of audio: %.1f files/s, %.4f audio hours/s' % (
+               self.cnt, len(self.failed), self.skipped, self.audio_secs / 3600.0, done / secs, self.audio_secs / 3600.0 / secs)
+
+    def close(self):
+
+        """wait for all pending conversions, returns the failed ones"""
+
+        self.pool.close()
+        self.pool.join()
+
+        if self.cnt:
+            logging.info ('converted %s' % self.stats())
+
+        return self.failed
+
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# per-corpus audio metadata index
+#
+# keeps size, mtime, number of frames and sample rate of every wav file of a
+# corpus in data/src/speech/<corpus>/audio_meta.csv so tools can get
+# durations etc. without opening the audio files. update() only probes
+# files not indexed yet and otherwise trusts the index as long as the mtime
+# of the wav directory (which changes whenever a file is added, removed or
+# replaced via rename, as the converters do) is the one recorded in the
+# index. Only then, or when asked to refresh, indexed files are stat'ed and
+# re-read if their size or mtime changed, in parallel.
+#
+
+import os
+import wave
+import codecs
+import logging
+import multiprocessing
+
+from collections        import namedtuple
+
+from nltools            import misc
+from speech_transcripts import TSDIR, DEFAULT_NUM_CPUS
+
+AUDIO_META = TSDIR + '/audio_meta.csv'
+CHUNKSIZE  = 256
+
+class AudioInfo(namedtuple('AudioInfo', 'size mtime num_frames sample_rate')):
+
+    __slots__ = ()
+
+    @property
+    def duration(self):
+        return float(self.num_frames) / float(self.sample_rate)
+
+def _probe(job):
+
+    # process pool worker: returns None if the file is missing, the known
+    # AudioInfo if size and mtime did not change, a fresh one otherwise
+
+    utt_id, wavfn, known = job
+
+    try:
+        st = os.stat(wavfn)
+    except OSError:
+        return utt_id, None
+
+    if known and (known.size == st.st_size) and (known.mtime == st.st_mtime):
+        return utt_id, known
+
+    try:
+        wavef = wave.open(wavfn, 'rb')
+        info  = AudioInfo(st.st_size, st.st_mtime, wavef.getnframes(), wavef.getframerate())
+        wavef.close()
+    except (wave.Error, EOFError, IOError) as e:
+        logging.error('%s: failed to read wav header: %s' % (wavfn, e))
+        return utt_id, None
+
+    return utt_id, info
+
+class AudioMetaIndex(object):
+
+    def __init__(self, corpus_name, wav_dir):
+
+        """
+        corpus_name: determines where the index is stored
+        wav_dir    : directory containing the <utt_id>.wav files
+        """
+
+        self.corpus_name = corpus_name
+        self.wav_dir     = wav_dir
+        self.fn          = AUDIO_META % corpus_name
+        self.meta        = {}
+        self.dir_mtime   = None # mtime of wav_dir when the index was last checked
+
+        if os.path.exists(self.fn):
+            with codecs.open(self.fn, 'r', 'utf8') as f:
+                for line in f:
+                    parts = line.rstrip().split(';')
+                    if parts[0] == '#wav_dir' and len(parts) == 2:
+                        self.dir_mtime = float(parts[1])
+                        continue
+                    if len(parts) != 5:
+                        continue
+                    self.meta[parts[0]] = AudioInfo(int(parts[1]), float(parts[2]), int(parts[3]), int(parts[4]))
+
+    def wavfn(self, utt_id):
+        return '%s/%s.wav' % (self.wav_dir, utt_id)
+
+    def update(self, utt_ids, num_cpus=DEFAULT_NUM_CPUS, refresh=False):
+
+        """
+        make sure the index covers utt_ids. Files not indexed yet are probed,
+        indexed ones are only checked (and re-probed if their size or mtime
+        changed) if the wav directory changed or refresh is set. Missing files
+        are dropped from the index.
+        """
+
+        try:
+            dir_mtime = os.stat(self.wav_dir).st_mtime
+        except OSError:
+            dir_mtime = None
+
+        # files added, removed or replaced since the last check: check all
+        # indexed files, not just utt_ids
+
+        if dir_mtime != self.dir_mtime:
+            if self.meta:
+                logging.info ('%s: %s changed, checking all indexed files.' % (self.corpus_name, self.wav_dir))
+            utt_ids = set(utt_ids) | set(self.meta)
+            refresh = True
+
+        jobs = []
+        for utt_id in utt_ids:
+            known = self.meta.get(utt_id)
+            if known and not refresh:
+                continue
+            jobs.append((utt_id, self.wavfn(utt_id), known))
+
+        if not jobs:
+            return
+
+        logging.info ('%s: checking audio metadata of %d files...' % (self.corpus_name, len(jobs)))
+
+        num_cpus = min(num_cpus, multiprocessing.cpu_count())
+
+        if num_cpus > 1 and len(jobs) > CHUNKSIZE:
+            pool = multiprocessing.Pool(num_cpus)
+            try:
+                results = pool.imap_unordered(_probe, jobs, CHUNKSIZE)
+                changed = self._apply(results)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            changed = self._apply(map(_probe, jobs))
+
+        logging.info ('%s: checking audio metadata of %d files... done, %d changed.' % (self.corpus_name, len(jobs), changed))
+
+        if changed or (dir_mtime != self.dir_mtime):
+            self.dir_mtime = dir_mtime
+            self.save()
+
+    def _apply(self, results):
+
+        changed = 0
+        for utt_id, info in results:
+            known = self.meta.get(utt_id)
+            if info == known:
+                continue
+            if info is None:
+                del self.meta[utt_id]
+            else:
+                self.meta[utt_id] = info
+            changed += 1
+
+        return changed
+
+    def save(self):
+
+        misc.mkdirs(os.path.dirname(self.fn))
+
+        tmpfn = '%s.tmp' % self.fn
+        with codecs.open(tmpfn, 'w', 'utf8') as f:
+            if self.dir_mtime is not None:
+                f.write(u'#wav_dir;%r\n' % self.dir_mtime)
+            for utt_id in sorted(self.meta):
+                info = self.meta[utt_id]
+                f.write(u'%s;%d;%r;%d;%d\n' % (utt_id, info.size, info.mtime, info.num_frames, info.sample_rate))
+        os.rename(tmpfn, self.fn)
+
+        logging.debug ('%s written, %d entries.' % (self.fn, len(self.meta)))
+
+    def __len__(self):
+        return len(self.meta)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.meta
+
+    def __getitem__(self, utt_id):
+        return self.meta[utt_id]
+
+    def get(self, utt_id, default=None):
+        return self.meta.get(utt_id, default)
+
+    def duration(self, utt_id):
+        return self.meta[utt_id].duration
+
+    def durations(self):
+        return dict([ (utt_id, self.meta[utt_id].duration) for utt_id in self.meta ])
+
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# audio format normalization: 16kHz mono int16 plus optional peak/rms gain,
+# silence squeezing and compander
+#
+# A NormSpec describes the processing, normalize_file() runs it either through
+# sox (BACKEND_SOX, one process per file) or in-process using numpy
+# (BACKEND_NUMPY), BACKEND_FFMPEG only converts the format (used for mp3
+# input). The numpy implementations are close to, but not sample
+# exact with sox: resampling is polyphase with a kaiser windowed sinc, the
+# compander follows the envelope on 1ms frames. Inputs the wave module cannot
+# read (flac, float wavs, ...) are handed to sox either way.
+#
+
+import os
+import wave
+import logging
+import subprocess
+
+from collections import namedtuple
+from fractions   import gcd
+
+# numpy is only needed for BACKEND_NUMPY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BACKEND_SOX   = 'sox'
+BACKEND_NUMPY = 'numpy'
+BACKEND_FFMPEG = 'ffmpeg'
+BACKENDS      = [BACKEND_SOX, BACKEND_NUMPY]
+
+DEFAULT_RATE  = 16000
+
+RESAMPLE_BLOCK = 8192  # output samples per polyphase block
+COMPAND_FRAME  = 0.001 # envelope follower resolution in seconds
+
+class Compander(namedtuple('Compander', 'attack decay knee_db points gain_db initial_db delay')):
+
+    """
+    same parameters as sox's compand effect, points are (in_db, out_db)
+    pairs of the transfer function
+    """
+
+    __slots__ = ()
+
+    def sox_args(self):
+
+        points = ','.join([ '%g,%g' % p for p in self.points ])
+
+        return ['compand', '%g,%g' % (self.attack, self.decay), '%g:%s' % (self.knee_db, points),
+                '%g' % self.gain_db, '%g' % self.initial_db, '%g' % self.delay]
+
+# sox compand 0.02,0.20 5:-60,-40,-10 -5 -90 0.1 (a single leading in-dB value
+# means out-dB = in-dB)
+
+SPEECH_COMPANDER = Compander(0.02, 0.20, 5.0, [(-60.0, -60.0), (-40.0, -10.0)], -5.0, -90.0, 0.1)
+
+class NormSpec(namedtuple('NormSpec', 'rate peak_db rms_db silence compand')):
+
+    """
+    rate   : output sample rate
+    peak_db: normalize peak level to this (dBFS), None: off
+    rms_db : normalize rms level to this (dBFS), None: off
+    silence: (secs, threshold) shorten silent stretches (below threshold,
+             fraction of full scale) to secs, None: off
+    compand: Compander, None: off
+    """
+
+    __slots__ = ()
+
+    def sox_format(self):
+        return ['-r', str(self.rate), '-b', '16', '-c', '1']
+
+    def sox_effects(self):
+
+        args = []
+
+        if self.peak_db is not None:
+            args.extend(['gain', '-n', '%g' % self.peak_db])
+        if self.silence:
+            args.extend(['silence', '-l', '0', '-1', '%g' % self.silence[0], '%g%%' % (self.silence[1] * 100.0)])
+        if self.compand:
+            args.extend(self.compand.sox_args())
+
+        return args
+
+def norm_spec(rate=DEFAULT_RATE, peak_db=None, rms_db=None, silence=None, compand=None):
+    return NormSpec(rate, peak_db, rms_db, silence, compand)
+
+DEFAULT_SPEC = norm_spec()
+
+#
+# numpy implementation
+#
+
+def read_wav(fn):
+
+    """samples as float32 array (frames x channels) in [-1, 1), sample rate"""
+
+    wavf = wave.open(fn, 'rb')
+    try:
+        nchannels = wavf.getnchannels()
+        width     = wavf.getsampwidth()
+        rate      = wavf.getframerate()
+        data      = wavf.readframes(wavf.getnframes())
+    finally:
+        wavf.close()
+
+    if width == 1:
+        x = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        x = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        x = ((b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)).astype(np.float32) / 2147483648.0
+    elif width == 4:
+        x = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise wave.Error('%s: unsupported sample width %d' % (fn, width))
+
+    return x.reshape(-1, nchannels), rate
+
+def write_wav(fn, x, rate):
+
+    """write mono float samples as 16 bit wav, clipping at full scale"""
+
+    samples = np.clip(np.round(x * 32768.0), -32768, 32767).astype('<i2')
+
+    wavf = wave.open(fn, 'wb')
+    try:
+        wavf.setnchannels(1)
+        wavf.setsampwidth(2)
+        wavf.setframerate(rate)
+        wavf.writeframes(samples.tostring())
+    finally:
+        wavf.close()
+
+def downmix(x):
+    return x.mean(axis=1) if x.ndim > 1 else x
+
+_filters = {}
+
+def _lowpass(up, down):
+
+    # kaiser windowed sinc, cutoff at the lower of both nyquist frequencies,
+    # split into up polyphase components of equal length
+
+    if not (up, down) in _filters:
+
+        m        = max(up, down)
+        half_len = 10 * m
+        n        = np.arange(-half_len, half_len + 1, dtype=np.float64)
+
+        h = np.sinc(n / m) * np.kaiser(2 * half_len + 1, 5.0) * up / m
+
+        # pad so every phase has the same number of taps
+        taps = (len(h) + up - 1) // up
+        hp   = np.zeros(taps * up)
+        hp[:len(h)] = h
+
+        _filters[(up, down)] = (hp.reshape(taps, up).T.astype(np.float32), half_len)
+
+    return _filters[(up, down)]
+
+def resample(x, rate_in, rate_out):
+
+    """polyphase resampling of mono x from rate_in to rate_out"""
+
+    if rate_in == rate_out:
+        return x
+
+    g    = gcd(rate_in, rate_out)
+    up   = rate_out // g
+    down = rate_in  // g
+
+    phases, delay = _lowpass(up, down)
+    taps = phases.shape[1]
+
+    n_out = (len(x) * up + down - 1) // down
+    xp    = np.concatenate([np.zeros(taps, dtype=np.float32), x, np.zeros(taps, dtype=np.float32)])
+    k     = np.arange(taps)
+    y     = np.empty(n_out, dtype=np.float32)
+
+    # output n sits at n * down + delay on the upsampled time axis, its phase
+    # selects the filter taps, its quotient the newest input sample involved
+
+    for start in range(0, n_out, RESAMPLE_BLOCK):
+
+        t = np.arange(start, min(start + RESAMPLE_BLOCK, n_out)) * down + delay
+        q = t // up
+        p = t % up
+
+        idx = (q[:, None] - k[None, :]) + taps
+        np.clip(idx, 0, len(xp) - 1, out=idx)
+
+        y[start:start + len(t)] = (xp[idx] * phases[p]).sum(axis=1)
+
+    return y
+
+def _db2amp(db):
+    return 10.0 ** (db / 20.0)
+
+def normalize_peak(x, db):
+
+    peak = np.abs(x).max() if len(x) else 0.0
+    return x * (_db2amp(db) / peak) if peak > 0.0 else x
+
+def normalize_rms(x, db):
+
+    rms = np.sqrt(np.mean(np.square(x, dtype=np.float64))) if len(x) else 0.0
+    return x * (_db2amp(db) / rms) if rms > 0.0 else x
+
+def squeeze_silence(x, rate, secs, threshold):
+
+    """shorten stretches below threshold which are longer than secs to secs"""
+
+    keep  = int(secs * rate)
+    quiet = np.abs(x) < threshold
+
+    # start/end of each quiet run
+    edges  = np.diff(np.concatenate([[False], quiet, [False]]).astype(np.int8))
+    starts = np.nonzero(edges == 1)[0]
+    ends   = np.nonzero(edges == -1)[0]
+
+    long_runs = (ends - starts) > keep
+    if not long_runs.any():
+        return x
+
+    mask = np.ones(len(x), dtype=bool)
+    for s, e in zip(starts[long_runs] + keep, ends[long_runs]):
+        mask[s:e] = False
+
+    return x[mask]
+
+def compand(x, rate, c):
+
+    """simple compander with sox compand semantics, see Compander"""
+
+    if not len(x):
+        return x
+
+    frame   = max(1, int(rate * COMPAND_FRAME))
+    nframes = (len(x) + frame - 1) // frame
+
+    padded = np.zeros(nframes * frame, dtype=np.float32)
+    padded[:len(x)] = np.abs(x)
+    levels = padded.reshape(nframes, frame).max(axis=1)
+
+    # envelope follower, attack when the level rises, decay when it falls
+
+    a_att = 1.0 - np.exp(-COMPAND_FRAME / c.attack) if c.attack > 0 else 1.0
+    a_dec = 1.0 - np.exp(-COMPAND_FRAME / c.decay)  if c.decay  > 0 else 1.0
+
+    env = np.empty(nframes)
+    e   = _db2amp(c.initial_db)
+    for i, l in enumerate(levels.tolist()):
+        e += (l - e) * (a_att if l > e else a_dec)
+        env[i] = e
+
+    # transfer function on dB levels: like sox it ends in (0, 0), below the
+    # first point the slope is 1
+
+    points = list(c.points)
+    if points[-1][0] < 0.0:
+        points.append((0.0, 0.0))
+
+    in_db  = 20.0 * np.log10(np.maximum(env, 1e-10))
+    pts_in = np.array([ p[0] for p in points ])
+    pts_d  = np.array([ p[1] - p[0] for p in points ])
+    gain   = np.interp(in_db, pts_in, pts_d) + c.gain_db
+
+    # delay: the gain reacts to what is coming up
+
+    shift = int(round(c.delay / COMPAND_FRAME))
+    if shift:
+        gain = np.concatenate([gain[shift:], np.repeat(gain[-1:], min(shift, nframes))])[:nframes]
+
+    centers = (np.arange(nframes) + 0.5) * frame
+    g       = np.interp(np.arange(len(x)), centers, gain)
+
+    return x * (10.0 ** (g / 20.0)).astype(np.float32)
+
+def normalize(x, rate, spec):
+
+    """apply spec to float samples x (frames x channels), returns mono samples at spec.rate"""
+
+    x = resample(downmix(x), rate, spec.rate)
+
+    if spec.peak_db is not None:
+        x = normalize_peak(x, spec.peak_db)
+    if spec.rms_db is not None:
+        x = normalize_rms(x, spec.rms_db)
+    if spec.silence:
+        x = squeeze_silence(x, spec.rate, spec.silence[0], spec.silence[1])
+    if spec.compand:
+        x = compand(x, spec.rate, spec.compand)
+
+    return x
+
+#
+# file level
+#
+
+def sox_cmd(srcfn, dstfn, spec=DEFAULT_SPEC):
+    return ['sox', srcfn] + spec.sox_format() + [dstfn] + spec.sox_effects()
+
+def _run(cmd):
+
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    if p.returncode:
+        raise Exception ('%s failed (%d): %s' % (cmd[0], p.returncode, err.strip()))
+
+def _normalize_ffmpeg(srcfn, dstfn, spec):
+
+    if spec.sox_effects() or spec.rms_db is not None:
+        raise Exception ('ffmpeg backend does not support effects')
+
+    _run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', srcfn,
+          '-ar', str(spec.rate), '-ac', '1', '-acodec', 'pcm_s16le', dstfn])
+
+def valid_wav(fn, rate=DEFAULT_RATE):
+
+    """True if fn is a complete 16 bit mono wav at rate"""
+
+    try:
+        wavf = wave.open(fn, 'rb')
+        try:
+            ok = (wavf.getnchannels() == 1) and (wavf.getsampwidth() == 2) and (wavf.getframerate() == rate) \
+                 and (wavf.getnframes() > 0)
+            if ok:
+                # truncated files (e.g. from an interrupted sox) lack the last frame
+                wavf.setpos(wavf.getnframes() - 1)
+                ok = len(wavf.readframes(1)) == 2
+        finally:
+            wavf.close()
+    except (wave.Error, EOFError, IOError):
+        return False
+
+    return ok
+
+def normalize_file(srcfn, dstfn, spec=DEFAULT_SPEC, backend=BACKEND_SOX):
+
+    """convert srcfn to a 16 bit mono wav at dstfn according to spec"""
+
+    if backend == BACKEND_FFMPEG:
+        _normalize_ffmpeg(srcfn, dstfn, spec)
+        return
+
+    if backend == BACKEND_NUMPY and np is None:
+        raise Exception ('numpy backend requested but numpy is not installed')
+
+    if backend == BACKEND_NUMPY and srcfn.lower().endswith('.wav'):
+        try:
+            x, rate = read_wav(srcfn)
+        except (wave.Error, EOFError) as e:
+            logging.debug ('%s: %s, using sox' % (srcfn, e))
+        else:
+            write_wav(dstfn, normalize(x, rate, spec), spec.rate)
+            return
+
+    _run(sox_cmd(srcfn, dstfn, spec))
+
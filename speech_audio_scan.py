@@ -30,17 +30,138 @@
 # 2. the transcripts in data/src/speech/<speech_corpus>/transcripts_*.csv are
 #    updated.
 #
+# conversions run in parallel, see speech_audio_convert.py
+#
+# speaker directories are only scanned if they changed since the last run,
+# see ScanManifest below. The whole manifest is dropped when the corpus's
+# transcripts or its wav16 directory changed behind our back, use -f to scan
+# everything regardless.
+#
 
 import os
 import sys
+import codecs
+import hashlib
 import logging
 
-from nltools            import misc
-from speech_transcripts import Transcripts
-from optparse           import OptionParser
+from nltools              import misc
+from speech_transcripts   import Transcripts, TSDIR, DEFAULT_NUM_CPUS
+from speech_audio_convert import AudioConverter
+from speech_audio_norm    import BACKENDS, BACKEND_SOX
+from optparse             import OptionParser
 
 PROC_TITLE = 'speech_audio_scan'
 
+SCAN_MANIFEST = TSDIR + '/scan_manifest.csv'
+
+def scan_context(corpus_name, out_wav16_subdir):
+
+    """
+    fingerprint of what the manifest relies on besides the audio dirs: the
+    transcripts shards and the wav16 output directory
+    """
+
+    m     = hashlib.md5()
+    tsdir = TSDIR % corpus_name
+
+    if os.path.isdir(tsdir):
+        for tsfn in sorted(os.listdir(tsdir)):
+            if tsfn.startswith('transcripts') and tsfn.endswith('.csv'):
+                st = os.stat('%s/%s' % (tsdir, tsfn))
+                m.update('%s;%d;%r\n' % (tsfn, st.st_size, st.st_mtime))
+
+    m.update('wav16;%r\n' % _mtime(out_wav16_subdir))
+
+    return m.hexdigest()
+
+def _mtime(fn):
+    try:
+        return os.stat(fn).st_mtime
+    except OSError:
+        return -1.0
+
+def _dir_stat(subdirfn):
+
+    # adding or removing files changes the mtime of the directory containing them
+
+    return '%r,%r,%r,%r' % (_mtime(subdirfn), _mtime('%s/wav' % subdirfn), _mtime('%s/flac' % subdirfn),
+                            _mtime('%s/etc/prompts-original' % subdirfn))
+
+def _dir_listing(subdirfn):
+
+    listing = []
+    for audiodir in ['wav', 'flac']:
+        audiodirfn = '%s/%s' % (subdirfn, audiodir)
+        if os.path.isdir(audiodirfn):
+            listing.extend([ '%s/%s' % (audiodir, fn) for fn in os.listdir(audiodirfn) ])
+
+    return sorted(listing)
+
+def _read_prompts(subdirfn):
+
+    promptsfn = '%s/etc/prompts-original' % subdirfn
+    if not os.path.isfile(promptsfn):
+        return ''
+
+    with open(promptsfn) as promptsf:
+        return promptsf.read()
+
+class ScanManifest(object):
+
+    """
+    per speaker directory: mtimes of the directory, its wav/flac dirs and
+    prompts file plus md5s of the audio file listing and of the prompts. A
+    directory whose mtimes did not change is skipped without looking inside,
+    if only the mtimes changed the hashes are compared. All entries are
+    ignored if context (see scan_context()) differs from the one saved.
+    """
+
+    def __init__(self, corpus_name, context):
+
+        self.fn      = SCAN_MANIFEST % corpus_name
+        self.context = context
+        self.entries = {} # subdir -> (stat, listing md5, prompts md5)
+
+        if not os.path.exists(self.fn):
+            return
+
+        with codecs.open(self.fn, 'r', 'utf8') as f:
+
+            if f.readline().rstrip() != u'#context;%s' % context:
+                logging.info ('%s: transcripts or wav16 dir changed, scanning all directories.' % self.fn)
+                return
+
+            for line in f:
+                parts = line.rstrip().split(';')
+                if len(parts) != 4:
+                    continue
+                self.entries[parts[0]] = tuple(parts[1:])
+
+    def get(self, subdir):
+        return self.entries.get(subdir)
+
+    def __setitem__(self, subdir, entry):
+        self.entries[subdir] = entry
+
+    def discard(self, subdir):
+        self.entries.pop(subdir, None)
+
+    def clear(self):
+        self.entries = {}
+
+    def save(self):
+
+        misc.mkdirs(os.path.dirname(self.fn))
+
+        tmpfn = '%s.tmp' % self.fn
+        with codecs.open(tmpfn, 'w', 'utf8') as f:
+            f.write(u'#context;%s\n' % self.context)
+            for subdir in sorted(self.entries):
+                f.write(u'%s;%s;%s;%s\n' % ((subdir,) + self.entries[subdir]))
+        os.rename(tmpfn, self.fn)
+
+        logging.debug ('%s written, %d entries.' % (self.fn, len(self.entries)))
+
 def exit_if_corpus_is_missing(speech_corpora_dir, speech_corpora):
 
     missing_directories = []
@@ -58,10 +179,18 @@ def exit_if_corpus_is_missing(speech_corpora_dir, speech_corpora):
         sys.exit(1)
 
 
-def scan_audiodir(audiodir, transcripts, out_wav16_subdir):
+def scan_audiodir(audiodir, transcripts, out_wav16_subdir, converter, manifest=None):
+
+    """
+    scan speaker directories of audiodir for new audio, skipping the ones
+    manifest (optional) says did not change. Returns the set of scanned
+    subdirs.
+    """
 
     # keep track of all cfns we have audio files for
     cfn_audio = set()
+    unchanged = set()
+    scanned   = set()
 
     for subdir in os.listdir(audiodir):
 
@@ -69,35 +198,52 @@ def scan_audiodir(audiodir, transcripts, out_wav16_subdir):
             logging.warn('skipping %s as it does not match our naming scheme' % subdir)
             continue
 
-        logging.debug ("scanning %s in %s" % (subdir, audiodir))
-
         subdirfn  = '%s/%s'   % (audiodir, subdir)
         wavdirfn  = '%s/wav'  % subdirfn
         flacdirfn = '%s/flac' % subdirfn
 
+        known = manifest.get(subdir) if manifest else None
+        stat  = _dir_stat(subdirfn)
+
+        if known and known[0] == stat:
+            unchanged.add(subdir)
+            continue
+
+        listing     = _dir_listing(subdirfn)
+        promptsdata = _read_prompts(subdirfn)
+        entry       = (stat,
+                       hashlib.md5('\n'.join(listing)).hexdigest(),
+                       hashlib.md5(promptsdata).hexdigest())
+
+        if manifest:
+            manifest[subdir] = entry
+
+        if known and known[1:] == entry[1:]:
+            unchanged.add(subdir)
+            continue
+
+        logging.debug ("scanning %s in %s" % (subdir, audiodir))
+        scanned.add(subdir)
+
         # do we have prompts?
 
         prompts = {}
 
-        promptsfn = '%s/etc/prompts-original' % subdirfn
-        if os.path.isfile(promptsfn):
-            with open(promptsfn) as promptsf:
-                while True:
-                    line = promptsf.readline().decode('utf8', errors='ignore')
-                    if not line:
-                        break
+        lines = promptsdata.split('\n')
+        if lines and not lines[-1]:
+            lines.pop()
 
-                    line = line.rstrip()
-                    if '\t' in line:
-                        afn = line.split('\t')[0]
-                        ts = line[len(afn)+1:]
-                    else:
-                        afn = line.split(' ')[0]
-                        ts = line[len(afn)+1:]
+        for line in lines:
 
-                    prompts[afn] = ts.replace(';',',')
+            line = line.decode('utf8', errors='ignore').rstrip()
+            if '\t' in line:
+                afn = line.split('\t')[0]
+                ts = line[len(afn)+1:]
+            else:
+                afn = line.split(' ')[0]
+                ts = line[len(afn)+1:]
 
-            # print repr(prompts)
+            prompts[afn] = ts.replace(';',',')
 
         for audiodirfn in [wavdirfn, flacdirfn]:
 
@@ -129,19 +275,23 @@ def scan_audiodir(audiodir, transcripts, out_wav16_subdir):
 
                     transcripts[cfn] = v
 
-                audio_convert (cfn, subdir, audiofn, audiodir, out_wav16_subdir)
+                audio_convert (converter, cfn, subdir, audiofn, audiodir, out_wav16_subdir)
 
-    # report missing audio files
+    if unchanged:
+        logging.info ('%s: %d speaker directories unchanged, %d scanned.' % (audiodir, len(unchanged), len(scanned)))
+
+    # report missing audio files (unchanged directories have been checked before)
     for cfn in sorted(transcripts):
-        if cfn in cfn_audio:
+        if cfn in cfn_audio or transcripts[cfn]['dirfn'] in unchanged:
             continue
         logging.warn('audio file missing for %s' % cfn)
 
+    return scanned
+
 
-def audio_convert(cfn, subdir, fn, audiodir, wav16_dir):
-    # global mfcc_dir
+def audio_convert(converter, cfn, subdir, fn, audiodir, wav16_dir):
 
-    # convert audio if not done yet
+    # queue conversion of audio if not done yet
 
     w16filename = "%s/%s.wav" % (wav16_dir, cfn)
 
@@ -154,21 +304,17 @@ def audio_convert(cfn, subdir, fn, audiodir, wav16_dir):
             flacfilename = "%s/%s/flac/%s.flac" % (audiodir, subdir, fn)
 
             if not os.path.isfile(flacfilename):
-                print "   WAV file '%s' does not exist, neither does FLAC file '%s' => skipping submission." % (
-                wavfilename, flacfilename)
+                logging.warn("   WAV file '%s' does not exist, neither does FLAC file '%s' => skipping submission." % (
+                             wavfilename, flacfilename))
                 return False
 
-            print "%-20s: converting %s => %s (16kHz mono)" % (
-            cfn, flacfilename, w16filename)
-            os.system(
-                "sox '%s' -r 16000 -b 16 -c 1 %s" % (flacfilename, w16filename))
+            logging.debug("%-20s: converting %s => %s (16kHz mono)" % (cfn, flacfilename, w16filename))
+            converter.submit(flacfilename, w16filename)
 
         else:
 
-            print "%-20s: converting %s => %s (16kHz mono)" % (
-            cfn, wavfilename, w16filename)
-            os.system(
-                "sox '%s' -r 16000 -b 16 -c 1 %s" % (wavfilename, w16filename))
+            logging.debug("%-20s: converting %s => %s (16kHz mono)" % (cfn, wavfilename, w16filename))
+            converter.submit(wavfilename, w16filename)
 
     return True
 
@@ -203,6 +349,12 @@ if __name__ == "__main__":
 
     parser = OptionParser("usage: %%prog [options] <speech_corpora>\n  speech_corpora: one or more of %s" % ", ".join(speech_corpora_available))
 
+    parser.add_option ("-b", "--backend", dest="backend", type="choice", choices=BACKENDS, default=BACKEND_SOX,
+                       help="audio conversion backend (%s), default: %s" % (', '.join(BACKENDS), BACKEND_SOX))
+    parser.add_option ("-f", "--full", action="store_true", dest="full",
+                       help="scan all speaker directories, not just the ones changed since the last scan")
+    parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                       help="number of parallel audio conversions, default: %d" % DEFAULT_NUM_CPUS)
     parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
                        help="verbose output")
 
@@ -225,10 +377,27 @@ if __name__ == "__main__":
         misc.mkdirs(out_wav16_subdir)
         in_root_corpus_dir = '%s/%s' % (speech_corpora_dir, speech_corpus)
 
-        scan_audiodir(str(in_root_corpus_dir), transcripts, str(out_wav16_subdir))
+        converter = AudioConverter(options.num_cpus, backend=options.backend)
+        manifest  = ScanManifest(speech_corpus, scan_context(speech_corpus, out_wav16_subdir))
+
+        if options.full:
+            manifest.clear()
+
+        scan_audiodir(str(in_root_corpus_dir), transcripts, str(out_wav16_subdir), converter, manifest)
+
+        failed = converter.close()
+        if failed:
+            logging.error('%s: %d audio conversions failed:' % (speech_corpus, len(failed)))
+            for res in failed:
+                logging.error('    %s: %s' % (res.srcfn, res.error))
+                # <subdir>/{wav,flac}/<audiofn>: rescan next time
+                manifest.discard(os.path.basename(os.path.dirname(os.path.dirname(res.srcfn))))
 
         transcripts.save()
 
+        manifest.context = scan_context(speech_corpus, out_wav16_subdir)
+        manifest.save()
+
         print speech_corpus, "new transcripts saved."
         print
 
@@ -34,6 +34,7 @@ from nltools                import misc
 from nltools.tokenizer      import tokenize
 
 from speech_transcripts     import Transcripts
+from speech_audio_meta      import AudioMetaIndex
 
 WORKDIR             = 'data/dst/speech/%s/deepspeech'
 PROMPT_AUDIO_FACTOR = 1000
@@ -81,9 +82,13 @@ wav16_dir   = config.get("speech", "wav16_dir_%s" % options.lang)
 logging.info ( "loading transcripts...")
 transcripts = Transcripts(corpus_name=options.lang)
 logging.info ( "loading transcripts...done. %d transcripts." % len(transcripts))
+
+audio_meta = AudioMetaIndex(options.lang, wav16_dir)
+audio_meta.update(transcripts.keys())
+
 logging.info ("splitting transcripts...")
-ts_all, ts_train, ts_test = transcripts.split()
-logging.info ("splitting transcripts done, %d train, %d test." % (len(ts_train), len(ts_test)))
+ts_all, ts_train, ts_test = transcripts.split(durations=audio_meta.durations())
+logging.info ("splitting transcripts done, %s." % transcripts.format_split_stats())
 
 #
 # create work_dir 
@@ -113,10 +118,16 @@ def export_ds(ds, csv_fn):
         for cfn in ds:
             ts = ds[cfn]
 
-            wavfn  = '%s/%s.wav' % (wav16_dir, cfn)
-            wavlen = os.path.getsize(wavfn)
+            wavfn  = audio_meta.wavfn(cfn)
+            info   = audio_meta.get(cfn)
             prompt = ts['ts']
 
+            if not info:
+                logging.warn('Skipping %s (wav file missing)' % cfn)
+                continue
+
+            wavlen = info.size
+
             if (len(prompt)*PROMPT_AUDIO_FACTOR) > wavlen:
                 logging.warn('Skipping %s (wav (%d bytes) too short for prompt (%d chars)' % (cfn, wavlen, len(prompt)))
                 continue
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# single pass dictionary export
+#
+# export_dict() walks a lexicon once and hands every token along with all its
+# pronunciation variants to a set of format writers (kaldi, wav2letter,
+# sequitur, eSpeak). Writer outputs are cached keyed on the lexicon contents,
+# the word filter and the writer's parameters, so re-exporting an unchanged
+# lexicon only copies files.
+#
+
+import os
+import shutil
+import codecs
+import hashlib
+import logging
+import subprocess
+
+from nltools            import misc
+from nltools.phonetics  import ipa2xsampa, espeak2ipa, ipa2espeak
+
+from speech_lexicon     import xsampa, phonetics_version
+
+EXPORT_CACHE_DIR = 'data/dst/cache/dict_export'
+
+def split_hash(word):
+
+    """deterministic pseudo-random number in [0, 1) for word, used for train/test splits"""
+
+    return int(hashlib.md5(word.encode('utf8')).hexdigest()[:8], 16) / float(1 << 32)
+
+class DictWriter(object):
+
+    """
+    base class for export formats: write(token, forms) is called once per
+    exported token in sorted order, forms maps each pronunciation variant
+    (token, token_2, ...) to its ipa.
+    """
+
+    def signature(self):
+        """everything besides the lexicon the output depends on, None: do not cache"""
+        return (self.__class__.__name__,)
+
+    def outputs(self):
+        return []
+
+    def open(self):
+        pass
+
+    def write(self, token, forms):
+        pass
+
+    def close(self):
+        pass
+
+class KaldiDictWriter(DictWriter):
+
+    """lexicon.txt, nonsilence/silence/optional_silence phones, extra_questions.txt"""
+
+    def __init__(self, dict_dir):
+        self.dict_dir = dict_dir
+
+    def outputs(self):
+        return [ '%s/%s' % (self.dict_dir, fn) for fn in ['lexicon.txt', 'nonsilence_phones.txt', 'silence_phones.txt',
+                                                          'optional_silence.txt', 'extra_questions.txt'] ]
+
+    def open(self):
+        misc.mkdirs(self.dict_dir)
+        self.ps    = {}
+        self.dictf = codecs.open('%s/lexicon.txt' % self.dict_dir, 'w', 'utf8')
+        self.dictf.write(u'!SIL SIL\n')
+
+    def write(self, token, forms):
+
+        for form in forms:
+
+            ipa = forms[form]
+            xs  = xsampa(token, ipa)
+
+            self.dictf.write(u'%s %s\n' % (token, xs))
+
+            for p in xs.split(' '):
+
+                if len(p) < 1:
+                    logging.error(
+                        u"****ERROR: empty phoneme in : '%s' (ipa: '%s', token: '%s')" % (
+                        xs, ipa, token))
+                    continue
+
+                pws = p[1:] if p[0] == '\'' else p
+
+                if not pws in self.ps:
+                    self.ps[pws] = {p}
+                else:
+                    self.ps[pws].add(p)
+
+    def close(self):
+
+        self.dictf.close()
+
+        with codecs.open('%s/nonsilence_phones.txt' % self.dict_dir, 'w', 'utf8') as psf:
+            for pws in sorted(self.ps):
+                for p in sorted(self.ps[pws]):
+                    psf.write(u'%s ' % p)
+                psf.write(u'\n')
+
+        with codecs.open('%s/silence_phones.txt' % self.dict_dir, 'w', 'utf8') as psf:
+            psf.write(u'SIL\nSPN\nNSN\n')
+
+        with codecs.open('%s/optional_silence.txt' % self.dict_dir, 'w', 'utf8') as psf:
+            psf.write(u'SIL\n')
+
+        with codecs.open('%s/extra_questions.txt' % self.dict_dir, 'w', 'utf8') as psf:
+
+            psf.write(u'SIL SPN NSN\n')
+
+            for stressed in (False, True):
+                for pws in sorted(self.ps):
+                    for p in sorted(self.ps[pws]):
+                        if ('\'' in p) == stressed:
+                            psf.write(u'%s ' % p)
+                psf.write(u'\n')
+
+class W2LDictWriter(DictWriter):
+
+    """wav2letter lexicon.txt and tokens.txt (phoneme set)"""
+
+    def __init__(self, lexiconfn, tokensfn):
+        self.lexiconfn = lexiconfn
+        self.tokensfn  = tokensfn
+
+    def outputs(self):
+        return [self.lexiconfn, self.tokensfn]
+
+    def open(self):
+        self.phoneme_set = set()
+        self.dictf       = codecs.open(self.lexiconfn, 'w', 'utf8')
+
+    def write(self, token, forms):
+
+        if not token in forms:
+            return
+
+        ipa = forms[token]
+        xs  = xsampa(token, ipa)
+
+        self.dictf.write(u'%s %s\n' % (token, xs))
+
+        for p in xs.split(' '):
+
+            if len(p) < 1:
+                logging.error(
+                    u"****ERROR: empty phoneme in : '%s' (ipa: '%s', token: '%s')" % (
+                    xs, ipa, token))
+
+            self.phoneme_set.add(p)
+
+    def close(self):
+
+        self.dictf.close()
+
+        with codecs.open(self.tokensfn, 'w', 'utf8') as tokensf:
+            tokensf.write(u'|\n')
+            for token in sorted(self.phoneme_set):
+                tokensf.write(u'%s\n' % token)
+
+class SequiturDictWriter(DictWriter):
+
+    """sequitur train.lex, test.lex and all.lex, split by word hash so it is reproducible"""
+
+    def __init__(self, workdir, ratio=0.9):
+        self.workdir = workdir
+        self.ratio   = ratio
+
+    def signature(self):
+        return (self.__class__.__name__, 'hash', self.ratio)
+
+    def outputs(self):
+        return [ '%s/%s.lex' % (self.workdir, n) for n in ['train', 'test', 'all'] ]
+
+    def open(self):
+        misc.mkdirs(self.workdir)
+        self.trainf = codecs.open('%s/train.lex' % self.workdir, 'w', 'utf8')
+        self.testf  = codecs.open('%s/test.lex'  % self.workdir, 'w', 'utf8')
+        self.allf   = codecs.open('%s/all.lex'   % self.workdir, 'w', 'utf8')
+
+    def write(self, token, forms):
+
+        if not token in forms:
+            return
+
+        xs = ipa2xsampa (token, forms[token], spaces=True, stress_to_vowels=False)
+
+        if self.ratio <= split_hash(token):
+            self.testf.write (u'%s %s\n' % (token, xs))
+        else:
+            self.trainf.write (u'%s %s\n' % (token, xs))
+        self.allf.write (u'%s %s\n' % (token, xs))
+
+    def close(self):
+        self.trainf.close()
+        self.testf.close()
+        self.allf.close()
+
+def espeak_version():
+
+    """version string of the installed eSpeak NG, None if it cannot be determined"""
+
+    try:
+        return subprocess.check_output(['espeak-ng', '--version']).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class ESpeakDictWriter(DictWriter):
+
+    """entries whose pronunciation differs from what eSpeak NG generates, in eSpeak notation"""
+
+    def __init__(self, outfn, esng, voice, limit=0):
+        self.outfn = outfn
+        self.esng  = esng
+        self.voice = voice
+        self.limit = limit
+
+        # the output depends on what eSpeak NG generates, so its version is
+        # part of the cache key - unknown version: do not cache
+
+        self.version = espeak_version()
+
+    def signature(self):
+
+        if not self.version:
+            return None
+
+        return (self.__class__.__name__, self.voice, self.limit, self.version)
+
+    def outputs(self):
+        return [self.outfn]
+
+    def open(self):
+        self.cnt     = 0
+        self.cnt_new = 0
+        self.outf    = codecs.open(self.outfn, 'w', 'utf8')
+
+    def write(self, token, forms):
+
+        if not token in forms or '_' in token:
+            return
+
+        if self.limit and self.cnt_new >= self.limit:
+            return
+
+        self.cnt += 1
+
+        ipa1 = forms[token].replace(u'-',u'').replace(u'ʔ',u'')
+        es1  = ipa2espeak (token, ipa1, stress_to_vowels=True)
+        es2  = self.esng.g2p (token)
+        ipa2 = espeak2ipa (token, es2)
+        es2  = ipa2espeak (token, ipa2, stress_to_vowels=True)
+
+        if es1 == es2:
+            logging.debug (u'%6d [      MATCH] %s' % (self.cnt, token))
+            return
+
+        self.cnt_new += 1
+        logging.info (u'%6d [new: %6d] %s -> %s : %s' % (self.cnt, self.cnt_new, token, es1, es2))
+
+        self.outf.write(u'%s\t%s\n' % (token, es1))
+
+    def close(self):
+        self.outf.close()
+        logging.info ('%d entries written to %s .' % (self.cnt_new, self.outfn))
+
+def _cache_key(lex_hash, words_hash, writer):
+
+    m = hashlib.md5()
+    m.update(lex_hash)
+    m.update(words_hash)
+    m.update(phonetics_version())
+    m.update(repr(writer.signature()))
+
+    return m.hexdigest()
+
+def export_dict(lex, writers, words=None, cache_dir=EXPORT_CACHE_DIR):
+
+    """
+    export lex in all writers' formats in a single pass. words (optional) limits
+    the export to the given tokens, all of which have to be in lex. Writers whose
+    outputs are cached for the current lexicon contents are served from the cache.
+    """
+
+    if words is not None:
+        words = sorted(set(words))
+        for token in words:
+            if not token in lex:
+                raise Exception(u'missing token in dictionary: %s' % token)
+
+    lex_hash   = lex.content_hash()
+    words_hash = hashlib.md5(u'\n'.join(words).encode('utf8')).hexdigest() if words is not None else 'all'
+
+    todo = []
+    for writer in writers:
+
+        if writer.signature() is None:
+            todo.append((writer, None))
+            continue
+
+        cachedn = '%s/%s' % (cache_dir, _cache_key(lex_hash, words_hash, writer))
+        outputs = writer.outputs()
+
+        if all([ os.path.exists('%s/%d' % (cachedn, i)) for i in range(len(outputs)) ]):
+            for i, fn in enumerate(outputs):
+                misc.mkdirs(os.path.dirname(fn))
+                shutil.copyfile('%s/%d' % (cachedn, i), fn)
+                logging.info ('%s written (cached).' % fn)
+            continue
+
+        todo.append((writer, cachedn))
+
+    if not todo:
+        return
+
+    # variants of each base word: looked up per token when filtering, grouped
+    # in one go when exporting the whole lexicon
+
+    if words is None:
+        words = list(lex)
+        multi = {}
+        for token in words:
+            multi.setdefault(token.split('_')[0], []).append(token)
+        get_forms = lambda token: dict([ (form, lex[form]['ipa']) for form in multi[token.split('_')[0]] ])
+    else:
+        get_forms = lambda token: dict([ (form, v['ipa']) for form, v in lex.get_multi(token).items() ])
+
+    logging.info ('exporting %d tokens to %s ...' % (len(words), ', '.join([ w.__class__.__name__ for w, c in todo ])))
+
+    for writer, cachedn in todo:
+        writer.open()
+
+    for token in words:
+        forms = get_forms(token)
+        for writer, cachedn in todo:
+            writer.write(token, forms)
+
+    for writer, cachedn in todo:
+
+        writer.close()
+
+        for fn in writer.outputs():
+            logging.info ('%s written.' % fn)
+
+        if cachedn is None:
+            continue
+
+        tmpdn = '%s.%d.tmp' % (cachedn, os.getpid())
+        misc.mkdirs(tmpdn)
+        for i, fn in enumerate(writer.outputs()):
+            shutil.copyfile(fn, '%s/%d' % (tmpdn, i))
+        if os.path.exists(cachedn):
+            shutil.rmtree(cachedn)
+        os.rename(tmpdn, cachedn)
+
+    logging.info ('exporting %d tokens ... done.' % len(words))
+
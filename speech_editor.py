@@ -36,11 +36,11 @@ from optparse               import OptionParser
 from nltools                import misc
 from nltools.phonetics      import ipa2xsampa, xsampa2ipa
 from nltools.tokenizer      import tokenize
-from nltools.sequiturclient import sequitur_gen_ipa
 from nltools.tts            import TTS
 
 from speech_transcripts     import Transcripts
 from speech_lexicon         import Lexicon
+from speech_g2p             import g2p_ipa
 
 PROC_TITLE      = 'speech_editor'
 DEFAULT_MARY    = False # switch between mary and sequitur default g2p
@@ -154,7 +154,7 @@ def lex_set_token(token):
         if DEFAULT_MARY:
             ipas = tts.gen_ipa (lex_base)
         else:
-            ipas = sequitur_gen_ipa (SEQUITUR_MODEL, lex_base)
+            ipas = g2p_ipa (SEQUITUR_MODEL, lex_base)
 
         lex_entry = {'ipa': ipas}
         lex[lex_token] = lex_entry
@@ -235,7 +235,7 @@ def lex_edit(token):
             # generate de-sequitur
             elif c == 'j':
                 
-                ipas = sequitur_gen_ipa (SEQUITUR_MODEL, lex_base)
+                ipas = g2p_ipa (SEQUITUR_MODEL, lex_base)
                 tts.locale ='de'
                 tts.engine ='mary'
                 tts.voice  ='bits3'
@@ -660,8 +660,8 @@ try:
                 lex_edit(t)
 
 
-    transcripts.save()
-    logging.info("new transcripts saved.")
+    transcripts.commit()
+    logging.info("transcript changes committed to the review journal.")
 
     lex.save()
     logging.info("new lexicon saved.")
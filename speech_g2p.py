@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# batch g2p with result caching
+#
+# g2p_ipa_multi() / g2p_ipa() hand words to a running g2p daemon
+# (speech_g2p_server.py, keeps sequitur models resident) if there is one,
+# otherwise the model is loaded once per process. If sequitur cannot be
+# imported in this process, g2p.py is run as a subprocess through
+# nltools.sequiturclient like the exports used to do. Either way results are
+# cached in an LRU plus an sqlite store keyed by (model fingerprint, word),
+# which is consulted before anything gets sent to sequitur. Results of models
+# which have been replaced or removed get evicted by evict_obsolete().
+#
+
+import os
+import time
+import json
+import socket
+import hashlib
+import logging
+import sqlite3
+import threading
+import SocketServer
+
+from collections import OrderedDict
+
+from nltools     import misc
+
+G2P_SOCKET = 'tmp/g2p.sock'
+G2P_DBFN   = 'data/dst/cache/g2p.sqlite'
+LRU_SIZE   = 100000
+BATCH_SIZE = 500
+
+_fingerprints = {}
+
+def model_fingerprint(modelfn):
+
+    """md5 of the model file, recomputed only if its size or mtime changed"""
+
+    st  = os.stat(modelfn)
+    key = (os.path.realpath(modelfn), st.st_size, st.st_mtime)
+
+    if not key in _fingerprints:
+        m = hashlib.md5()
+        with open(modelfn, 'rb') as f:
+            while True:
+                buf = f.read(1 << 20)
+                if not buf:
+                    break
+                m.update(buf)
+        _fingerprints[key] = m.hexdigest()
+
+    return _fingerprints[key]
+
+class G2PStore(object):
+
+    def __init__(self, dbfn=G2P_DBFN, lru_size=LRU_SIZE):
+
+        misc.mkdirs(os.path.dirname(dbfn))
+
+        self.lru      = OrderedDict()
+        self.lru_size = lru_size
+        self.lock     = threading.Lock()
+        self.hits     = 0
+        self.misses   = 0
+
+        self.conn = sqlite3.connect(dbfn, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS g2p (model TEXT, word TEXT, ipa TEXT, PRIMARY KEY (model, word))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, path TEXT, last_used REAL)')
+        self.conn.commit()
+
+    def _lru_put(self, key, ipa):
+        self.lru.pop(key, None)
+        self.lru[key] = ipa
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get_multi(self, model, words):
+
+        """cached results for words: word -> ipa"""
+
+        res  = {}
+        todo = []
+
+        with self.lock:
+
+            for word in words:
+                ipa = self.lru.pop((model, word), None)
+                if ipa is None:
+                    todo.append(word)
+                else:
+                    self.lru[(model, word)] = ipa
+                    res[word] = ipa
+
+            for i in range(0, len(todo), BATCH_SIZE):
+                batch = todo[i:i+BATCH_SIZE]
+                cur = self.conn.execute('SELECT word, ipa FROM g2p WHERE model=? AND word IN (%s)' % ','.join(['?'] * len(batch)),
+                                        [model] + batch)
+                for word, ipa in cur:
+                    res[word] = ipa
+                    self._lru_put((model, word), ipa)
+
+            self.hits   += len(res)
+            self.misses += len(words) - len(res)
+
+        return res
+
+    def put_multi(self, model, modelfn, ipas):
+
+        """
+        store results of model (fingerprint of modelfn). The model is registered
+        in the same transaction, so evict_obsolete() never sees its results
+        without it.
+        """
+
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO models VALUES (?,?,?)', (model, os.path.realpath(modelfn), time.time()))
+            self.conn.executemany('INSERT OR REPLACE INTO g2p VALUES (?,?,?)', [ (model, word, ipas[word]) for word in ipas ])
+            self.conn.commit()
+            for word in ipas:
+                self._lru_put((model, word), ipas[word])
+
+    def evict_obsolete(self):
+
+        """
+        drop results of models whose file has been modified or removed since
+        (or which are not registered at all), returns the number of entries evicted
+        """
+
+        with self.lock:
+
+            obsolete = []
+            for model, path in self.conn.execute('SELECT model, path FROM models').fetchall():
+                try:
+                    if model_fingerprint(path) == model:
+                        continue
+                except (IOError, OSError):
+                    pass
+                obsolete.append(model)
+
+            for model in obsolete:
+                self.conn.execute('DELETE FROM models WHERE model=?', (model,))
+
+            cnt = self.conn.execute('DELETE FROM g2p WHERE model NOT IN (SELECT model FROM models)').rowcount
+            self.conn.commit()
+
+            for key in [ key for key in self.lru if key[0] in obsolete ]:
+                del self.lru[key]
+
+        if cnt:
+            logging.info ('g2p store: evicted %d entries of %d obsolete model(s).' % (cnt, len(obsolete)))
+
+        return cnt
+
+    def stats(self):
+        total = self.hits + self.misses
+        return '%d hits, %d misses (%.1f%% hit rate)' % (self.hits, self.misses, 100.0 * self.hits / total if total else 0.0)
+
+class G2PEngine(object):
+
+    """keeps sequitur models resident, answers batch requests from the store where possible"""
+
+    def __init__(self, store=None):
+
+        self.store  = store if store else G2PStore()
+        self.models = {} # model fingerprint -> SeqIf
+        self.lock   = threading.Lock()
+
+    def load(self, modelfn):
+        return self._model(modelfn, model_fingerprint(modelfn))
+
+    def _model(self, modelfn, fp):
+
+        # None: sequitur is not importable, use the g2p.py subprocess instead
+
+        if not fp in self.models:
+            try:
+                from seqif import SeqIf
+            except ImportError as e:
+                logging.warn ('sequitur not available in this process (%s), running g2p.py instead.' % e)
+                self.models[fp] = None
+            else:
+                logging.info ('loading g2p model %s ...' % modelfn)
+                self.models[fp] = SeqIf(modelfn)
+                logging.info ('loading g2p model %s ... done.' % modelfn)
+
+        return self.models[fp]
+
+    def g2p_multi(self, modelfn, words):
+
+        """
+        word -> ipa for all words sequitur could transcribe. Failures are
+        cached as well (as empty ipa), so they do not trigger a model load
+        next time.
+        """
+
+        res  = self.store.get_multi(model_fingerprint(modelfn), words)
+        todo = [ word for word in words if not word in res ]
+        if todo:
+            res.update(self.generate(modelfn, todo))
+
+        return dict([ (word, res[word]) for word in res if res[word] ])
+
+    def generate(self, modelfn, words):
+
+        """run sequitur on words, store and return the results"""
+
+        fp = model_fingerprint(modelfn)
+
+        generated = {}
+        with self.lock:
+            si = self._model(modelfn, fp)
+
+            if si is None:
+                from nltools.sequiturclient import sequitur_gen_ipa_multi
+                ipas = sequitur_gen_ipa_multi(modelfn, words)
+                for word in words:
+                    generated[word] = ipas.get(word, u'')
+
+            else:
+                for word in words:
+                    try:
+                        generated[word] = si.g2p(word)
+                    except Exception as e:
+                        logging.error (u'g2p failed for %s: %s' % (word, e))
+                        generated[word] = u''
+
+        self.store.put_multi(fp, modelfn, generated)
+
+        return generated
+
+class G2PRequestHandler(SocketServer.StreamRequestHandler):
+
+    # one json request per line: {"model": modelfn, "words": [...]}
+    # answered by {"ipas": {word: ipa}} or {"error": msg}
+
+    def handle(self):
+
+        while True:
+
+            line = self.rfile.readline()
+            if not line:
+                break
+
+            try:
+                req  = json.loads(line)
+                resp = {'ipas': self.server.engine.g2p_multi(req['model'], req['words'])}
+            except Exception as e:
+                logging.error ('g2p request failed: %s' % e)
+                resp = {'error': str(e)}
+
+            self.wfile.write(json.dumps(resp) + '\n')
+            self.wfile.flush()
+
+class G2PServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, sockfn=G2P_SOCKET, engine=None):
+
+        if os.path.exists(sockfn):
+            os.unlink(sockfn)
+        misc.mkdirs(os.path.dirname(sockfn))
+
+        SocketServer.UnixStreamServer.__init__(self, sockfn, G2PRequestHandler)
+
+        self.engine = engine if engine else G2PEngine()
+
+class G2PServerError(Exception):
+    pass
+
+def _server_g2p_multi(sockfn, modelfn, words):
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(sockfn)
+        f = s.makefile('rw')
+        f.write(json.dumps({'model': os.path.abspath(modelfn), 'words': words}) + '\n')
+        f.flush()
+        resp = json.loads(f.readline())
+    finally:
+        s.close()
+
+    if 'error' in resp:
+        raise G2PServerError ('g2p server: %s' % resp['error'])
+
+    return resp['ipas']
+
+_store  = None
+_engine = None
+
+def get_g2p_store():
+
+    global _store
+
+    if _store is None:
+        _store = G2PStore()
+
+    return _store
+
+def g2p_ipa_multi(modelfn, words, sockfn=G2P_SOCKET):
+
+    """
+    word -> ipa for all of words sequitur could transcribe. Words not in the
+    store yet are sent to the g2p daemon if it is running, otherwise the model
+    is loaded in this process.
+    """
+
+    global _engine
+
+    store = get_g2p_store()
+    words = list(words)
+    res   = store.get_multi(model_fingerprint(modelfn), words)
+    todo  = [ word for word in words if not word in res ]
+
+    if todo:
+
+        generated = None
+
+        if os.path.exists(sockfn):
+            try:
+                generated = _server_g2p_multi(sockfn, modelfn, todo)
+            except (socket.error, ValueError, G2PServerError) as e:
+                logging.warn ('g2p server at %s not available (%s), running g2p locally.' % (sockfn, e))
+
+        if generated is None:
+            if _engine is None:
+                _engine = G2PEngine(store)
+            generated = _engine.generate(modelfn, todo)
+
+        res.update(generated)
+
+    return dict([ (word, res[word]) for word in res if res[word] ])
+
+def g2p_ipa(modelfn, word, sockfn=G2P_SOCKET):
+    return g2p_ipa_multi(modelfn, [word], sockfn=sockfn).get(word, u'')
+
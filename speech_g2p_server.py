@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# g2p daemon: keeps sequitur models resident and answers batch g2p requests
+# of the editors and lexicon tools on a unix socket, see speech_g2p.py
+#
+
+import sys
+import logging
+
+from optparse   import OptionParser
+
+from nltools    import misc
+from speech_g2p import G2PServer, G2P_SOCKET
+
+PROC_TITLE = 'speech_g2p_server'
+
+misc.init_app (PROC_TITLE)
+
+parser = OptionParser("usage: %prog [options] [model ...]")
+
+parser.add_option ("-s", "--socket", dest="sockfn", type="str", default=G2P_SOCKET,
+                   help="unix socket to listen on, default: %s" % G2P_SOCKET)
+parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
+                   help="verbose output")
+
+(options, args) = parser.parse_args()
+
+if options.verbose:
+    logging.basicConfig(level=logging.DEBUG)
+else:
+    logging.basicConfig(level=logging.INFO)
+
+server = G2PServer(options.sockfn)
+
+# models given on the command line are loaded right away, others on first request
+
+for modelfn in args:
+    server.engine.load(modelfn)
+
+logging.info ('g2p server listening on %s' % options.sockfn)
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    logging.info ('g2p server shutting down.')
+
@@ -25,6 +25,11 @@
 # these additional, artifically created recordings should help with
 # noise resistance when used in training
 #
+# the random choices (noise files, levels) are all made up front in the main
+# process, the mixing itself runs on a process pool, either in-process using
+# numpy (see speech_noise.py) or through the original sox pipeline. The numpy
+# workers share one memory-mapped NoiseBank instead of reading noise files.
+#
 
 import os
 import sys
@@ -34,17 +39,68 @@ import locale
 import codecs
 import wave
 import random
+import subprocess
+import multiprocessing
 
 from optparse               import OptionParser
+from collections            import OrderedDict
 
 from nltools                import misc
-from speech_transcripts     import Transcripts
+from speech_transcripts     import Transcripts, DEFAULT_NUM_CPUS
+from speech_audio_meta      import AudioMetaIndex
+from speech_audio_norm      import np, write_wav, BACKENDS, BACKEND_SOX, BACKEND_NUMPY
+from speech_noise           import NoiseBank, read_mono, noisy_mix
 
 PROC_TITLE      = 'speech_gen_noisy'
 
 DEBUG_LIMIT     = 0
 FRAMERATE       = 16000
 MIN_QUALITY     = 2
+CHUNKSIZE       = 4
+
+def gen_noisy(job):
+
+    # process pool worker, returns (outfn, error message or None)
+
+    backend, infn, outfn, fgfn_1, fgfn_2, bgfn, bg_off, fg_len, fg_level, bg_level, reverb_level, seed = job
+
+    try:
+        if backend == BACKEND_NUMPY:
+
+            # bank: opened by the main process before the pool got forked
+
+            speech, rate = read_mono(infn)
+            fg1          = bank.samples(fgfn_1)
+            fg2          = bank.samples(fgfn_2)
+            bg           = bank.samples(bgfn, bg_off, fg_len)
+
+            y = noisy_mix(speech, fg1, fg2, bg, rate, fg_level, bg_level, reverb_level,
+                          np.random.RandomState(seed))
+
+            write_wav(outfn, y, rate)
+
+        else:
+
+            # reverb [-w|--wet-only] [reverberance (50%) [HF-damping (50%)
+            #        [room-scale (100%) [stereo-depth (100%)
+            #        [pre-delay (0ms) [wet-gain (0dB)]]]]]]
+
+            # compand attack1,decay1{,attack2,decay2}
+            #        [soft-knee-dB:]in-dB1[,out-dB1]{,in-dB2,out-dB2}
+            #        [gain [initial-volume-dB [delay]]]
+
+            cmd = 'sox -b 16 -r 16000 -m "|sox --norm=%f %s %s %s -p compand 0.01,0.2 -90,-10 -5 reverb %f" "|sox --norm=%f %s -p trim %f %f" %s' % \
+                  (fg_level, fgfn_1, infn, fgfn_2, reverb_level, bg_level, bgfn, bg_off, fg_len, outfn)
+
+            logging.debug('   cmd: %s' % cmd)
+
+            if subprocess.call(cmd, shell=True):
+                raise Exception ('sox failed: %s' % cmd)
+
+    except Exception as e:
+        return outfn, '%s' % e
+
+    return outfn, None
 
 #
 # init
@@ -58,6 +114,14 @@ misc.init_app(PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options] corpus")
 
+default_backend = BACKEND_NUMPY if np is not None else BACKEND_SOX
+
+parser.add_option ("-b", "--backend", dest="backend", type="choice", choices=BACKENDS, default=default_backend,
+                   help="noise mixing backend (%s), default: %s" % (', '.join(BACKENDS), default_backend))
+
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                   help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+
 parser.add_option ("-s", "--stride", dest="stride", type="int", default=4,
                    help="only generate noisy variant for every nth entry, default: 4")
 
@@ -77,6 +141,10 @@ if len(args) != 1:
     parser.print_usage()
     sys.exit(1)
 
+if options.backend == BACKEND_NUMPY and np is None:
+    logging.error('numpy backend requested but numpy is not installed')
+    sys.exit(1)
+
 corpus_in  = args[0]
 corpus_out = corpus_in + '_noisy'
 
@@ -158,22 +226,36 @@ for bgfn in os.listdir(bg_dir):
 
 # print repr(bg_lens)
 
+#
+# numpy backend: all noise decoded once into a shared, memory-mapped bank
+#
+
+if options.backend == BACKEND_NUMPY:
+    bank = NoiseBank([ '%s/%s' % (fg_dir, fgfn) for fgfn in fg_lens ] +
+                     [ '%s/%s' % (bg_dir, bgfn) for bgfn in bg_lens ], FRAMERATE)
+
 #
 # count good transcripts
 #
 
-total_good = 0
-for ts in transcripts:
+good = [ v['cfn'] for v in transcripts.iter(min_quality=MIN_QUALITY) ]
+total_good = len(good)
 
-    if transcripts[ts]['quality']<MIN_QUALITY:
-        continue
-    total_good += 1
+#
+# audio metadata (durations, frame rates) of the input corpus
+#
+
+audio_meta = AudioMetaIndex(corpus_in, '%s/%s' % (wav16_dir, corpus_in))
+audio_meta.update(good)
 
 #
-# main 
+# main: draw noise files and levels, collect mixing jobs
 #
 
-cnt = 1
+cnt     = 1
+jobs    = []
+prompts = OrderedDict() # pkgdirfn -> [(audiofn, ts)]
+
 random.seed(42)
 
 for ts in transcripts:
@@ -202,15 +284,17 @@ for ts in transcripts:
 
         outfn = '%s/wav/%s.wav' % (pkgdirfn, audiofn2)
 
-        wav = wave.open(infn, 'r')
+        info = audio_meta.get(cfn)
+
+        if not info:
+            logging.error ('%s: audio file missing' % infn)
 
-        fr = wav.getframerate()
-        if fr == FRAMERATE:
+        elif info.sample_rate == FRAMERATE:
 
-            in_len = float(wav.getnframes()) / float(FRAMERATE)
+            in_len = info.duration
             fg_level = random.uniform (-1.0, 0.0)
 
-            logging.info ('%5d/%5d %6.2fs lvl=%2.3f %s' % (cnt, total_good, in_len, fg_level, cfn))
+            logging.debug ('%5d/%5d %6.2fs lvl=%2.3f %s' % (cnt, total_good, in_len, fg_level, cfn))
 
             logging.debug ('    entry: %s' % repr(entry))
 
@@ -247,39 +331,57 @@ for ts in transcripts:
 
                 logging.debug ('   bg: off=%6.2fs fn=%s' % (bg_off, bgfn))
 
-                # reverb [-w|--wet-only] [reverberance (50%) [HF-damping (50%)
-                #        [room-scale (100%) [stereo-depth (100%)
-                #        [pre-delay (0ms) [wet-gain (0dB)]]]]]]
-
                 reverb_level = random.uniform(0.0, 50.0)
 
-                # compand attack1,decay1{,attack2,decay2}
-                #        [soft-knee-dB:]in-dB1[,out-dB1]{,in-dB2,out-dB2}
-                #        [gain [initial-volume-dB [delay]]]
+                jobs.append((options.backend, infn, outfn, '%s/%s' % (fg_dir, fgfn_1), '%s/%s' % (fg_dir, fgfn_2),
+                             '%s/%s' % (bg_dir, bgfn), bg_off, fg_len, fg_level, bg_level, reverb_level, cnt))
 
-
-                cmd = 'sox -b 16 -r 16000 -m "|sox --norm=%f %s/%s %s %s/%s -p compand 0.01,0.2 -90,-10 -5 reverb %f" "|sox --norm=%f %s/%s -p trim %f %f" %s' % \
-                      (fg_level, fg_dir, fgfn_1, infn, fg_dir, fgfn_2, reverb_level, bg_level, bg_dir, bgfn, bg_off, fg_len, outfn)
-
-                logging.debug('   cmd: %s' % cmd)
-
-                os.system(cmd)
-
-                promptfn = '%s/etc/prompts-original' % pkgdirfn
-
-                with codecs.open(promptfn, 'a', 'utf8') as promptf:
-                    promptf.write('%s %s\n' % (audiofn2, ts2))
+                if not pkgdirfn in prompts:
+                    prompts[pkgdirfn] = []
+                prompts[pkgdirfn].append((audiofn2, ts2))
 
             else:
                 logging.error ('%s: too long %f' % (infn, fg_len))
 
         else:
-            logging.error ('%s: wrong framerate %d' % (infn, fr))
-
-        wav.close()
+            logging.error ('%s: wrong framerate %d' % (infn, info.sample_rate))
 
     cnt += 1
 
     if DEBUG_LIMIT>0 and cnt>DEBUG_LIMIT:
         break
 
+#
+# mix
+#
+
+logging.info ('mixing %d noisy recordings (%s) ...' % (len(jobs), options.backend))
+
+pool   = multiprocessing.Pool(options.num_cpus)
+failed = set()
+
+for i, (outfn, error) in enumerate(pool.imap(gen_noisy, jobs, CHUNKSIZE)):
+
+    if error:
+        logging.error ('%s: %s' % (outfn, error))
+        failed.add(outfn)
+
+    if (i+1) % 1000 == 0:
+        logging.info ('%6d/%6d noisy recordings done.' % (i+1, len(jobs)))
+
+pool.close()
+pool.join()
+
+#
+# prompts, only for recordings which were created
+#
+
+for pkgdirfn in prompts:
+
+    with codecs.open('%s/etc/prompts-original' % pkgdirfn, 'w', 'utf8') as promptf:
+        for audiofn2, ts2 in prompts[pkgdirfn]:
+            if not ('%s/wav/%s.wav' % (pkgdirfn, audiofn2)) in failed:
+                promptf.write('%s %s\n' % (audiofn2, ts2))
+
+logging.info ('%d noisy recordings created, %d failed.' % (len(jobs) - len(failed), len(failed)))
+
@@ -32,7 +32,6 @@ import logging
 import traceback
 import locale
 import codecs
-import wave
 import random
 import copy
 
@@ -40,6 +39,8 @@ from optparse               import OptionParser
 
 from nltools                import misc
 from speech_transcripts     import Transcripts
+from speech_audio_meta      import AudioMetaIndex
+from speech_audio_norm      import np, read_wav, write_wav, downmix, resample, BACKENDS, BACKEND_SOX, BACKEND_NUMPY
 
 PROC_TITLE      = 'speech_gen_phone'
 
@@ -59,6 +60,9 @@ misc.init_app(PROC_TITLE)
 
 parser = OptionParser("usage: %prog [options] corpus")
 
+parser.add_option ("-b", "--backend", dest="backend", type="choice", choices=BACKENDS, default=BACKEND_SOX,
+                   help="backend for the 8kHz round trip (%s), default: %s. lpc and gsm always use sox." % (', '.join(BACKENDS), BACKEND_SOX))
+
 parser.add_option ("-s", "--stride", dest="stride", type="int", default=4,
                    help="only generate noisy variant for every nth entry, default: 4")
 
@@ -78,6 +82,10 @@ if len(args) != 1:
     parser.print_usage()
     sys.exit(1)
 
+if options.backend == BACKEND_NUMPY and np is None:
+    logging.error('numpy backend requested but numpy is not installed')
+    sys.exit(1)
+
 corpus_in  = args[0]
 corpus_out = corpus_in + '_phone'
 
@@ -112,12 +120,15 @@ misc.mkdirs(out_dir)
 # count good transcripts
 #
 
-total_good = 0
-for ts in transcripts:
+good = [ v['cfn'] for v in transcripts.iter(min_quality=MIN_QUALITY) ]
+total_good = len(good)
 
-    if transcripts[ts]['quality']<MIN_QUALITY:
-        continue
-    total_good += 1
+#
+# audio metadata (durations, frame rates) of the input corpus
+#
+
+audio_meta = AudioMetaIndex(corpus_in, '%s/%s' % (wav16_dir, corpus_in))
+audio_meta.update(good)
 
 #
 # main 
@@ -153,31 +164,41 @@ for ts in transcripts:
 
         outfn = '%s/wav/%s.wav' % (pkgdirfn, audiofn2)
 
-        wav = wave.open(infn, 'r')
+        info = audio_meta.get(cfn)
+
+        if not info:
+            logging.error ('%s: audio file missing' % infn)
 
-        fr = wav.getframerate()
-        if fr == FRAMERATE:
+        elif info.sample_rate == FRAMERATE:
 
             op = random.choice(['8kHz', 'lpc ', 'gsm '])
 
             logging.info ('%5d/%5d %s %s' % (cnt, total_good, op, cfn))
 
-            if op == '8kHz':
-                tmpfn = '%s.wav' % tmpfn_base
+            if op == '8kHz' and options.backend == BACKEND_NUMPY:
+
+                samples, rate = read_wav(infn)
+                samples = resample(resample(downmix(samples), rate, 8000), 8000, FRAMERATE)
+                write_wav(outfn, samples, FRAMERATE)
 
-            elif op == 'lpc ':
-                tmpfn = '%s.lpc' % tmpfn_base
-            
             else:
-                tmpfn = '%s.gsm' % tmpfn_base
 
-            cmd = 'sox %s -r 8000 -c 1 %s' % (infn, tmpfn)
-            logging.debug('   cmd: %s' % cmd)
-            os.system(cmd)
+                if op == '8kHz':
+                    tmpfn = '%s.wav' % tmpfn_base
+
+                elif op == 'lpc ':
+                    tmpfn = '%s.lpc' % tmpfn_base
 
-            cmd = 'sox %s -b 16 -r 16000 -c 1 %s' % (tmpfn, outfn)
-            logging.debug('   cmd: %s' % cmd)
-            os.system(cmd)
+                else:
+                    tmpfn = '%s.gsm' % tmpfn_base
+
+                cmd = 'sox %s -r 8000 -c 1 %s' % (infn, tmpfn)
+                logging.debug('   cmd: %s' % cmd)
+                os.system(cmd)
+
+                cmd = 'sox %s -b 16 -r 16000 -c 1 %s' % (tmpfn, outfn)
+                logging.debug('   cmd: %s' % cmd)
+                os.system(cmd)
 
 
             promptfn = '%s/etc/prompts-original' % pkgdirfn
@@ -186,9 +207,7 @@ for ts in transcripts:
                 promptf.write('%s %s\n' % (audiofn2, entry['ts']))
 
         else:
-            logging.error ('%s: wrong framerate %d' % (infn, fr))
-
-        wav.close()
+            logging.error ('%s: wrong framerate %d' % (infn, info.sample_rate))
 
     cnt += 1
 
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# common part of the import_* scripts which convert corpora to voxforge-like
+# packages (<corpus>/<package>/wav/<uttid>.wav + etc/prompts-original)
+#
+# Importer.add() queues the audio conversion of one utterance right away
+# (see speech_audio_convert.AudioConverter) and remembers its prompt, close()
+# waits for the conversions and writes each package's prompts file once.
+# Outputs which already are complete wavs are not converted again (unless
+# -f is given), so an interrupted import can just be started again.
+#
+# add_source() does the same for a whole speech_archive.CorpusSource in a
+# single pass: when the corpus is read from an archive, each audio member is
+# spooled to a temporary file (in $TMPDIR) only while its conversion is
+# pending - plus, for archives storing audio ahead of its metadata, until that
+# metadata has been read (see speech_archive).
+#
+
+import os
+import codecs
+import shutil
+import logging
+import tempfile
+
+from collections          import OrderedDict
+
+from nltools              import misc
+from speech_audio_convert import AudioConverter
+from speech_audio_norm    import DEFAULT_SPEC, BACKENDS, valid_wav
+
+DEFAULT_NUM_CPUS = 12
+DEFAULT_RETRIES  = 2
+
+def add_importer_options(parser, backends=BACKENDS):
+
+    """-b/--backend, -f/--force, -n/--num-cpus and -r/--retries"""
+
+    parser.add_option ("-b", "--backend", dest="backend", type="choice", choices=backends, default=backends[0],
+                       help="audio conversion backend (%s), default: %s" % (', '.join(backends), backends[0]))
+
+    parser.add_option ("-f", "--force", action="store_true", dest="force",
+                       help="convert all audio files, even the ones converted by a previous run")
+
+    parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                       help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+
+    parser.add_option ("-r", "--retries", dest="retries", type="int", default=DEFAULT_RETRIES,
+                       help="number of times to retry a failed conversion, default: %d" % DEFAULT_RETRIES)
+
+class Importer(object):
+
+    def __init__(self, options, spec=DEFAULT_SPEC):
+
+        """options: as set up by add_importer_options()"""
+
+        self.spec       = spec
+        self.skip_valid = not options.force
+        self.converter  = AudioConverter(options.num_cpus, spec=spec, backend=options.backend,
+                                         retries=options.retries, skip_valid=self.skip_valid)
+        self.prompts    = OrderedDict() # package dir -> [(uttid, prompt)]
+        self.uttids     = set()
+        self.spooldir   = None
+
+    def _register(self, pkgdir, uttid, prompt):
+
+        if uttid in self.uttids:
+            logging.error('utterance id %s is not unique!' % uttid)
+            return False
+        self.uttids.add(uttid)
+
+        if not pkgdir in self.prompts:
+            misc.mkdirs('%s/wav' % pkgdir)
+            misc.mkdirs('%s/etc' % pkgdir)
+            self.prompts[pkgdir] = []
+
+        self.prompts[pkgdir].append((uttid, prompt))
+
+        return True
+
+    def add(self, pkgdir, uttid, prompt, srcfn):
+
+        """
+        add utterance uttid of package pkgdir, audio is converted from srcfn.
+        Returns False (and ignores the utterance) if uttid is not unique.
+        """
+
+        if not self._register(pkgdir, uttid, prompt):
+            return False
+
+        logging.debug('%6d %s' % (len(self.uttids), uttid))
+        self.converter.submit(srcfn, '%s/wav/%s.wav' % (pkgdir, uttid))
+
+        return True
+
+    def add_source(self, source, metadata_pattern, audio_pattern, parse, num_metadata=None):
+
+        """
+        add the utterances of speech_archive.CorpusSource source, see
+        CorpusSource.audio(). parse(relpath, data) turns the contents of a
+        metadata file into utterances [(audio relpath, pkgdir, uttid, prompt)],
+        num_metadata is the number of metadata files if known.
+        """
+
+        dstfns = OrderedDict() # audio relpath -> dstfn, not seen yet
+
+        def parse_utts(relpath, data):
+            relpaths = []
+            for audio_relpath, pkgdir, uttid, prompt in parse(relpath, data):
+                if self._register(pkgdir, uttid, prompt):
+                    dstfns[audio_relpath] = '%s/wav/%s.wav' % (pkgdir, uttid)
+                    relpaths.append(audio_relpath)
+            return relpaths
+
+        if source.archive and not self.spooldir:
+            self.spooldir = tempfile.mkdtemp(prefix='speech_import_')
+
+        cnt = 0
+        for relpath, src, spooled in source.audio(metadata_pattern, audio_pattern, parse_utts, self.spooldir, num_metadata=num_metadata):
+
+            dstfn = dstfns.pop(relpath)
+            cnt  += 1
+            logging.debug('%6d %s' % (cnt, relpath))
+
+            if not source.archive:
+                self.converter.submit(src, dstfn)
+                continue
+
+            # no need to extract audio which has been converted before
+
+            if self.skip_valid and valid_wav(dstfn, self.spec.rate):
+                self.converter.skip(relpath, dstfn)
+                if spooled:
+                    os.unlink(src)
+                continue
+
+            if not spooled:
+                spoolfn = '%s/%d_%s' % (self.spooldir, cnt, os.path.basename(relpath))
+                with open(spoolfn, 'wb') as spoolf:
+                    shutil.copyfileobj(src, spoolf)
+                src = spoolfn
+
+            self.converter.submit(src, dstfn, remove_src=True)
+
+        for relpath in dstfns:
+            logging.error('%s: %s not found' % (source.name, relpath))
+
+    def write_prompts(self):
+
+        for pkgdir in self.prompts:
+
+            promptsfn = '%s/etc/prompts-original' % pkgdir
+            tmpfn     = '%s.tmp' % promptsfn
+
+            with codecs.open(tmpfn, 'w', 'utf8') as promptsf:
+                for uttid, prompt in self.prompts[pkgdir]:
+                    promptsf.write(u'%s %s\n' % (uttid, prompt))
+            os.rename(tmpfn, promptsfn)
+
+        logging.info('prompts of %d packages written.' % len(self.prompts))
+
+    def close(self):
+
+        """wait for all conversions, write prompts, returns the failed conversions"""
+
+        failed = self.converter.close()
+
+        if self.spooldir:
+            shutil.rmtree(self.spooldir)
+
+        self.write_prompts()
+
+        if failed:
+            logging.error('%d audio conversions failed:' % len(failed))
+            for res in failed:
+                logging.error('    %s: %s' % (res.srcfn, res.error))
+
+        return failed
+
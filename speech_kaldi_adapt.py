@@ -34,9 +34,8 @@ from StringIO import StringIO
 
 from nltools                import misc
 from nltools.tokenizer      import tokenize
-from nltools.phonetics      import ipa2xsampa
 
-from speech_lexicon         import Lexicon
+from speech_lexicon         import Lexicon, xsampa
 from speech_transcripts     import Transcripts
 
 #
@@ -116,16 +115,14 @@ with open (dictfn2, 'w') as dictf:
         multi = lex.get_multi(token)
         for form in multi:
             ipa = multi[form]['ipa']
-            xsr = ipa2xsampa (token, ipa, spaces=True)
-
-            xs = xsr.replace('-','').replace('\' ', '\'').replace('  ', ' ').replace('#', 'nC')
+            xs  = xsampa (token, ipa)
 
             dictf.write((u'%s %s\n' % (token, xs)).encode('utf8'))
 
             for p in xs.split(' '):
 
                 if len(p)<1:
-                    logging.error ( u"****ERROR: empty phoneme in : '%s' ('%s', ipa: '%s', token: '%s')" % (xs, xsr, ipa, token) )
+                    logging.error ( u"****ERROR: empty phoneme in : '%s' (ipa: '%s', token: '%s')" % (xs, ipa, token) )
 
                 pws = p[1:] if p[0] == '\'' else p
 
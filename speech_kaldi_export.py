@@ -31,11 +31,12 @@ from optparse               import OptionParser
 
 from nltools                import misc
 from nltools.tokenizer      import tokenize
-from nltools.phonetics      import ipa2xsampa
-from nltools.sequiturclient import sequitur_gen_ipa_multi
 
 from speech_lexicon         import Lexicon
-from speech_transcripts     import Transcripts
+from speech_dict_export     import export_dict, KaldiDictWriter
+from speech_g2p             import g2p_ipa_multi, get_g2p_store
+from speech_tokenizer_cache import tokenize_cached, prefetch_tokens, DEFAULT_LANG
+from speech_transcripts     import load_transcripts, BACKEND_MMAP, DEFAULT_NUM_CPUS
 
 SEQUITUR_MODEL_DIR  = 'data/models/sequitur'
 LANGUAGE_MODELS_DIR = 'data/dst/lm'
@@ -60,30 +61,37 @@ def export_kaldi_data (wav16_dir, audio_corpora, destdirfn, tsdict):
 
             utt2spkf.write('%s %s\n' % (utt_id, ts['spk']))
 
-def add_missing_words(transcripts, lex, sequitur_model_path):
+def add_missing_words(transcript_objs, lex, sequitur_model_path, lang):
     logging.info("looking for missing words...")
     missing = {}  # word -> count
-    num = len(transcripts)
-    cnt = 0
-    for cfn in transcripts:
-        ts = transcripts[cfn]
 
-        cnt += 1
+    for transcripts in transcript_objs:
 
-        if ts['quality'] > 0:
-            continue
+        prefetch_tokens([ts['prompt'] for ts in transcripts.iter(quality=0)], lang=lang)
 
-        for word in tokenize(ts['prompt']):
-            if word in lex:
-                continue
+        for ts in transcripts.iter(quality=0):
+
+            for word in tokenize_cached(ts['prompt'], lang=lang):
+                if word in lex:
+                    continue
 
-            if word in missing:
-                missing[word] += 1
-            else:
-                missing[word] = 1
+                if word in missing:
+                    missing[word] += 1
+                else:
+                    missing[word] = 1
     cnt = 0
     missing_tokens = [ item[0] for item in reversed(sorted(missing.items(), key=lambda x: x[1])) ]
-    ipa_map = sequitur_gen_ipa_multi(sequitur_model_path, missing_tokens)
+
+    # results of earlier exports are kept in the g2p store, so only words
+    # never seen with this model before get handed to sequitur
+
+    g2p_store = get_g2p_store()
+    g2p_store.evict_obsolete()
+
+    ipa_map = g2p_ipa_multi(sequitur_model_path, missing_tokens)
+
+    logging.info("g2p store: %s." % g2p_store.stats())
+
     for lex_base in ipa_map:
         ipas = ipa_map[lex_base]
         logging.info(u"%5d/%5d Adding missing word : %s [ %s ]" % (
@@ -96,113 +104,32 @@ def add_missing_words(transcripts, lex, sequitur_model_path):
     return lex
 
 
-def export_dictionary(ts_all, lex, dictfn2, prompt_words):
-    logging.info("Exporting dictionary...")
-    utt_dict = {}
-    if prompt_words:
-        for ts in ts_all:
-
-            tsd = ts_all[ts]
-
-            tokens = tsd['ts'].split(' ')
-
-            # logging.info ( '%s %s' % (repr(ts), repr(tokens)) )
-
-            for token in tokens:
-                if token in utt_dict:
-                    continue
-
-                if not token in lex:
-                    logging.error(
-                        "*** ERROR: missing token in dictionary: '%s' (tsd=%s, tokens=%s)" % (
-                        token, repr(tsd), repr(tokens)))
-                    sys.exit(1)
-
-                utt_dict[token] = lex.get_multi(token)
-    else:
-        for token in lex:
-            utt_dict[token] = lex.get_multi(token)
-
-    ps = {}
-    with open(dictfn2, 'w') as dictf:
-
-        dictf.write('!SIL SIL\n')
-
-        for token in sorted(utt_dict):
-            for form in utt_dict[token]:
-                ipa = utt_dict[token][form]['ipa']
-                xsr = ipa2xsampa(token, ipa, spaces=True)
+def prompt_words(ts_all, lex):
 
-                xs = (xsr.replace('-', '')
-                         .replace('\' ', '\'')
-                         .replace('  ', ' ')
-                         .replace('#', 'nC'))
+    """tokens used in the given transcripts, exits if any of them is missing in lex"""
 
-                dictf.write((u'%s %s\n' % (token, xs)).encode('utf8'))
+    words = set()
+    for utt_id in ts_all:
 
-                for p in xs.split(' '):
-
-                    if len(p) < 1:
-                        logging.error(
-                            u"****ERROR: empty phoneme in : '%s' ('%s', ipa: '%s', token: '%s')" % (
-                            xs, xsr, ipa, token))
-
-                    pws = p[1:] if p[0] == '\'' else p
-
-                    if not pws in ps:
-                        ps[pws] = {p}
-                    else:
-                        ps[pws].add(p)
-    logging.info("%s written." % dictfn2)
-    logging.info("Exporting dictionary ... done.")
-
-    return ps, utt_dict
-
-
-def write_nonsilence_phones(ps, psfn):
-    with open(psfn, 'w') as psf:
-        for pws in ps:
-            for p in sorted(list(ps[pws])):
-                psf.write((u'%s ' % p).encode('utf8'))
-
-            psf.write('\n')
-    logging.info('%s written.' % psfn)
-
-
-def write_silence_phones(psfn):
-    with open(psfn, 'w') as psf:
-        psf.write('SIL\nSPN\nNSN\n')
-    logging.info('%s written.' % psfn)
-
-
-def write_optional_silence(psfn):
-    with open(psfn, 'w') as psf:
-        psf.write('SIL\n')
-    logging.info('%s written.' % psfn)
+        tsd    = ts_all[utt_id]
+        tokens = tsd['ts'].split(' ')
 
+        for token in tokens:
+            if token in words:
+                continue
 
-def write_extra_questions(ps, psfn):
-    with open(psfn, 'w') as psf:
-        psf.write('SIL SPN NSN\n')
+            if not token in lex:
+                logging.error(
+                    "*** ERROR: missing token in dictionary: '%s' (tsd=%s, tokens=%s)" % (
+                    token, repr(tsd), repr(tokens)))
+                sys.exit(1)
 
-        for pws in ps:
-            for p in ps[pws]:
-                if '\'' in p:
-                    continue
-                psf.write((u'%s ' % p).encode('utf8'))
-        psf.write('\n')
-
-        for pws in ps:
-            for p in ps[pws]:
-                if not '\'' in p:
-                    continue
-                psf.write((u'%s ' % p).encode('utf8'))
+            words.add(token)
 
-        psf.write('\n')
-    logging.info('%s written.' % psfn)
+    return words
 
 
-def create_training_data_for_language_model(transcript_objs, utt_dict, data_dir):
+def create_training_data_for_language_model(transcript_objs, words, data_dir):
     transcripts = {}
     for transcript_obj in transcript_objs:
         transcripts.update(transcript_obj.ts)
@@ -217,7 +144,7 @@ def create_training_data_for_language_model(transcript_objs, utt_dict, data_dir)
     fn = '%s/local/lm/wordlist.txt' % data_dir
     with open(fn, 'w') as f:
 
-        for token in sorted(utt_dict):
+        for token in sorted(words):
             f.write((u'%s\n' % token).encode('utf8'))
     logging.info("%s written." % fn)
 
@@ -246,6 +173,12 @@ parser = OptionParser("usage: %prog [options] <model_name> <dictionary> <languag
 
 parser.add_option ("-d", "--debug", dest="debug", type='int', default=0, help="Limit number of sentences (debug purposes only), default: 0")
 
+parser.add_option ("-l", "--lang", dest="lang", type = "str", default=DEFAULT_LANG,
+                   help="language used to tokenize prompts when looking for missing words (default: %s)" % DEFAULT_LANG)
+
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                   help="number of cpus to use for loading transcripts in parallel, default: %d" % DEFAULT_NUM_CPUS)
+
 parser.add_option ("-s", "--sequitur-model", dest="sequitur_model", type='str', 
                    help="sequitur model (used to generate missing dict entries, if given)")
 
@@ -324,11 +257,10 @@ ts_all = {}
 ts_train = {}
 ts_test = {}
 transcript_objs = []
-for audio_corpus in audio_corpora:
 
-    logging.info("loading transcripts from %s ..." % audio_corpus)
+logging.info("loading transcripts from %s ..." % ', '.join(audio_corpora))
 
-    transcripts = Transcripts(corpus_name=audio_corpus)
+for audio_corpus, transcripts in zip(audio_corpora, load_transcripts(audio_corpora, num_cpus=options.num_cpus, backend=BACKEND_MMAP)):
 
     ts_all_, ts_train_, ts_test_ = transcripts.split(limit=options.debug, add_all=add_all)
 
@@ -337,7 +269,7 @@ for audio_corpus in audio_corpora:
     ts_test.update(ts_test_)
     transcript_objs.append(transcripts)
 
-    logging.info("loading transcripts from %s: %d train, %d test samples." % (audio_corpus, len(ts_train_), len(ts_test_)))
+    logging.info("loading transcripts from %s: %s." % (audio_corpus, transcripts.format_split_stats()))
 
 logging.info("loading transcripts done, total: %d train, %d test samples." % (len(ts_train), len(ts_test)))
 
@@ -349,24 +281,19 @@ export_kaldi_data(wav16_dir, audio_corpora, '%s/test/' % data_dir, ts_test)
 #
 
 if sequitur_model_path:
-    for transcript_obj in transcript_objs:
-        lex = add_missing_words(transcript_obj, lex, sequitur_model_path)
-
-ps, utt_dict = export_dictionary(ts_all,
-                                 lex,
-                                 '%s/local/dict/lexicon.txt' % data_dir,
-                                 options.prompt_words)
+    lex = add_missing_words(transcript_objs, lex, sequitur_model_path, options.lang)
 
 #
-# phones etc
+# lexicon, phones etc
 #
 
-write_nonsilence_phones(ps, '%s/local/dict/nonsilence_phones.txt' % data_dir)
+words = prompt_words(ts_all, lex) if options.prompt_words else None
+
+logging.info("Exporting dictionary...")
+export_dict(lex, [KaldiDictWriter('%s/local/dict' % data_dir)], words=words)
+logging.info("Exporting dictionary ... done.")
 
-write_silence_phones('%s/local/dict/silence_phones.txt' % data_dir)
-write_optional_silence('%s/local/dict/optional_silence.txt' % data_dir)
-write_extra_questions(ps, '%s/local/dict/extra_questions.txt' % data_dir)
-create_training_data_for_language_model(transcript_objs, utt_dict, data_dir)
+create_training_data_for_language_model(transcript_objs, words if words is not None else lex.keys(), data_dir)
 
 #
 # script
@@ -37,11 +37,11 @@ from nltools                import misc
 
 from nltools.phonetics      import ipa2xsampa, xsampa2ipa
 from nltools.tokenizer      import tokenize
-from nltools.sequiturclient import sequitur_gen_ipa
 from nltools.tts            import TTS
 
 from speech_transcripts     import Transcripts
 from speech_lexicon         import Lexicon
+from speech_g2p             import g2p_ipa
 
 #
 # Lex Editor
@@ -112,7 +112,7 @@ def lex_gen_ipa (locale, engine, voice, speak=False):
     global tts
 
     if engine == 'sequitur':
-        ipas = sequitur_gen_ipa (SEQUITUR_MODEL, lex_base)
+        ipas = g2p_ipa (SEQUITUR_MODEL, lex_base)
     
     else:
         tts.locale = locale
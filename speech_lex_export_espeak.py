@@ -30,9 +30,9 @@ import codecs
 
 from optparse           import OptionParser
 from speech_lexicon     import Lexicon
+from speech_dict_export import export_dict, ESpeakDictWriter
 from nltools            import misc
 from espeakng           import ESpeakNG
-from nltools.phonetics  import ipa2xsampa, xsampa2ipa, espeak2ipa, ipa2espeak
 
 # DEBUG_LIMIT = 0
 DEBUG_LIMIT = 1000
@@ -77,50 +77,19 @@ logging.info ( "loading lexicon...done.")
 # espeak
 #
 
-if options.lang == 'en':
-    esng = ESpeakNG(voice='english-us')
-elif options.lang =='de':
-    esng = ESpeakNG(voice='de')
-else:
+voices = { 'en': 'english-us',
+           'de': 'de' }
+
+if not options.lang in voices:
     raise Exception ('no support for language %s yet.' % options.lang)
 
+esng = ESpeakNG(voice=voices[options.lang])
+
 #
-# main loop
+# main
 #
 
-cnt     = 0
-cnt_new = 0
-
-outfn   = '%s_extra' % options.lang
-
-with codecs.open (outfn, 'w', 'utf8') as outf:
-
-    for word in lex:
-
-        cnt += 1
-
-        if '_' in word:
-            continue
-
-        entry = lex[word]
-        ipa1 = entry['ipa'].replace(u'-',u'').replace(u'ʔ',u'')
-        es1  = ipa2espeak (word, ipa1, stress_to_vowels=True)
-        es2  = esng.g2p (word)
-        ipa2 = espeak2ipa (word, es2)
-        es2  = ipa2espeak (word, ipa2, stress_to_vowels=True)
-
-        if es1 == es2:
-            logging.info (u'%6d/%6d [      MATCH] %s' % (cnt, len(lex), word))
-            continue
-
-        cnt_new += 1
-        logging.info (u'%6d/%6d [new: %6d] %s -> %s : %s' % (cnt, len(lex), cnt_new, word, es1, es2))
-
-        outf.write(u'%s\t%s\n' % (word, es1))
-
-        if DEBUG_LIMIT and cnt_new >= DEBUG_LIMIT:
-            break
-
-logging.info ('%d entries written to %s .' % (cnt_new, outfn))
+outfn = '%s_extra' % options.lang
 
+export_dict(lex, [ESpeakDictWriter(outfn, esng, voices[options.lang], limit=DEBUG_LIMIT)])
 
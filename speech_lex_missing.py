@@ -36,10 +36,11 @@ from optparse               import OptionParser
 from nltools                import misc
 from nltools.tokenizer      import tokenize
 from nltools.phonetics      import ipa2xsampa, xsampa2ipa
-from nltools.sequiturclient import sequitur_gen_ipa
 
 from speech_transcripts     import Transcripts
+from speech_tokenizer_cache import tokenize_cached, prefetch_tokens
 from speech_lexicon         import Lexicon
+from speech_g2p             import g2p_ipa_multi
 
 SEQUITUR_MODEL  = 'data/models/sequitur-%s-latest'
 
@@ -119,6 +120,10 @@ logging.info("loading transcripts from %s ..." % corpus_name)
 transcripts = Transcripts(corpus_name=corpus_name)
 logging.info("loading transcripts...done.")
 
+logging.info("tokenizing prompts...")
+prefetch_tokens([transcripts[cfn]['prompt'] for cfn in transcripts], lang=options.lang)
+logging.info("tokenizing prompts...done.")
+
 
 #
 # find missing words
@@ -147,7 +152,7 @@ for cfn in transcripts:
     # do_trace = True if 'snatcher' in ts['prompt'] else False
     do_trace = False
 
-    for word in tokenize(ts['prompt'], lang=options.lang):
+    for word in tokenize_cached(ts['prompt'], lang=options.lang):
 
         if word in lex:
             if do_trace:
@@ -171,7 +176,8 @@ for cfn in transcripts:
     else:
         num_ts_complete += 1
 
-cnt = 0
+cnt       = 0
+gen_words = []
 for item in reversed(sorted(missing.items(), key=lambda x: x[1])):
 
     cnt += 1
@@ -197,10 +203,20 @@ for item in reversed(sorted(missing.items(), key=lambda x: x[1])):
                 logging.info(u"%4d/%4d not generating phonemes for entry %s because it is too common" % (cnt, options.num_words, item[0]))
                 continue
 
-        ipas = sequitur_gen_ipa (sequitur_model, item[0])
-        logging.info(u"%4d/%4d generated lex entry: %s -> %s" % (cnt, options.num_words, item[0], ipas))
-        lex[item[0]] = {'ipa': ipas}
+        gen_words.append(item[0])
+
+if gen_words:
 
+    # one batch for all words, so the model gets loaded only once (if at all)
+
+    ipa_map = g2p_ipa_multi(sequitur_model, gen_words)
+
+    for cnt, word in enumerate(gen_words):
+        if not word in ipa_map:
+            logging.warn(u"%4d/%4d failed to generate lex entry for %s" % (cnt+1, len(gen_words), word))
+            continue
+        logging.info(u"%4d/%4d generated lex entry: %s -> %s" % (cnt+1, len(gen_words), word, ipa_map[word]))
+        lex[word] = {'ipa': ipa_map[word]}
 
 logging.info("%d missing words total. %d submissions lack at least one word, %d are covered fully by the lexicon." % (len(missing), num_ts_lacking, num_ts_complete))
 
@@ -18,15 +18,212 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+import sys
+import mmap
+import atexit
+import inspect
+import array
 import codecs
+import struct
+import bisect
+import hashlib
+import logging
 
-from nltools.phonetics import _normalize, IPA_normalization
+from nltools           import misc
+from nltools           import phonetics
+from nltools.phonetics import _normalize, IPA_normalization, ipa2xsampa
 
 #
 # Lexicon load/save abstraction
 #
 
-DICT_PATH = 'data/src/dicts/%s'
+DICT_PATH  = 'data/src/dicts/%s'
+CACHE_PATH = 'data/dst/cache/lexicon_%s.bin'
+XSAMPA_CACHE_PATH = 'data/dst/cache/xsampa.txt'
+
+#
+# normalizing all entries of a big dictionary takes seconds, so the normalized
+# lexicon is compiled into a binary cache which is mmap'd on load:
+#
+# header  : magic, version, #entries, dict mtime, dict size, dict md5,
+#           normalization md5, len(keys)
+# offsets : (#entries+1) x uint32, ipa offsets into the ipa blob
+# keys    : utf8, '\n' separated, sorted
+# ipa     : utf8, normalized ipa of each entry
+#
+
+CACHE_MAGIC   = 'ZLX1'
+CACHE_VERSION = 1
+CACHE_HEADER  = struct.Struct('<4sIIdQ16s16sQ')
+
+def _md5(fn):
+
+    m = hashlib.md5()
+    with open(fn, 'rb') as f:
+        while True:
+            buf = f.read(1 << 20)
+            if not buf:
+                break
+            m.update(buf)
+    return m.digest()
+
+def _norm_md5():
+    return hashlib.md5(repr(sorted(IPA_normalization.items()))).digest()
+
+def _read_dict(dictfn):
+
+    """parse and normalize a dictionary file, returns sorted (keys, ipas)"""
+
+    entries = {}
+
+    with open(dictfn, 'r') as f:
+
+        while True:
+
+            line = f.readline().rstrip().decode('utf8')
+
+            if not line:
+                break
+
+            parts = line.split(';')
+            # print repr(parts)
+
+            entries[parts[0]] = _normalize (parts[1],  IPA_normalization)
+
+    keys = sorted(entries)
+
+    return keys, [ entries[k] for k in keys ]
+
+class LexiconStore(object):
+
+    """
+    read-only, mmap'd view on a compiled lexicon: sorted keys, ipa decoded on
+    access. Recompiled whenever the dictionary file or the normalization
+    table changes.
+    """
+
+    def __init__(self, dictfn, cachefn):
+
+        self.dictfn  = dictfn
+        self.cachefn = cachefn
+
+        if not self._valid():
+            keys, ipas = _read_dict(dictfn)
+            self.compile(dictfn, cachefn, keys, ipas)
+
+        self._open()
+
+    def _valid(self):
+
+        if not os.path.exists(self.cachefn):
+            return False
+
+        with open(self.cachefn, 'rb') as f:
+            hdr = f.read(CACHE_HEADER.size)
+
+        if len(hdr) != CACHE_HEADER.size:
+            return False
+
+        magic, version, n, mtime, size, md5, norm_md5, keys_len = CACHE_HEADER.unpack(hdr)
+
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or norm_md5 != _norm_md5():
+            return False
+
+        st = os.stat(self.dictfn)
+        if st.st_size != size:
+            return False
+        if st.st_mtime == mtime:
+            return True
+
+        # touched but maybe not modified
+
+        if _md5(self.dictfn) != md5:
+            return False
+
+        with open(self.cachefn, 'r+b') as f:
+            f.write(CACHE_HEADER.pack(magic, version, n, st.st_mtime, size, md5, norm_md5, keys_len))
+
+        return True
+
+    @staticmethod
+    def compile(dictfn, cachefn, keys, ipas):
+
+        logging.debug ('compiling lexicon cache %s ...' % cachefn)
+
+        st  = os.stat(dictfn)
+        md5 = _md5(dictfn)
+
+        keys_blob = u'\n'.join(keys).encode('utf8')
+
+        offsets = [0]
+        blob    = []
+        for ipa in ipas:
+            b = ipa.encode('utf8')
+            blob.append(b)
+            offsets.append(offsets[-1] + len(b))
+
+        offsets = array.array('I', offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+
+        misc.mkdirs(os.path.dirname(cachefn))
+
+        tmpfn = '%s.%d.tmp' % (cachefn, os.getpid())
+        with open(tmpfn, 'wb') as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(keys), st.st_mtime, st.st_size, md5, _norm_md5(), len(keys_blob)))
+            f.write(offsets.tostring())
+            f.write(keys_blob)
+            f.write(''.join(blob))
+        os.rename(tmpfn, cachefn)
+
+        logging.debug ('compiling lexicon cache %s ... done, %d entries.' % (cachefn, len(keys)))
+
+    def _open(self):
+
+        with open(self.cachefn, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n, mtime, size, md5, norm_md5, keys_len = CACHE_HEADER.unpack_from(self.mm, 0)
+
+        self.md5       = md5 + norm_md5
+
+        self.off_base  = CACHE_HEADER.size
+        self.key_base  = self.off_base + (self.n + 1) * 4
+        self.ipa_base  = self.key_base + keys_len
+
+        if self.n:
+            self.keys = self.mm[self.key_base:self.ipa_base].decode('utf8').split(u'\n')
+        else:
+            self.keys = []
+
+    def index(self, key):
+
+        """index of key or -1"""
+
+        idx = bisect.bisect_left(self.keys, key)
+        if idx < self.n and self.keys[idx] == key:
+            return idx
+        return -1
+
+    def ipa(self, idx):
+        start, end = struct.unpack_from('<II', self.mm, self.off_base + idx * 4)
+        return self.mm[self.ipa_base + start:self.ipa_base + end].decode('utf8')
+
+    def multi_keys(self, b):
+
+        """keys of all variants of base word b: b itself and b_*"""
+
+        res = []
+        if self.index(b) >= 0:
+            res.append(b)
+
+        # '`' sorts right after '_'
+        idx = bisect.bisect_left(self.keys, b + u'_')
+        end = bisect.bisect_left(self.keys, b + u'`')
+        res.extend(self.keys[idx:end])
+
+        return res
 
 class Lexicon(object):
 
@@ -34,64 +231,248 @@ class Lexicon(object):
         """Load a lexicon
 
         :param file_name: E.g. dict-de.ipa or dict-en.ipa.
+
+        Entries come from the binary lexicon cache and are decoded on first
+        access. to_dict() and to_multidict() (base word -> variants) build the
+        whole lexicon as a dict, use get_multi() for the variants of one word.
         """
 
-        self.file_name  = file_name
-        self.dictionary = {}
-        self.multidict  = {}
+        self.file_name = file_name
+        self._entries  = {}    # decoded, modified and added entries
+        self._added    = set() # keys not in the cache
+        self._removed  = set() # cache keys removed
 
-        with open(DICT_PATH % self.file_name, 'r') as f:
+        try:
+            self._store = LexiconStore(DICT_PATH % file_name, CACHE_PATH % file_name)
+        except (IOError, OSError, mmap.error) as e:
+            logging.warn ('%s: failed to use lexicon cache (%s), normalizing all entries.' % (file_name, e))
+            self._store = None
+            for k, ipa in zip(*_read_dict(DICT_PATH % file_name)):
+                self._entries[k] = {'ipa': ipa}
+                self._added.add(k)
 
-            while True:
+    def _get(self, key):
 
-                line = f.readline().rstrip().decode('utf8')
+        v = self._entries.get(key)
+        if v is not None or key in self._removed or self._store is None:
+            return v
 
-                if not line:
-                    break
+        idx = self._store.index(key)
+        if idx < 0:
+            return None
 
-                parts = line.split(';')
-                # print repr(parts)
+        v = {'ipa': self._store.ipa(idx)}
+        self._entries[key] = v
 
-                ipas = _normalize (parts[1],  IPA_normalization)
+        return v
 
-                k = parts[0]
-                v = {'ipa': ipas}
+    def keys(self):
 
-                self.dictionary[k] = v
-                b = k.split('_')[0]
-                if not b in self.multidict:
-                    self.multidict[b] = {}
-                self.multidict[b][k] = v
+        if self._store is None:
+            return list(self._added)
 
+        if not self._added and not self._removed:
+            return list(self._store.keys)
+
+        keys = set(self._store.keys)
+        keys.update(self._added)
+        keys.difference_update(self._removed)
+
+        return list(keys)
+
+    def to_dict(self):
+
+        """all entries as a new dict key -> entry, decodes the whole lexicon"""
+
+        return dict([ (k, self[k]) for k in self.keys() ])
+
+    def to_multidict(self):
+
+        """all entries as a new dict base word -> {key: entry}, decodes the whole lexicon"""
+
+        multidict = {}
+        for k in self.keys():
+            multidict.setdefault(k.split('_')[0], {})[k] = self[k]
+        return multidict
 
     def __len__(self):
-        return len(self.dictionary)
+        n = self._store.n if self._store else 0
+        return n + len(self._added) - len(self._removed)
 
     def __getitem__(self, key):
-        return self.dictionary[key]
+        v = self._get(key)
+        if v is None:
+            raise KeyError(key)
+        return v
 
     def __iter__(self):
-        return iter(sorted(self.dictionary))
+        return iter(sorted(self.keys()))
 
     def __setitem__(self, k, v):
-        self.dictionary[k] = v
-        b = k.split('_')[0]
-        if not b in self.multidict:
-            self.multidict[b] = {}
-        self.multidict[b][k] = v
+        self._entries[k] = v
+        if k in self._removed:
+            self._removed.remove(k)
+        elif self._store is None or self._store.index(k) < 0:
+            self._added.add(k)
 
     def __contains__(self, key):
-        return key in self.dictionary
+        return self._get(key) is not None
+
+    def content_hash(self):
+
+        """
+        md5 hex digest of the lexicon contents including unsaved modifications,
+        only entries touched since loading need to be looked at
+        """
+
+        m = hashlib.md5()
+
+        if self._store is not None:
+            m.update(self._store.md5)
+
+        for k in sorted(self._entries):
+            ipa = self._entries[k]['ipa']
+            if (self._store is None) or (k in self._added) or (self._store.ipa(self._store.index(k)) != ipa):
+                m.update((u'%s;%s\n' % (k, ipa)).encode('utf8'))
+
+        for k in sorted(self._removed):
+            m.update((u'-%s\n' % k).encode('utf8'))
+
+        return m.hexdigest()
+
+    def xsampa(self, key):
+        return xsampa(key, self[key]['ipa'])
 
     def get_multi(self, k):
+
         b = k.split('_')[0]
-        return self.multidict[b]
+
+        keys = set(self._store.multi_keys(b)) if self._store else set()
+        for k2 in self._added:
+            if k2 == b or k2.startswith(b + u'_'):
+                keys.add(k2)
+        keys.difference_update(self._removed)
+
+        if not keys:
+            raise KeyError(b)
+
+        return dict([ (k2, self[k2]) for k2 in keys ])
 
     def save(self):
-        with codecs.open(DICT_PATH % self.file_name, 'w', 'utf8') as f:
-            for w in sorted(self.dictionary):
-                entry = self.dictionary[w]
-                f.write(u"%s;%s\n" % (w, entry['ipa']))
+
+        dictfn = DICT_PATH % self.file_name
+
+        keys = sorted(self.keys())
+        ipas = [ self[w]['ipa'] for w in keys ]
+
+        with codecs.open(dictfn, 'w', 'utf8') as f:
+            for w, ipa in zip(keys, ipas):
+                f.write(u"%s;%s\n" % (w, ipa))
+
+        # entries are normalized already, so the cache can be written right away
+
+        try:
+            LexiconStore.compile(dictfn, CACHE_PATH % self.file_name, keys, ipas)
+        except (IOError, OSError) as e:
+            logging.warn ('%s: failed to update lexicon cache: %s' % (self.file_name, e))
 
     def remove(self, key):
-        del self.dictionary[key]
+        if not key in self:
+            raise KeyError(key)
+        del self._entries[key]
+        if key in self._added:
+            self._added.remove(key)
+        else:
+            self._removed.add(key)
+
+#
+# IPA -> X-SAMPA as used in our kaldi and wav2letter dictionaries. Conversion
+# results are memoized by ipa and kept in XSAMPA_CACHE_PATH, which is
+# invalidated when the nltools.phonetics source changes.
+#
+
+def phonetics_version():
+
+    srcfn = inspect.getsourcefile(phonetics)
+    if not srcfn or not os.path.exists(srcfn):
+        srcfn = phonetics.__file__
+
+    m = hashlib.md5()
+    with open(srcfn, 'rb') as f:
+        m.update(f.read())
+
+    return m.hexdigest()
+
+class XSampaCache(object):
+
+    def __init__(self, fn=XSAMPA_CACHE_PATH):
+
+        self.fn      = fn
+        self.version = phonetics_version()
+        self.memo    = {}
+        self.added   = 0
+
+        if os.path.exists(fn):
+            with codecs.open(fn, 'r', 'utf8') as f:
+                if f.readline().rstrip() == self.version:
+                    for line in f:
+                        parts = line.rstrip(u'\n').split(u'\t')
+                        if len(parts) == 2:
+                            self.memo[parts[0]] = parts[1]
+
+        atexit.register(self.save)
+
+    def xsampa(self, token, ipa):
+
+        """
+        X-SAMPA pronunciation of ipa, phonemes separated by spaces, stress
+        marks attached to the following phoneme, # replaced by nC
+        """
+
+        xs = self.memo.get(ipa)
+
+        if xs is None:
+
+            xsr = ipa2xsampa(token, ipa, spaces=True)
+
+            xs = (xsr.replace('-', '')
+                     .replace('\' ', '\'')
+                     .replace('  ', ' ')
+                     .replace('#', 'nC'))
+
+            self.memo[ipa] = xs
+            self.added += 1
+
+        return xs
+
+    def save(self):
+
+        if not self.added:
+            return
+
+        try:
+            misc.mkdirs(os.path.dirname(self.fn))
+            tmpfn = '%s.%d.tmp' % (self.fn, os.getpid())
+            with codecs.open(tmpfn, 'w', 'utf8') as f:
+                f.write(u'%s\n' % self.version)
+                for ipa in sorted(self.memo):
+                    f.write(u'%s\t%s\n' % (ipa, self.memo[ipa]))
+            os.rename(tmpfn, self.fn)
+        except (IOError, OSError) as e:
+            logging.warn ('failed to write %s: %s' % (self.fn, e))
+            return
+
+        logging.debug ('%s written, %d entries (%d new).' % (self.fn, len(self.memo), self.added))
+
+        self.added = 0
+
+_xsampa_cache = None
+
+def xsampa(token, ipa):
+
+    global _xsampa_cache
+
+    if _xsampa_cache is None:
+        _xsampa_cache = XSampaCache()
+
+    return _xsampa_cache.xsampa(token, ipa)
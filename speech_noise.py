@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# noise augmentation as done by speech_gen_noisy.py, on numpy arrays
+#
+# The recipe is the one of the original sox pipeline:
+#
+#   sox -m "|sox --norm=<fg_level> fg1 speech fg2 -p compand 0.01,0.2 -90,-10 -5 reverb <reverb_level>" \
+#          "|sox --norm=<bg_level> bg -p trim <bg_off> <fg_len>" out.wav
+#
+# i.e. speech framed by two foreground noises, peak normalized, companded
+# and reverberated, mixed 1:1 (each at half the amplitude, like sox -m) with
+# a peak normalized stretch of background noise. sox's reverb is a freeverb
+# style filter network, here it is approximated by convolution with a
+# synthetic impulse response (exponentially decaying, slightly low passed
+# noise) whose length and level grow with the reverberance.
+#
+# NoiseBank decodes all noise files once into a single float32 file plus a
+# json index of offsets. Noises keep their original level: the foreground
+# noises are normalized together with the speech they frame, so scaling them
+# beforehand would change the speech to noise ratio. The bank is memory-mapped
+# read only, pool workers forked after it has been opened share the same
+# pages and cutting a stretch of background noise is just a slice.
+#
+
+import os
+import json
+import wave
+import logging
+
+from nltools           import misc
+from speech_audio_norm import np, read_wav, downmix, normalize_peak, compand, Compander
+
+NOISE_BANK         = 'data/dst/cache/noise_bank.f32'
+NOISE_BANK_VERSION = 1
+
+# sox compand 0.01,0.2 -90,-10 -5
+NOISY_COMPANDER = Compander(0.01, 0.2, 0.01, [(-90.0, -10.0)], -5.0, 0.0, 0.0)
+
+REVERB_MIN_RT60 = 0.2 # reverb decay time (to -60dB) in seconds at 0% and 100% reverberance
+REVERB_MAX_RT60 = 1.8
+REVERB_DAMPING  = 4   # moving average length damping the high frequencies of the reverb tail
+
+def read_mono(fn, offset=0.0, duration=None):
+
+    """mono float samples and sample rate of wav fn, optionally just duration seconds from offset"""
+
+    if offset <= 0.0 and duration is None:
+        x, rate = read_wav(fn)
+        return downmix(x), rate
+
+    wavf = wave.open(fn, 'rb')
+    try:
+        rate      = wavf.getframerate()
+        nchannels = wavf.getnchannels()
+        if wavf.getsampwidth() != 2:
+            raise wave.Error('%s: only 16 bit wavs can be read partially' % fn)
+
+        start = min(int(round(offset * rate)), wavf.getnframes())
+        n     = wavf.getnframes() - start if duration is None else int(round(duration * rate))
+
+        wavf.setpos(start)
+        data = wavf.readframes(n)
+    finally:
+        wavf.close()
+
+    x = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+
+    return downmix(x.reshape(-1, nchannels)), rate
+
+class NoiseBank(object):
+
+    def __init__(self, noisefns, rate, bankfn=NOISE_BANK):
+
+        """
+        noise files noisefns (wavs at sample rate rate), (re-)built whenever
+        the set of files, their sizes or mtimes change
+        """
+
+        self.bankfn  = bankfn
+        self.indexfn = os.path.splitext(bankfn)[0] + '.json'
+        self.rate    = rate
+
+        sources = {}
+        for fn in noisefns:
+            st = os.stat(fn)
+            sources[fn] = [st.st_size, st.st_mtime]
+
+        index = self._load_index()
+        if not index or (index['sources'] != sources) or (index['rate'] != rate):
+            self.build(sources)
+            index = self._load_index()
+
+        self.index = index['offsets']
+        self.data  = np.memmap(bankfn, dtype='<f4', mode='r') if os.path.getsize(bankfn) else np.zeros(0, dtype='<f4')
+
+    def _load_index(self):
+
+        if not os.path.exists(self.indexfn) or not os.path.exists(self.bankfn):
+            return None
+
+        with open(self.indexfn, 'r') as f:
+            index = json.load(f)
+
+        if index.get('version') != NOISE_BANK_VERSION:
+            return None
+
+        return index
+
+    def build(self, sources):
+
+        logging.info ('building noise bank %s from %d files ...' % (self.bankfn, len(sources)))
+
+        misc.mkdirs(os.path.dirname(self.bankfn))
+
+        offsets = {} # fn -> (offset, number of samples)
+        pos     = 0
+
+        tmpfn = '%s.tmp%d' % (self.bankfn, os.getpid())
+        with open(tmpfn, 'wb') as f:
+
+            for fn in sorted(sources):
+
+                x, rate = read_mono(fn)
+                if rate != self.rate:
+                    raise Exception ('%s: wrong framerate %d' % (fn, rate))
+
+                x = x.astype('<f4')
+                f.write(x.tostring())
+
+                offsets[fn] = (pos, len(x))
+                pos += len(x)
+
+        os.rename(tmpfn, self.bankfn)
+
+        # index last: a bank without (matching) index gets rebuilt
+
+        with open(self.indexfn, 'w') as f:
+            json.dump({'version': NOISE_BANK_VERSION, 'rate': self.rate, 'sources': sources, 'offsets': offsets}, f)
+
+        logging.info ('building noise bank %s ... done, %.1f hours of noise.' % (self.bankfn, float(pos) / self.rate / 3600.0))
+
+    def samples(self, fn, offset=0.0, duration=None):
+
+        """samples of noise file fn (no copy), optionally just duration seconds from offset"""
+
+        start, n = self.index[fn]
+
+        skip = min(int(round(offset * self.rate)), n)
+        if duration is not None:
+            n = min(skip + int(round(duration * self.rate)), n)
+
+        return self.data[start + skip:start + n]
+
+def reverb_ir(rate, reverberance, rng):
+
+    """impulse response of the reverb tail (no direct sound), reverberance in percent"""
+
+    r    = max(0.0, min(reverberance, 100.0)) / 100.0
+    rt60 = REVERB_MIN_RT60 + (REVERB_MAX_RT60 - REVERB_MIN_RT60) * r
+    n    = max(1, int(rt60 * rate))
+
+    t    = np.arange(n, dtype=np.float32) / rate
+    tail = rng.standard_normal(n).astype(np.float32) * np.exp(-6.9 * t / rt60).astype(np.float32)
+    tail = np.convolve(tail, np.ones(REVERB_DAMPING, dtype=np.float32) / REVERB_DAMPING)[:n]
+
+    # unit energy tail, scaled by the reverberance
+
+    energy = np.sqrt(np.sum(np.square(tail, dtype=np.float64)))
+
+    return tail * (r / energy) if energy > 0.0 else tail
+
+def fft_convolve(x, h):
+
+    """x convolved with h, truncated to len(x)"""
+
+    n    = len(x) + len(h) - 1
+    nfft = 1 << (n - 1).bit_length()
+
+    y = np.fft.irfft(np.fft.rfft(x, nfft) * np.fft.rfft(h, nfft), nfft)
+
+    return y[:len(x)].astype(np.float32)
+
+def reverb(x, rate, reverberance, rng):
+
+    """dry signal plus reverb tail, same length as x"""
+
+    if not len(x) or reverberance <= 0.0:
+        return x
+
+    return x + fft_convolve(x, reverb_ir(rate, reverberance, rng))
+
+def noisy_mix(speech, fg1, fg2, bg, rate, fg_level, bg_level, reverb_level, rng):
+
+    """
+    speech framed by foreground noises fg1 and fg2, mixed with background
+    noise bg (at least as long as the foreground), levels in dBFS
+    """
+
+    fg = np.concatenate([fg1, speech, fg2])
+    fg = normalize_peak(fg, fg_level)
+    fg = compand(fg, rate, NOISY_COMPANDER)
+    fg = reverb(fg, rate, reverb_level, rng)
+
+    bg = normalize_peak(bg[:len(fg)], bg_level)
+
+    y = fg * 0.5
+    y[:len(bg)] += bg * 0.5
+
+    return y
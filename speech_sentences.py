@@ -41,6 +41,7 @@ import parole
 
 from parole             import load_punkt_tokenizer
 from speech_transcripts import Transcripts
+from speech_tokenizer_cache import tokenize_cached, prefetch_tokens
 
 PROC_TITLE             = 'speech_sentences'
 
@@ -245,10 +246,11 @@ def proc_transcripts(corpus_name):
 
     transcripts = Transcripts(corpus_name=corpus_name)
 
-    if use_prompts:
-        transcripts_set = set((u' '.join(tokenize(transcripts[key]["prompt"], lang))) for key in transcripts)
-    else:
-        transcripts_set = set( (u' '.join(tokenize(transcripts[key]["ts"], lang)))  for key in transcripts )
+    field = "prompt" if use_prompts else "ts"
+
+    prefetch_tokens([transcripts[key][field] for key in transcripts], lang=lang)
+
+    transcripts_set = set( (u' '.join(tokenize_cached(transcripts[key][field], lang)))  for key in transcripts )
 
     for ts in transcripts_set:
         yield ts
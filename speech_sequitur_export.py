@@ -26,13 +26,12 @@ import sys
 import logging
 import codecs
 import traceback
-import random
 
 from optparse           import OptionParser
 from nltools            import misc
-from nltools.phonetics  import ipa2xsampa
 
 from speech_lexicon     import Lexicon
+from speech_dict_export import export_dict, SequiturDictWriter
 
 DEFAULT_DICT='dict-de.ipa'
 
@@ -81,27 +80,7 @@ logging.info("loading lexicon...done.")
 # export
 #
 
-misc.mkdirs(workdir)
-
-with codecs.open('%s/train.lex' % workdir, 'w', 'utf8') as trainf, \
-     codecs.open('%s/test.lex'  % workdir, 'w', 'utf8') as testf, \
-     codecs.open('%s/all.lex'  % workdir, 'w', 'utf8') as allf :
-
-    cnt = 0
-
-    for word in lex:
-
-        ipa = lex[word]['ipa']
-
-        xs = ipa2xsampa (word, ipa, spaces=True, stress_to_vowels=False)
-
-        if options.ratio < random.random():
-            testf.write (u'%s %s\n' % (word, xs))
-        else:
-            trainf.write (u'%s %s\n' % (word, xs))
-        allf.write (u'%s %s\n' % (word, xs))
-
-        cnt += 1
+export_dict(lex, [SequiturDictWriter(workdir, ratio=options.ratio)])
 
 logging.info('sequitur workdir %s done.' % workdir)
 
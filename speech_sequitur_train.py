@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# sequitur g2p training: model-1 is trained from scratch, every following
+# stage ramps up the previous one. Each model is evaluated on test.lex while
+# the next stage trains, k-fold cross validation runs the folds side by side.
+# Word and phoneme error rates plus timings of all stages end up in
+# summary.json in the work dir.
+#
+
+import os
+import re
+import sys
+import json
+import time
+import codecs
+import logging
+import subprocess
+
+from optparse           import OptionParser
+from multiprocessing    import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from nltools            import misc
+from speech_dict_export import split_hash
+
+PROC_TITLE     = 'speech_sequitur_train'
+
+SEQUITUR_ROOT  = '/apps/sequitur'
+DEFAULT_STAGES = 6
+
+RE_STRING_ERRORS = re.compile(r'string errors:\s+(\d+)\s+\(\s*([0-9.]+)%\)')
+RE_SYMBOL_ERRORS = re.compile(r'symbol errors:\s+(\d+)\s+\(\s*([0-9.]+)%\)')
+
+def sequitur_env(sequitur_root):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ':'.join(filter(None, ['%s/lib64/python2.7/site-packages/' % sequitur_root, env.get('PYTHONPATH')]))
+    env['PATH']       = '%s/bin:%s' % (sequitur_root, env.get('PATH', ''))
+
+    return env
+
+def run_g2p(workdir, args, outfn, env):
+
+    """run g2p.py in workdir, output goes to outfn, returns the time it took"""
+
+    cmd = ['g2p.py', '--encoding=UTF8'] + args
+    logging.debug ('%s: %s > %s' % (workdir, ' '.join(cmd), outfn))
+
+    t0 = time.time()
+    with open('%s/%s' % (workdir, outfn), 'w') as outf:
+        res = subprocess.call(cmd, cwd=workdir, env=env, stdout=outf, stderr=subprocess.STDOUT)
+    if res:
+        raise Exception ('%s: g2p.py %s failed, see %s' % (workdir, ' '.join(args), outfn))
+
+    return time.time() - t0
+
+def parse_test(testfn):
+
+    """word (string) and phoneme (symbol) error rates from g2p.py --test output"""
+
+    with open(testfn) as f:
+        out = f.read()
+
+    ms = RE_STRING_ERRORS.search(out)
+    mp = RE_SYMBOL_ERRORS.search(out)
+    if not ms or not mp:
+        raise Exception ('%s: failed to parse error rates' % testfn)
+
+    return float(ms.group(2)), float(mp.group(2))
+
+def test_model(workdir, model, lexfn, env):
+
+    testfn = '%s.test' % model if lexfn == 'test.lex' else '%s-%s.test' % (model, os.path.splitext(lexfn)[0])
+    secs   = run_g2p(workdir, ['--model', model, '--test', lexfn], testfn, env)
+    wer, per = parse_test('%s/%s' % (workdir, testfn))
+
+    logging.info ('%s: %s on %s: WER %5.2f%% PER %5.2f%% (%.0fs)' % (workdir, model, lexfn, wer, per, secs))
+
+    return {'lex': lexfn, 'wer': wer, 'per': per, 'secs': secs}
+
+def train(workdir, stages, testpool, env, test_all=False):
+
+    """
+    train all stages in workdir, tests are handed to testpool as soon as a
+    model is written so they overlap with the next stage's training
+    """
+
+    results = []
+
+    for stage in range(1, stages+1):
+
+        model = 'model-%d' % stage
+        args  = ['--train', 'train.lex', '--devel', '5%', '--write-model', model]
+        if stage > 1:
+            args = ['--model', 'model-%d' % (stage-1), '--ramp-up'] + args
+
+        logging.info ('%s: training %s ...' % (workdir, model))
+        secs = run_g2p(workdir, args, '%s.log' % model, env)
+        logging.info ('%s: training %s ... done (%.0fs).' % (workdir, model, secs))
+
+        tests = [ testpool.apply_async(test_model, (workdir, model, 'test.lex', env)) ]
+
+        # testing the final model on all.lex is useful to check for inconsistencies in manual entries
+        if test_all and stage == stages:
+            tests.append(testpool.apply_async(test_model, (workdir, model, 'all.lex', env)))
+
+        results.append((model, secs, tests))
+
+    summary = []
+    for model, secs, tests in results:
+        summary.append({'model': model, 'train_secs': secs, 'tests': [ t.get() for t in tests ]})
+
+    return summary
+
+def split_folds(workdir, folds):
+
+    """split all.lex into folds by word hash, returns the fold work dirs"""
+
+    with codecs.open('%s/all.lex' % workdir, 'r', 'utf8') as f:
+        entries = [ line for line in f if line.strip() ]
+
+    folddirs = []
+    for fold in range(folds):
+
+        folddn = '%s/fold-%d' % (workdir, fold)
+        misc.mkdirs(folddn)
+
+        with codecs.open('%s/train.lex' % folddn, 'w', 'utf8') as trainf, \
+             codecs.open('%s/test.lex'  % folddn, 'w', 'utf8') as testf:
+            for line in entries:
+                if int(split_hash(line.split(' ', 1)[0]) * folds) == fold:
+                    testf.write(line)
+                else:
+                    trainf.write(line)
+
+        folddirs.append(folddn)
+
+    logging.info ('%s: %d entries split into %d folds.' % (workdir, len(entries), folds))
+
+    return folddirs
+
+#
+# init
+#
+
+misc.init_app (PROC_TITLE)
+
+#
+# commandline
+#
+
+parser = OptionParser("usage: %prog [options] <dict>")
+
+parser.add_option ("-k", "--folds", dest="folds", type="int", default=0,
+                   help="k-fold cross validation on all.lex instead of the train/test split, default: off")
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=cpu_count(),
+                   help="number of g2p.py processes to run in parallel, default: %d" % cpu_count())
+parser.add_option ("-r", "--sequitur-root", dest="sequitur_root", type="str", default=SEQUITUR_ROOT,
+                   help="sequitur installation, default: %s" % SEQUITUR_ROOT)
+parser.add_option ("-s", "--stages", dest="stages", type="int", default=DEFAULT_STAGES,
+                   help="number of training stages, default: %d" % DEFAULT_STAGES)
+parser.add_option ("-w", "--workdir", dest="workdir", type="str",
+                   help="work dir (containing train.lex, test.lex, all.lex), default: data/dst/dict-models/<dict>/sequitur")
+parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
+                   help="verbose output")
+
+(options, args) = parser.parse_args()
+
+if options.verbose:
+    logging.basicConfig(level=logging.DEBUG)
+else:
+    logging.basicConfig(level=logging.INFO)
+
+if options.workdir:
+    workdir = options.workdir
+elif len(args) == 1:
+    workdir = 'data/dst/dict-models/%s/sequitur' % args[0]
+else:
+    parser.print_usage()
+    sys.exit(1)
+
+env = sequitur_env(options.sequitur_root)
+
+#
+# train
+#
+
+t0       = time.time()
+testpool = ThreadPool(options.num_cpus)
+
+if options.folds > 1:
+
+    folddirs  = split_folds(workdir, options.folds)
+    trainpool = ThreadPool(min(options.folds, options.num_cpus))
+    jobs      = [ trainpool.apply_async(train, (folddn, options.stages, testpool, env)) for folddn in folddirs ]
+    folds     = [ job.get() for job in jobs ]
+    trainpool.close()
+
+    # average error rates per stage across folds
+
+    cv = []
+    for i in range(options.stages):
+        wers = [ fold[i]['tests'][0]['wer'] for fold in folds ]
+        pers = [ fold[i]['tests'][0]['per'] for fold in folds ]
+        cv.append({'model': 'model-%d' % (i+1),
+                   'wer'  : sum(wers) / len(wers),
+                   'per'  : sum(pers) / len(pers)})
+        logging.info ('%d-fold cv: model-%d: WER %5.2f%% PER %5.2f%%' % (options.folds, i+1, cv[-1]['wer'], cv[-1]['per']))
+
+    summary = {'folds': dict(zip([ os.path.basename(dn) for dn in folddirs ], folds)), 'cv': cv}
+
+else:
+
+    summary = {'stages': train(workdir, options.stages, testpool, env, test_all=True)}
+
+testpool.close()
+
+summary['total_secs'] = time.time() - t0
+
+summaryfn = '%s/summary.json' % workdir
+with open(summaryfn, 'w') as f:
+    json.dump(summary, f, indent=2, sort_keys=True)
+
+logging.info ('%s written.' % summaryfn)
+
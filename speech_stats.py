@@ -27,12 +27,12 @@ import re
 import os
 import StringIO
 import ConfigParser
-import wave
 import codecs
 import logging
 
 from optparse           import OptionParser
-from speech_transcripts import Transcripts
+from speech_transcripts import Transcripts, DEFAULT_NUM_CPUS
+from speech_audio_meta  import AudioMetaIndex
 from speech_lexicon     import Lexicon
 from nltools            import misc
 
@@ -55,6 +55,10 @@ parser = OptionParser("usage: %prog [options] corpus")
 
 parser.add_option ("-c", "--csv", dest="csvfn", type = "str",
                    help="CSV output file")
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                   help="number of cpus to use for updating the audio metadata index, default: %d" % DEFAULT_NUM_CPUS)
+parser.add_option ("-r", "--refresh", action="store_true", dest="refresh",
+                   help="re-check size and mtime of all audio files already in the audio metadata index")
 parser.add_option ("-s", "--speaker-stats", action="store_true", dest="speaker_stats", 
                    help="show per-speaker stats")
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose", 
@@ -98,6 +102,13 @@ logging.info("loading transcripts...")
 transcripts = Transcripts(corpus_name=corpus_name)
 logging.info("loading transcripts...done.")
 
+#
+# audio metadata
+#
+
+audio_meta = AudioMetaIndex(corpus_name, '%s/%s' % (wav16_dir, corpus_name))
+audio_meta.update(transcripts.keys(), num_cpus=options.num_cpus, refresh=options.refresh)
+
 #
 # compute stats
 #
@@ -131,12 +142,12 @@ for cfn in transcripts:
     else:
         s = 'train'
 
-    wavfn = '%s/%s/%s.wav' % (wav16_dir, corpus_name, cfn)
-    wavef = wave.open(wavfn, 'rb')
-    num_frames = wavef.getnframes()
-    frame_rate = wavef.getframerate()
-    duration = float(num_frames) / float(frame_rate)
-    wavef.close()
+    info = audio_meta.get(cfn)
+    if not info:
+        logging.error('%s: audio file missing' % audio_meta.wavfn(cfn))
+        continue
+
+    duration = info.duration
 
     # print '%s has %d frames at %d samples/s -> %fs' % (wavfn, num_frames, frame_rate, duration)
 
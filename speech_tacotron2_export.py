@@ -111,23 +111,16 @@ with codecs.open(valfn, 'w', 'utf8') as valf:
     with codecs.open(trainfn, 'w', 'utf8') as trainf:
 
         cnt = 0
-        for cfn in transcripts:
+        for ts in transcripts.iter(min_quality=MIN_QUALITY, spk=speaker):
 
-            ts = transcripts[cfn]
-
-            if ts['quality'] < MIN_QUALITY:
-                continue
-
-            if ts['spk'] != speaker:
-                # logging.debug(ts['spk'])
-                continue
+            cfn = ts['cfn']
 
             ts_orig  = ts['ts']
 
             wavfn = '%s/%s/%s.wav' % (wav16_dir, corpus_name, cfn)
             
             if cnt % 100 == 0:
-                logging.info('%7d / %7d %-30s %s' % (cnt, len(transcripts), wavfn, ts_orig[:80]))
+                logging.info('%7d %-30s %s' % (cnt, wavfn, ts_orig[:80]))
 
             if cnt % 20 == 0:
                 valf.write('%s|%s\n' % (wavfn, ts_orig))
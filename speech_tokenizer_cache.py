@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# persistent tokenization cache
+#
+# tokenize() results are stored in an sqlite db keyed by
+# (lang, tokenizer version, flags, md5(text)), with an in-memory LRU in front.
+# The tokenizer version is a hash of the nltools.tokenizer source, so cached
+# results get ignored as soon as the tokenizer changes.
+#
+
+import os
+import atexit
+import hashlib
+import inspect
+import logging
+import sqlite3
+
+from collections       import OrderedDict
+
+from nltools           import misc
+from nltools           import tokenizer
+from nltools.tokenizer import tokenize
+
+CACHE_DIR        = 'data/dst/cache'
+TOKENIZER_DBFN   = '%s/tokenizer.sqlite' % CACHE_DIR
+LRU_SIZE         = 200000
+FLUSH_RATE       = 1000
+BATCH_SIZE       = 500
+
+def tokenizer_version():
+
+    srcfn = inspect.getsourcefile(tokenizer)
+    if not srcfn or not os.path.exists(srcfn):
+        srcfn = tokenizer.__file__
+
+    m = hashlib.md5()
+    with open(srcfn, 'rb') as f:
+        m.update(f.read())
+
+    return m.hexdigest()
+
+def _default_lang():
+
+    # the language nltools' tokenize() uses when none is given, so the cache
+    # is a drop-in replacement for it
+
+    argspec = inspect.getargspec(tokenize)
+
+    return argspec.defaults[argspec.args.index('lang') - len(argspec.args) + len(argspec.defaults)]
+
+DEFAULT_LANG = _default_lang()
+
+def _text_hash(text):
+    return hashlib.md5(text.encode('utf8')).hexdigest()
+
+class TokenizerCache(object):
+
+    def __init__(self, dbfn=TOKENIZER_DBFN, lru_size=LRU_SIZE):
+
+        misc.mkdirs(os.path.dirname(dbfn))
+
+        self.version  = tokenizer_version()
+        self.lru      = OrderedDict()
+        self.lru_size = lru_size
+        self.pending  = []
+        self.hits     = 0
+        self.misses   = 0
+
+        self.conn = sqlite3.connect(dbfn, timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tokens (lang TEXT, version TEXT, flags INTEGER, hash TEXT, tokens TEXT, PRIMARY KEY (lang, version, flags, hash))')
+        self.conn.commit()
+
+        atexit.register(self.flush)
+
+    def _lru_get(self, key):
+        tokens = self.lru.pop(key, None)
+        if tokens is not None:
+            self.lru[key] = tokens
+        return tokens
+
+    def _lru_put(self, key, tokens):
+        self.lru.pop(key, None)
+        self.lru[key] = tokens
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def _db_get(self, lang, flags, hashes):
+
+        res = {}
+        for i in range(0, len(hashes), BATCH_SIZE):
+            batch = hashes[i:i+BATCH_SIZE]
+            cur = self.conn.execute('SELECT hash, tokens FROM tokens WHERE lang=? AND version=? AND flags=? AND hash IN (%s)' % ','.join(['?'] * len(batch)),
+                                    [lang, self.version, flags] + batch)
+            for h, tokens in cur:
+                res[h] = tuple(tokens.split(u'\n')) if tokens else ()
+        return res
+
+    def _store(self, lang, flags, h, tokens):
+        self.pending.append((lang, self.version, flags, h, u'\n'.join(tokens)))
+        if len(self.pending) >= FLUSH_RATE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.conn.executemany('INSERT OR REPLACE INTO tokens VALUES (?,?,?,?,?)', self.pending)
+        self.conn.commit()
+        logging.debug ('tokenizer cache: %d entries written.' % len(self.pending))
+        self.pending = []
+
+    def tokenize(self, text, lang=DEFAULT_LANG, keep_punctuation=False):
+
+        flags = 1 if keep_punctuation else 0
+        h     = _text_hash(text)
+        key   = (lang, flags, h)
+
+        tokens = self._lru_get(key)
+        if tokens is None:
+            tokens = self._db_get(lang, flags, [h]).get(h)
+            if tokens is None:
+                self.misses += 1
+                tokens = tuple(tokenize(text, lang=lang, keep_punctuation=keep_punctuation))
+                self._store(lang, flags, h, tokens)
+            else:
+                self.hits += 1
+            self._lru_put(key, tokens)
+        else:
+            self.hits += 1
+
+        return list(tokens)
+
+    def prefetch(self, texts, lang=DEFAULT_LANG, keep_punctuation=False):
+
+        """
+        bulk-load cached results for texts (e.g. all prompts of a corpus)
+        into the LRU, tokenize and store the ones not cached yet
+        """
+
+        flags = 1 if keep_punctuation else 0
+
+        todo = {}
+        for text in texts:
+            h = _text_hash(text)
+            if (lang, flags, h) in self.lru:
+                continue
+            todo[h] = text
+
+        found = self._db_get(lang, flags, todo.keys())
+
+        for h in todo:
+            tokens = found.get(h)
+            if tokens is None:
+                tokens = tuple(tokenize(todo[h], lang=lang, keep_punctuation=keep_punctuation))
+                self._store(lang, flags, h, tokens)
+            self._lru_put((lang, flags, h), tokens)
+
+        self.flush()
+
+        logging.debug ('tokenizer cache: prefetched %d texts, %d were cached already.' % (len(todo), len(found)))
+
+_cache = None
+
+def get_tokenizer_cache():
+
+    global _cache
+
+    if _cache is None:
+        _cache = TokenizerCache()
+
+    return _cache
+
+def tokenize_cached(text, lang=DEFAULT_LANG, keep_punctuation=False):
+    return get_tokenizer_cache().tokenize(text, lang=lang, keep_punctuation=keep_punctuation)
+
+def prefetch_tokens(texts, lang=DEFAULT_LANG, keep_punctuation=False):
+    get_tokenizer_cache().prefetch(texts, lang=lang, keep_punctuation=keep_punctuation)
+
@@ -24,22 +24,731 @@
 # quality: 0=not reviewed, 1=poor, 2=fair, 3=good
 
 import os
+import sys
+import time
+import fcntl
 import codecs
 import logging
+import struct
+import array
+import mmap
+import hashlib
+import multiprocessing
+import bisect
 
 from nltools           import misc
 from nltools.tokenizer import tokenize
 
 TSDIR    = 'data/src/speech/%s'
 SPK_TEST = 'data/src/speech/%s/spk_test.txt'
+JOURNAL  = 'data/src/speech/%s/journal.csv'
 MAXLINES = 100000 # used to split up transcript.csvs
- 
+
+DEFAULT_NUM_CPUS = 4
+
+#
+# backends: 'csv'  parses all transcripts_NN.csv shards into a dict at load time,
+#           'mmap' compiles each shard into a transcripts_NN.bin store next to it
+#                  and decodes entries lazily on access
+#
+
+BACKEND_CSV  = 'csv'
+BACKEND_MMAP = 'mmap'
+
+#
+# binary store layout (all little endian):
+#
+# header  : magic, version, #entries, csv mtime, csv size, csv md5, len(keys)
+# offsets : (#entries+1) x uint32, entry offsets into the data blob
+# quality : #entries x uint8
+# keys    : utf8, '\n' separated, sorted
+# data    : utf8 'dirfn;audiofn;prompt;ts;quality' per entry
+#
+
+STORE_MAGIC   = 'ZTS1'
+STORE_VERSION = 1
+STORE_HEADER  = struct.Struct('<4sIIdQ16sQ')
+
+#
+# review journal: small edits (ratings, ts) are appended to journal.csv as
+# 'cfn;field;value;timestamp' lines instead of rewriting the shards. The journal
+# is replayed on load and compacted into the shards by save().
+#
+
+JOURNAL_FIELDS = ('prompt', 'ts', 'quality')
+
+#
+# transcript entries are the single biggest item in memory when dealing with
+# large corpora: use a compact __slots__ record instead of one dict per utterance,
+# with speaker ids interned so they are shared between all entries of a speaker
+#
+
+ENTRY_FIELDS = ('cfn', 'dirfn', 'audiofn', 'prompt', 'ts', 'quality', 'spk', 'corpus_name')
+
+_interned = {}
+
+def _intern(s):
+    return _interned.setdefault(s, s)
+
+class TranscriptEntry(object):
+
+    """
+    a transcript entry - dict-compatible for callers, reports modifications
+    to the dirty set of the Transcripts object it belongs to and remembers
+    the shard (transcripts_NN.csv) it is stored in
+    """
+
+    __slots__ = ENTRY_FIELDS + ('extra', 'shard', 'dirty')
+
+    def __init__(self, v, shard=None, dirty=None):
+        self.cfn         = None
+        self.dirfn       = None
+        self.audiofn     = None
+        self.prompt      = None
+        self.ts          = None
+        self.quality     = None
+        self.spk         = None
+        self.corpus_name = None
+        self.extra       = None
+        for k in v:
+            self._set(k, v[k])
+        self.shard       = shard
+        self.dirty       = dirty
+
+    def _set(self, k, v):
+        if k in ENTRY_FIELDS:
+            if k == 'spk' or k == 'corpus_name':
+                v = _intern(v)
+            setattr(self, k, v)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[k] = v
+
+    def _touch(self):
+        if self.dirty is not None:
+            self.dirty.add(self.cfn)
+
+    def __getitem__(self, k):
+        if k in ENTRY_FIELDS:
+            v = getattr(self, k)
+            if v is not None:
+                return v
+        elif self.extra and k in self.extra:
+            return self.extra[k]
+        raise KeyError(k)
+
+    def __setitem__(self, k, v):
+        self._set(k, v)
+        self._touch()
+
+    def __delitem__(self, k):
+        if k in ENTRY_FIELDS:
+            self[k]
+            setattr(self, k, None)
+        else:
+            if not self.extra or not k in self.extra:
+                raise KeyError(k)
+            del self.extra[k]
+        self._touch()
+
+    def __contains__(self, k):
+        if k in ENTRY_FIELDS:
+            return getattr(self, k) is not None
+        return bool(self.extra) and (k in self.extra)
+
+    has_key = __contains__
+
+    def keys(self):
+        res = [ k for k in ENTRY_FIELDS if getattr(self, k) is not None ]
+        if self.extra:
+            res.extend(self.extra.keys())
+        return res
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def setdefault(self, k, default=None):
+        if not k in self:
+            self._set(k, default)
+        return self[k]
+
+    def update(self, *args, **kwargs):
+        for v in args + (kwargs,):
+            for k in v:
+                self._set(k, v[k])
+        self._touch()
+
+    def values(self):
+        return [ self[k] for k in self.keys() ]
+
+    def items(self):
+        return [ (k, self[k]) for k in self.keys() ]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, TranscriptEntry):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+def _mk_entry(corpus_name, parts, shard=None, dirty=None):
+
+    # fast path, this is called once per utterance at load time
+
+    cfn = parts[0]
+
+    v = TranscriptEntry.__new__(TranscriptEntry)
+
+    v.cfn         = cfn
+    v.dirfn       = parts[1]
+    v.audiofn     = parts[2]
+    v.prompt      = parts[3]
+    v.ts          = parts[4]
+    v.quality     = int(parts[5])
+    v.spk         = _intern(cfn.split('-')[0])
+    v.corpus_name = corpus_name
+    v.extra       = None
+    v.shard       = shard
+    v.dirty       = dirty
+
+    return v
+
+def _shard_num(tsfn):
+    try:
+        return int(tsfn[len('transcripts_'):-len('.csv')])
+    except ValueError:
+        return -1
+
+def _read_shard(csvfn):
+
+    rows = []
+
+    # decoding the whole shard at once is a lot faster than codecs' readline()
+
+    with open(csvfn, 'rb') as f:
+        lines = f.read().decode('utf8').splitlines()
+
+    for line in lines:
+
+        line = line.rstrip()
+
+        if not line:
+            break
+
+        parts = line.split(';')
+        # print repr(parts)
+
+        if len(parts) != 6:
+            raise Exception("***ERROR in transcripts: %s" % line)
+
+        rows.append(parts)
+
+    return rows
+
+def _shard_fns(tsdir):
+
+    res = []
+    for tsfn in sorted(os.listdir(tsdir)):
+
+        if not tsfn.startswith('transcripts') or not tsfn.endswith('.csv'):
+            continue
+
+        res.append(tsfn)
+
+    return res
+
+def _match(v, quality=None, min_quality=None, spk=None, prefix=None):
+
+    if (quality is not None) and (v['quality'] != quality):
+        return False
+    if (min_quality is not None) and (v['quality'] < min_quality):
+        return False
+    if spk and (v['spk'] != spk):
+        return False
+    if prefix and not v['cfn'].startswith(prefix):
+        return False
+    return True
+
+def _stream_shard(csvfn, corpus_name, quality=None, min_quality=None, spk=None, prefix=None, journal=None):
+
+    """
+    generator: stream entries of a csv shard matching the given criteria. cfn,
+    speaker and quality are checked on the raw line, only matching lines get
+    decoded into entries. journal (cfn -> {field: value}) changes are applied
+    before matching.
+    """
+
+    tsfn    = os.path.basename(csvfn)
+    bprefix = prefix.encode('utf8') if prefix else None
+    bspk    = spk.encode('utf8') if spk else None
+
+    with open(csvfn, 'rb') as f:
+
+        for line in f:
+
+            line = line.rstrip()
+
+            if not line:
+                break
+
+            if line.count(';') != 5:
+                raise Exception("***ERROR in transcripts: %s" % line.decode('utf8', 'replace'))
+
+            if bprefix and not line.startswith(bprefix):
+                continue
+
+            if bspk and not (line.startswith(bspk + '-') or line.startswith(bspk + ';')):
+                continue
+
+            if journal:
+                changes = journal.get(line[:line.find(';')].decode('utf8'))
+                if changes:
+                    v = _mk_entry(corpus_name, line.decode('utf8').split(u';'), shard=tsfn)
+                    for k in changes:
+                        v._set(k, changes[k])
+                    if _match(v, quality, min_quality, spk, prefix):
+                        yield v
+                    continue
+
+            if (quality is not None) or (min_quality is not None):
+                q = int(line[line.rfind(';')+1:])
+                if (quality is not None) and (q != quality):
+                    continue
+                if (min_quality is not None) and (q < min_quality):
+                    continue
+
+            yield _mk_entry(corpus_name, line.decode('utf8').split(u';'), shard=tsfn)
+
+def _read_journal(fn, offset=0):
+
+    """
+    read journal entries starting at offset, returns (changes, end offset) where
+    changes maps cfn -> {field: value}, later entries overriding earlier ones.
+    A trailing partial line (writer died mid-append) is left for the next read.
+    A journal shorter than offset has been compacted (truncated) by another
+    process's save() since, it is then read from the start.
+    """
+
+    changes = {}
+
+    if not os.path.exists(fn):
+        return changes, 0
+
+    with open(fn, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < offset:
+            logging.info ('%s: journal has been compacted by another process, re-reading it.' % fn)
+            offset = 0
+        f.seek(offset)
+        data = f.read()
+
+    end = data.rfind('\n') + 1
+
+    for line in data[:end].decode('utf8').splitlines():
+
+        try:
+            cfn, field, rest = line.split(u';', 2)
+            value, stamp     = rest.rsplit(u';', 1)
+            if field == 'quality':
+                value = int(value)
+        except ValueError:
+            logging.warn ('%s: skipping malformed journal entry: %s' % (fn, line))
+            continue
+
+        if not field in JOURNAL_FIELDS:
+            logging.warn ('%s: skipping journal entry for unsupported field: %s' % (fn, line))
+            continue
+
+        changes.setdefault(cfn, {})[field] = value
+
+    return changes, offset + end
+
+def _append_journal(fn, lines):
+
+    # a single O_APPEND write under an exclusive lock, so concurrent writers
+    # (reviewers, parallel auto-review workers) never interleave their lines
+
+    data = u''.join(lines).encode('utf8')
+
+    fd = os.open(fn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        while data:
+            data = data[os.write(fd, data):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _journal_line(cfn, field, value, stamp):
+    if field == 'quality':
+        value = u'%d' % value
+    return u'%s;%s;%s;%.3f\n' % (cfn, field, value.replace(u'\n', u' '), stamp)
+
+def _md5(fn):
+
+    m = hashlib.md5()
+    with open(fn, 'rb') as f:
+        while True:
+            buf = f.read(1 << 20)
+            if not buf:
+                break
+            m.update(buf)
+    return m.digest()
+
+def _uint32_array(l):
+    a = array.array('I', l)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+class TranscriptShardStore(object):
+
+    """
+    memory-mapped, compiled version of a single transcripts_NN.csv shard,
+    (re-)built automatically whenever the csv's mtime/size and md5 changes
+    """
+
+    def __init__(self, csvfn):
+
+        self.csvfn = csvfn
+        self.tsfn  = os.path.basename(csvfn)
+        self.binfn = os.path.splitext(csvfn)[0] + '.bin'
+
+        st = os.stat(csvfn)
+
+        if not self._open(st):
+            self.compile(st)
+            if not self._open(st):
+                raise Exception("***ERROR: failed to open transcript store %s" % self.binfn)
+
+    def _open(self, st):
+
+        if not os.path.exists(self.binfn) or (os.path.getsize(self.binfn) < STORE_HEADER.size):
+            return False
+
+        with open(self.binfn, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n, mtime, size, digest, keys_len = STORE_HEADER.unpack_from(mm, 0)
+
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            mm.close()
+            return False
+
+        if (mtime != st.st_mtime) or (size != st.st_size):
+
+            # csv got touched - only recompile if its contents really changed
+
+            if (size != st.st_size) or (digest != _md5(self.csvfn)):
+                mm.close()
+                return False
+
+            logging.debug ('%s: contents unchanged, updating mtime' % self.binfn)
+            mm.close()
+            with open(self.binfn, 'r+b') as f:
+                f.write(STORE_HEADER.pack(magic, version, n, st.st_mtime, size, digest, keys_len))
+            with open(self.binfn, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.mm        = mm
+        self.n         = n
+        self.off_base  = STORE_HEADER.size
+        self.q_base    = self.off_base + (n+1) * 4
+        self.key_base  = self.q_base + n
+        self.data_base = self.key_base + keys_len
+        self._keys     = None
+
+        return True
+
+    def compile(self, st):
+
+        logging.info ('compiling transcript store %s ...' % self.binfn)
+
+        rows = sorted(_read_shard(self.csvfn), key=lambda parts: parts[0])
+
+        keys    = u'\n'.join([parts[0] for parts in rows]).encode('utf8')
+        data    = []
+        offsets = [0]
+        pos     = 0
+        for parts in rows:
+            rec = u';'.join(parts[1:]).encode('utf8')
+            data.append(rec)
+            pos += len(rec)
+            offsets.append(pos)
+
+        quality = array.array('B', [int(parts[5]) for parts in rows])
+
+        header = STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(rows), st.st_mtime, st.st_size,
+                                   _md5(self.csvfn), len(keys))
+
+        tmpfn = '%s.tmp%d' % (self.binfn, os.getpid())
+        with open(tmpfn, 'wb') as f:
+            f.write(header)
+            f.write(_uint32_array(offsets).tostring())
+            f.write(quality.tostring())
+            f.write(keys)
+            for rec in data:
+                f.write(rec)
+        os.rename(tmpfn, self.binfn)
+
+        logging.info ('compiling transcript store %s ... done. %d entries.' % (self.binfn, len(rows)))
+
+    def keys(self):
+        if self._keys is None:
+            if self.n:
+                self._keys = self.mm[self.key_base:self.data_base].decode('utf8').split(u'\n')
+            else:
+                self._keys = []
+        return self._keys
+
+    def __len__(self):
+        return self.n
+
+    def quality(self, idx):
+        return ord(self.mm[self.q_base + idx])
+
+    def parts(self, idx):
+        start, end = struct.unpack_from('<II', self.mm, self.off_base + idx * 4)
+        rec = self.mm[self.data_base + start:self.data_base + end].decode('utf8')
+        return [self.keys()[idx]] + rec.split(u';')
+
+class TranscriptStore(object):
+
+    """
+    dict-like view on the binary shard stores of a corpus: keys are available
+    right away, entries get decoded on first access and are kept from then on
+    (so callers can modify them just like with the csv backend)
+    """
+
+    def __init__(self, corpus_name, shards, dirty=None):
+
+        self.corpus_name = corpus_name
+        self.shards      = shards
+        self.dirty       = dirty
+        self._index      = None # cfn -> (shard, idx), built on first lookup
+        self._entries    = {}   # decoded and added entries
+        self._added      = []   # cfns not present in any shard
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = {}
+            for shard in self.shards:
+                for idx, cfn in enumerate(shard.keys()):
+                    self._index[cfn] = (shard, idx)
+        return self._index
+
+    def keys(self):
+        if len(self.shards) == 1:
+            return self.shards[0].keys() + self._added
+        # shards may overlap, later ones take precedence
+        return self._get_index().keys() + self._added
+
+    def __len__(self):
+        if len(self.shards) == 1:
+            return len(self.shards[0]) + len(self._added)
+        return len(self._get_index()) + len(self._added)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return (key in self._entries) or (key in self._get_index())
+
+    def __getitem__(self, key):
+
+        if key in self._entries:
+            return self._entries[key]
+
+        shard, idx = self._get_index()[key]
+
+        v = _mk_entry(self.corpus_name, shard.parts(idx), shard=shard.tsfn, dirty=self.dirty)
+        self._entries[key] = v
+
+        return v
+
+    def __setitem__(self, key, v):
+        if not key in self:
+            self._added.append(key)
+        self._entries[key] = v
+
+    def iter(self, quality=None, min_quality=None, spk=None, prefix=None):
+
+        """
+        generator: entries matching the given criteria. The key prefix is
+        looked up via bisection in the sorted shard keys, quality is checked
+        in the store's quality column, so only matching entries get decoded.
+        """
+
+        key_prefix = prefix
+        if spk and not (prefix and prefix.startswith(spk)):
+            key_prefix = spk
+
+        for shard in self.shards:
+
+            keys = shard.keys()
+            idx  = bisect.bisect_left(keys, key_prefix) if key_prefix else 0
+
+            while idx < len(keys):
+
+                cfn = keys[idx]
+
+                if key_prefix and not cfn.startswith(key_prefix):
+                    break
+
+                if len(self.shards) > 1 and self._get_index()[cfn][0] is not shard:
+                    # overridden by a later shard
+                    idx += 1
+                    continue
+
+                if cfn in self._entries:
+                    v = self._entries[cfn]
+                    if _match(v, quality, min_quality, spk, prefix):
+                        yield v
+                    idx += 1
+                    continue
+
+                q = shard.quality(idx)
+                if ((quality is None) or (q == quality)) and ((min_quality is None) or (q >= min_quality)):
+                    if (not spk) or (cfn.split('-')[0] == spk):
+                        if (not prefix) or cfn.startswith(prefix):
+                            yield self[cfn]
+
+                idx += 1
+
+        for cfn in self._added:
+            v = self._entries[cfn]
+            if _match(v, quality, min_quality, spk, prefix):
+                yield v
+
+    def shard_keys(self, tsfn):
+        for shard in self.shards:
+            if shard.tsfn == tsfn:
+                return shard.keys()
+        return []
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def has_key(self, key):
+        return key in self
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self[key]
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+def _load_shard_job(job):
+
+    # process pool worker: parse a csv shard or make sure its binary store is up to date
+
+    csvfn, backend = job
+
+    if backend == BACKEND_MMAP:
+        try:
+            TranscriptShardStore(csvfn)
+        except (IOError, OSError, mmap.error) as e:
+            # main process will fall back to csv
+            logging.warn ('%s: failed to compile binary transcript store (%s)' % (csvfn, e))
+        return None
+
+    return _read_shard(csvfn)
+
+def _load_shards(jobs, num_cpus):
+
+    """run shard load jobs in a process pool, results are returned in job order"""
+
+    num_cpus = min(num_cpus, len(jobs), multiprocessing.cpu_count())
+
+    if num_cpus < 2:
+        return [ _load_shard_job(job) for job in jobs ]
+
+    pool = multiprocessing.Pool(num_cpus)
+    try:
+        res = pool.map(_load_shard_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    return res
+
+def load_transcripts(corpus_names, num_cpus=DEFAULT_NUM_CPUS, backend=BACKEND_CSV):
+
+    """
+    load several corpora at once: the shards of all corpora are parsed (or
+    compiled, for the mmap backend) concurrently, then merged per corpus in
+    shard order, so the result is the same as loading them one by one
+    """
+
+    jobs   = []
+    owners = []
+    for corpus_name in corpus_names:
+        tsdir = TSDIR % corpus_name
+        for tsfn in _shard_fns(tsdir):
+            jobs.append(('%s/%s' % (tsdir, tsfn), backend))
+            owners.append((corpus_name, tsfn))
+
+    preloaded = {}
+    for (corpus_name, tsfn), rows in zip(owners, _load_shards(jobs, num_cpus)):
+        preloaded.setdefault(corpus_name, {})[tsfn] = rows
+
+    return [ Transcripts(corpus_name, backend=backend, preloaded=preloaded.get(corpus_name, {})) for corpus_name in corpus_names ]
+
 class Transcripts(object):
 
-    def __init__(self, corpus_name, create_db=False):
+    def __init__(self, corpus_name, create_db=False, backend=BACKEND_CSV, num_cpus=1, preloaded=None):
+
+        """
+        num_cpus > 1 parses (mmap backend: compiles) the shards concurrently in
+        a process pool. preloaded (tsfn -> rows) is used by load_transcripts()
+        to hand over shards which have been parsed already.
+        """
 
         self.corpus_name  = corpus_name
-        self.ts    = {}
+        self._ts   = None # csv backend: loaded on first access, see ts property
         self.tsdir = TSDIR % corpus_name
 
         if create_db:
@@ -47,45 +756,33 @@ class Transcripts(object):
                 logging.info ('creating %s' % self.tsdir)
                 misc.mkdirs(self.tsdir)
 
-        for tsfn in os.listdir(self.tsdir):
-
-            if not tsfn.startswith('transcripts') or not tsfn.endswith('.csv'):
-                continue
-
-            with codecs.open('%s/%s' % (self.tsdir, tsfn), 'r', 'utf8') as f:
+        self.backend   = backend
+        self.shards    = self._shard_fns()
+        self.members   = {}    # tsfn -> cfns stored in that shard
+        self.dirty     = set() # cfns modified since load/last save
+        self.journaled = set() # cfns with journal changes not compacted into the shards yet
 
-                while True:
+        self.journal_fn = JOURNAL % corpus_name
+        self._journal, self._journal_offset = _read_journal(self.journal_fn)
+        self._journal_pending = []
 
-                    line = f.readline().rstrip()
+        if preloaded is None:
+            preloaded = {}
+            if num_cpus > 1:
+                jobs = [ ('%s/%s' % (self.tsdir, tsfn), self.backend) for tsfn in self.shards ]
+                preloaded = dict(zip(self.shards, _load_shards(jobs, num_cpus)))
 
-                    if not line:
-                        break
+        if self.backend == BACKEND_MMAP:
+            try:
+                shards = [ TranscriptShardStore('%s/%s' % (self.tsdir, tsfn)) for tsfn in self.shards ]
+                self._ts = TranscriptStore(corpus_name, shards, dirty=self.dirty)
+                self._replay_journal(self._journal)
+            except (IOError, OSError, mmap.error) as e:
+                logging.warn ('%s: failed to use binary transcript store (%s), falling back to csv.' % (corpus_name, e))
+                self.backend = BACKEND_CSV
 
-                    parts = line.split(';')
-                    # print repr(parts)
-
-                    if len(parts) != 6:
-                        raise Exception("***ERROR in transcripts: %s" % line)
-                        
-                    cfn     = parts[0]
-                    dirfn   = parts[1]
-                    audiofn = parts[2]
-                    prompt  = parts[3]
-                    ts      = parts[4]
-                    quality = int(parts[5])
-                    spk     = cfn.split('-')[0]
-
-                    v = { 'cfn'        : cfn,
-                          'dirfn'      : dirfn,
-                          'audiofn'    : audiofn,
-                          'prompt'     : prompt,
-                          'ts'         : ts,
-                          'quality'    : quality,
-                          'spk'        : spk,
-                          'corpus_name': self.corpus_name
-                          }
-
-                    self.ts[cfn] = v
+        if (self.backend == BACKEND_CSV) and preloaded:
+            self._load_csv(preloaded)
 
         spk_test_fn = SPK_TEST % corpus_name
 
@@ -100,6 +797,83 @@ class Transcripts(object):
             for line in f:
                 self.spk_test.add(line.strip())
 
+        self.split_stats    = None
+        self._spk_test_lens = None
+
+
+    def _load_csv(self, preloaded={}):
+
+        self._ts = {}
+        for tsfn in self.shards:
+            members = []
+            rows    = preloaded.get(tsfn)
+            if rows is None:
+                rows = _read_shard('%s/%s' % (self.tsdir, tsfn))
+            for parts in rows:
+                self._ts[parts[0]] = _mk_entry(self.corpus_name, parts, shard=tsfn, dirty=self.dirty)
+                members.append(parts[0])
+            self.members[tsfn] = members
+
+        self._replay_journal(self._journal)
+
+    def _replay_journal(self, changes):
+
+        # apply journal changes to loaded entries without marking them dirty,
+        # they are in the journal already
+
+        for cfn in changes:
+            if not cfn in self._ts:
+                logging.warn ('%s: journal entry for unknown utterance %s ignored.' % (self.corpus_name, cfn))
+                continue
+            v = self._ts[cfn]
+            for k in changes[cfn]:
+                v._set(k, changes[cfn][k])
+            self.journaled.add(cfn)
+
+    @property
+    def ts(self):
+        if self._ts is None:
+            self._load_csv()
+        return self._ts
+
+    def iter(self, quality=None, min_quality=None, spk=None, prefix=None):
+
+        """
+        generator: stream entries matching all of the given criteria (exact
+        quality, minimum quality, speaker, cfn prefix).
+
+        Unless the corpus has been loaded already, entries are streamed
+        straight from the shard files (mmap backend: from the binary store)
+        and the criteria are checked before an entry is decoded, so the
+        corpus is never materialized as a whole. Entries streamed from csv
+        shards are not attached to this object - use transcripts[cfn] to
+        modify an entry.
+        """
+
+        if self._ts is None:
+            for tsfn in self.shards:
+                for v in _stream_shard('%s/%s' % (self.tsdir, tsfn), self.corpus_name,
+                                       quality=quality, min_quality=min_quality, spk=spk, prefix=prefix,
+                                       journal=self._journal):
+                    yield v
+
+        elif self.backend == BACKEND_MMAP:
+            for v in self._ts.iter(quality=quality, min_quality=min_quality, spk=spk, prefix=prefix):
+                yield v
+
+        else:
+            for cfn in sorted(self._ts):
+                v = self._ts[cfn]
+                if _match(v, quality, min_quality, spk, prefix):
+                    yield v
+
+    def _shard_fns(self):
+        return _shard_fns(self.tsdir)
+
+    def _get_members(self, tsfn):
+        if not tsfn in self.members:
+            self.members[tsfn] = list(self.ts.shard_keys(tsfn)) if self.backend == BACKEND_MMAP else []
+        return self.members[tsfn]
 
     def keys(self):
         return self.ts.keys()
@@ -114,33 +888,236 @@ class Transcripts(object):
         return iter(sorted(self.ts))
 
     def __setitem__(self, key, v):
+
+        if not isinstance(v, TranscriptEntry) or v.dirty is not self.dirty:
+
+            shard = self.ts[key].shard if key in self.ts else None
+
+            v = TranscriptEntry(v, shard=shard, dirty=self.dirty)
+            v.setdefault('cfn', key)
+            v.setdefault('spk', key.split('-')[0])
+            v.setdefault('corpus_name', self.corpus_name)
+
         self.ts[key] = v
+        self.dirty.add(key)
 
     def __contains__(self, key):
         return key in self.ts
 
-    def save(self):
+    def _write_shard(self, tsfn, cfns):
 
-        cnt = 0
-        fn = self.tsdir + '/transcripts.csv'
-        # f = codecs.open(fn, 'w', 'utf8')
-        f = None
+        # write to a temp file first so an interrupted save cannot corrupt the shard
+
+        fn    = '%s/%s' % (self.tsdir, tsfn)
+        tmpfn = '%s.tmp' % fn
+
+        with codecs.open(tmpfn, 'w', 'utf8') as f:
+            for cfn in sorted(cfns):
+                v = self.ts[cfn]
+                f.write(u"%s;%s;%s;%s;%s;%d\n" % (cfn, v['dirfn'], v['audiofn'], v['prompt'], v['ts'], v['quality']))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(tmpfn, fn)
+
+        logging.debug ('%s written (%d entries).' % (fn, len(cfns)))
+
+    def journal(self, cfn, **fields):
+
+        """
+        record changes of prompt, ts and/or quality of an existing entry, e.g.
+        transcripts.journal(cfn, quality=2). Changes are applied right away and
+        appended to the journal on commit() - the corpus does not need to be
+        loaded for this.
+        """
+
+        stamp = time.time()
+        for k in sorted(fields):
+            if not k in JOURNAL_FIELDS:
+                raise Exception('%s: field %s cannot be journaled' % (self.corpus_name, k))
+            self._journal_pending.append(_journal_line(cfn, k, fields[k], stamp))
+            self._journal.setdefault(cfn, {})[k] = fields[k]
 
-        for cfn in sorted(self.ts):
+        if self._ts is not None:
+            self._replay_journal({cfn: fields})
+
+    def commit(self):
+
+        """
+        cheap alternative to save() for small edits: append changes recorded via
+        journal() as well as prompt/ts/quality of all entries modified in place
+        to the journal. New entries can only be written by save().
+        """
+
+        stamp = time.time()
+        lines = self._journal_pending
+
+        for cfn in sorted(self.dirty):
             v = self.ts[cfn]
+            if v.shard is None:
+                continue
+            changes = self._journal.setdefault(cfn, {})
+            for k in JOURNAL_FIELDS:
+                lines.append(_journal_line(cfn, k, v[k], stamp))
+                changes[k] = v[k]
+            self.journaled.add(cfn)
+
+        self.dirty.difference_update(self.journaled)
+
+        if self.dirty:
+            logging.warn ('%s: %d new entries cannot be journaled, use save() to write them.' % (self.corpus_name, len(self.dirty)))
+
+        if not lines:
+            return
+
+        _append_journal(self.journal_fn, lines)
+        self._journal_pending = []
+
+        logging.debug ('%s: %d journal entries written.' % (self.corpus_name, len(lines)))
+
+    def _lock_journal(self):
+
+        # hold the journal lock while compacting so no concurrent commit() gets lost
+
+        if not os.path.exists(self.journal_fn):
+            return None
+
+        fd = os.open(self.journal_fn, os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        # pick up entries committed by others since we read the journal
+
+        changes, self._journal_offset = _read_journal(self.journal_fn, self._journal_offset)
+        for cfn in changes:
+            self._journal.setdefault(cfn, {}).update(changes[cfn])
+        if self._ts is not None:
+            self._replay_journal(changes)
+
+        return fd
+
+    def save(self, full=False):
+
+        """
+        write modified entries back to disk, compacting the journal into the
+        shards. By default, only the shards containing modified, journaled or
+        new entries are rewritten (new entries get appended to the last shard,
+        new shards are opened as needed), full=True re-sorts the whole corpus
+        into fresh MAXLINES-sized shards.
+        """
+
+        fd = self._lock_journal()
+        try:
+            if self._journal:
+                self.ts # load + replay
+
+            if full:
+                self._save_full()
+            elif self.dirty or self.journaled:
+                self._save_dirty()
+
+            if fd is not None:
+                os.ftruncate(fd, 0)
+                os.fsync(fd)
+
+            self._journal         = {}
+            self._journal_offset  = 0
+            self._journal_pending = []
+            self.journaled.clear()
+            self.dirty.clear()
+
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _save_dirty(self):
+
+        dirty_shards = set()
+        new_cfns     = []
+
+        for cfn in self.dirty | self.journaled:
+            shard = self.ts[cfn].shard
+            if shard is None:
+                new_cfns.append(cfn)
+            else:
+                dirty_shards.add(shard)
+
+        tsfn    = None
+        members = None
+        if self.shards:
+            tsfn    = sorted(self.shards, key=_shard_num)[-1]
+            members = self._get_members(tsfn)
+
+        for cfn in sorted(new_cfns):
+
+            if not tsfn or len(members) >= MAXLINES:
+                tsfn    = 'transcripts_%02d.csv' % (max([_shard_num(fn) for fn in self.shards] + [-1]) + 1)
+                members = []
+                self.members[tsfn] = members
+                self.shards.append(tsfn)
+
+            members.append(cfn)
+            self.ts[cfn].shard = tsfn
+            dirty_shards.add(tsfn)
+
+        for tsfn in sorted(dirty_shards):
+            self._write_shard(tsfn, self._get_members(tsfn))
+
+        logging.debug ('%s: %d shard(s) rewritten, %d modified, %d journaled, %d new entries.' % (self.corpus_name, len(dirty_shards), len(self.dirty), len(self.journaled), len(new_cfns)))
+
+    def _save_full(self):
+
+        shards  = []
+        members = {}
+        for cnt, cfn in enumerate(sorted(self.ts)):
 
             if cnt % MAXLINES == 0:
-                if f:
-                    f.close()
-                fn = self.tsdir + '/transcripts_%02d.csv' % (cnt / MAXLINES)
-                f = codecs.open(fn, 'w', 'utf8')
+                tsfn = 'transcripts_%02d.csv' % (cnt / MAXLINES)
+                shards.append(tsfn)
+                members[tsfn] = []
 
-            f.write(u"%s;%s;%s;%s;%s;%d\n" % (cfn, v['dirfn'], v['audiofn'], v['prompt'], v['ts'], v['quality']))
-            cnt += 1
+            members[tsfn].append(cfn)
+            self.ts[cfn].shard = tsfn
 
-        f.close()
+        for tsfn in shards:
+            self._write_shard(tsfn, members[tsfn])
 
-    def split(self, limit=0, min_quality=2, add_all=False):
+        # remove stale shards (and their compiled stores)
+
+        for tsfn in self.shards:
+            if tsfn in members:
+                continue
+            for fn in ['%s/%s' % (self.tsdir, tsfn), '%s/%s.bin' % (self.tsdir, os.path.splitext(tsfn)[0])]:
+                if os.path.exists(fn):
+                    logging.info ('removing stale shard %s' % fn)
+                    os.unlink(fn)
+
+        self.shards  = shards
+        self.members = members
+
+    def is_test(self, cfn):
+
+        """
+        utterances belong to the test set if their cfn starts with any of the
+        spk_test entries. Instead of trying each entry, look up the cfn's
+        prefixes for all distinct entry lengths in the spk_test set.
+        """
+
+        if self._spk_test_lens is None or self._spk_test_lens[0] != len(self.spk_test):
+            self._spk_test_lens = (len(self.spk_test), sorted(set([len(spk) for spk in self.spk_test])))
+
+        for l in self._spk_test_lens[1]:
+            if cfn[:l] in self.spk_test:
+                return True
+
+        return False
+
+    def split(self, limit=0, min_quality=2, add_all=False, durations=None):
+
+        """
+        split transcripts into all/train/test dicts. Statistics (number of
+        utterances, speakers and, if a durations dict utt_id -> seconds is
+        given, hours of audio) are stored in self.split_stats
+        """
 
         ts_all   = {}
         ts_train = {}
@@ -170,16 +1147,36 @@ class Transcripts(object):
 
             ts_all[cfn] = v
 
-            is_test = False
-            for spk in self.spk_test:
-                if cfn.startswith(spk):
-                    is_test = True
-                    break
-
-            if is_test:
+            if self.is_test(cfn):
                 ts_test[cfn]  = v
             else:
                 ts_train[cfn] = v
 
+        self.split_stats = {}
+        for name, tsd in [('all', ts_all), ('train', ts_train), ('test', ts_test)]:
+
+            speakers = set()
+            secs     = 0.0 if durations is not None else None
+            for cfn in tsd:
+                speakers.add(tsd[cfn]['spk'])
+                if durations is not None:
+                    secs += durations.get(cfn, 0.0)
+
+            self.split_stats[name] = { 'utterances': len(tsd),
+                                       'speakers'  : len(speakers),
+                                       'hours'     : secs / 3600.0 if secs is not None else None }
+
         return ts_all, ts_train, ts_test
 
+    def format_split_stats(self):
+
+        res = []
+        for name in ['train', 'test']:
+            st = self.split_stats[name]
+            if st['hours'] is None:
+                res.append('%d %s samples (%d speakers)' % (st['utterances'], name, st['speakers']))
+            else:
+                res.append('%d %s samples (%d speakers, %.1fh)' % (st['utterances'], name, st['speakers'], st['hours']))
+
+        return ', '.join(res)
+
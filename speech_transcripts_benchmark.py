@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# memory benchmark: plain dict vs TranscriptEntry records on a synthetic corpus
+#
+
+import os
+import sys
+import time
+import logging
+import resource
+import multiprocessing
+
+from optparse           import OptionParser
+
+from nltools            import misc
+from speech_transcripts import _mk_entry
+
+PROC_TITLE = 'speech_transcripts_benchmark'
+
+NUM_SPEAKERS = 2000
+
+def rss():
+
+    """current resident set size in bytes"""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def synth_parts(i):
+
+    spk    = u'speaker%04d-20190101-abc' % (i % NUM_SPEAKERS)
+    audiofn = u'de%06d' % i
+    prompt = u'DAS IST DER SYNTHETISCHE PROMPT NUMMER %d FÜR DEN BENCHMARK' % i
+
+    return [ u'%s_%s' % (spk, audiofn), spk, audiofn, prompt, prompt.lower(), u'2' ]
+
+def mk_dict(corpus_name, parts):
+
+    # representation used before TranscriptEntry was introduced
+
+    cfn = parts[0]
+
+    return { 'cfn'        : cfn,
+             'dirfn'      : parts[1],
+             'audiofn'    : parts[2],
+             'prompt'     : parts[3],
+             'ts'         : parts[4],
+             'quality'    : int(parts[5]),
+             'spk'        : cfn.split('-')[0],
+             'corpus_name': corpus_name
+             }
+
+def measure(mk, num_utts, res_queue):
+
+    corpus_name = 'synthetic'
+    keys        = [ synth_parts(i) for i in range(num_utts) ]
+    rss_start   = rss()
+    time_start  = time.time()
+
+    ts = {}
+    for parts in keys:
+        ts[parts[0]] = mk(corpus_name, parts)
+
+    res_queue.put((rss() - rss_start, time.time() - time_start))
+
+def run(name, mk, num_utts):
+
+    # run each variant in a fresh process so allocations don't get recycled
+
+    res_queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=measure, args=(mk, num_utts, res_queue))
+    p.start()
+    mem, secs = res_queue.get()
+    p.join()
+
+    logging.info ('%-16s: %8.1f MB, %6.1f bytes/utt, %5.2fs' % (name, float(mem) / 1024 / 1024, float(mem) / num_utts, secs))
+
+    return mem
+
+if __name__ == '__main__':
+
+    misc.init_app (PROC_TITLE)
+
+    parser = OptionParser("usage: %prog [options]")
+
+    parser.add_option ("-n", "--num-utts", dest="num_utts", type="int", default=1000000,
+                       help="number of synthetic utterances, default: 1000000")
+    parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
+                       help="verbose output")
+
+    (options, args) = parser.parse_args()
+
+    if options.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    logging.info ('building %d synthetic transcript entries per representation...' % options.num_utts)
+
+    mem_dict  = run('dict',            mk_dict,   options.num_utts)
+    mem_entry = run('TranscriptEntry', _mk_entry, options.num_utts)
+
+    logging.info ('memory reduction: %.1f%%' % (100.0 * (mem_dict - mem_entry) / mem_dict))
+
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# CorpusSource.audio() on small generated archives:
+#
+#   python -m unittest test_speech_archive
+#
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+import speech_archive
+
+from speech_archive import CorpusSource
+
+METADATA_PATTERN = r'^validated\.tsv$'
+AUDIO_PATTERN    = r'^clips/[^/]+\.mp3$'
+
+class TestCorpusSourceAudio(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmpdir   = tempfile.mkdtemp(prefix='test_speech_archive_')
+        self.spooldir = '%s/spool' % self.tmpdir
+        os.mkdir(self.spooldir)
+
+        # count the audio members spooled
+
+        self.num_spooled = 0
+        self.copyfileobj = shutil.copyfileobj
+
+        def copyfileobj(fsrc, fdst, *args):
+            self.num_spooled += 1
+            self.copyfileobj(fsrc, fdst, *args)
+
+        speech_archive.shutil.copyfileobj = copyfileobj
+
+    def tearDown(self):
+
+        speech_archive.shutil.copyfileobj = self.copyfileobj
+        shutil.rmtree(self.tmpdir)
+
+    def make_archive(self, members):
+
+        """corpus 'cv' packed as tar.gz, members [(relpath, data)] in this order"""
+
+        with tarfile.open('%s/cv.tar.gz' % self.tmpdir, 'w:gz') as tf:
+            for relpath, data in members:
+                ti      = tarfile.TarInfo('cv/%s' % relpath)
+                ti.size = len(data)
+                tf.addfile(ti, StringIO(data))
+
+        return CorpusSource(self.tmpdir, 'cv')
+
+    def read_audio(self, source, **kwargs):
+
+        def parse(relpath, data):
+            return [ 'clips/%s' % line for line in data.splitlines() ]
+
+        res = {}
+        for relpath, src, spooled in source.audio(METADATA_PATTERN, AUDIO_PATTERN, parse, self.spooldir, **kwargs):
+            if spooled:
+                with open(src, 'rb') as f:
+                    res[relpath] = f.read()
+                os.unlink(src)
+            else:
+                res[relpath] = src.read()
+
+        return res
+
+    def test_unreferenced_audio_after_metadata(self):
+
+        members  = [ ('clips/a.mp3', 'a'), ('clips/u1.mp3', 'u1'), ('validated.tsv', 'a.mp3\nb.mp3\n'), ('clips/b.mp3', 'b') ]
+        members += [ ('clips/u%d.mp3' % i, 'u%d' % i) for i in range(2, 10) ]
+
+        source = self.make_archive(members)
+
+        self.assertEqual(self.read_audio(source, num_metadata=1), {'clips/a.mp3': 'a', 'clips/b.mp3': 'b'})
+
+        # a and u1 came ahead of the metadata, nothing after it is spooled
+
+        self.assertEqual(self.num_spooled, 2)
+        self.assertEqual(os.listdir(self.spooldir), [])
+
+    def test_unknown_number_of_metadata_files(self):
+
+        source = self.make_archive([ ('validated.tsv', 'a.mp3\n'), ('clips/u1.mp3', 'u1'), ('clips/a.mp3', 'a') ])
+
+        self.assertEqual(self.read_audio(source), {'clips/a.mp3': 'a'})
+        self.assertEqual(self.num_spooled, 1)
+        self.assertEqual(os.listdir(self.spooldir), [])
+
+    def test_spool_overflow(self):
+
+        members = [ ('clips/a.mp3', 'aaaa'), ('clips/b.mp3', 'bbbb'), ('clips/u1.mp3', 'u1'), ('validated.tsv', 'a.mp3\nb.mp3\n') ]
+
+        source = self.make_archive(members)
+
+        # only a fits, b is read in a second pass
+
+        self.assertEqual(self.read_audio(source, num_metadata=1, max_spool=6), {'clips/a.mp3': 'aaaa', 'clips/b.mp3': 'bbbb'})
+        self.assertEqual(self.num_spooled, 2)
+        self.assertEqual(os.listdir(self.spooldir), [])
+
+if __name__ == '__main__':
+    unittest.main()
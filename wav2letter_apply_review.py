@@ -36,6 +36,7 @@ from nltools.phonetics      import ipa2xsampa
 
 from speech_lexicon         import Lexicon
 from speech_transcripts     import Transcripts
+from speech_tokenizer_cache import tokenize_cached
 
 APP_NAME            = 'wav2letter_apply_review'
 
@@ -53,6 +54,8 @@ misc.init_app(APP_NAME)
 
 parser = OptionParser("usage: %prog [options]")
 
+parser.add_option ("-c", "--compact", action="store_true", dest="compact", help="compact the review journal into the transcript shards afterwards")
+
 parser.add_option ("-l", "--lang", dest="lang", type = "str", default='de', help="language (default: de)")
 
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose", help="verbose output")
@@ -125,13 +128,22 @@ with codecs.open('%s/logs/.log' % WORK_DIR, 'r', 'utf8') as logf:
             transcripts = corpora[corpus]
     
         transcripts[utt_id]['quality'] = quality
-        transcripts[utt_id]['ts']      = u' '.join(tokenize(transcripts[utt_id]['prompt'], lang=lang, keep_punctuation=True))
+        transcripts[utt_id]['ts']      = u' '.join(tokenize_cached(transcripts[utt_id]['prompt'], lang=lang, keep_punctuation=True))
 
         cnt += 1
 
 logging.info ('results applied to %d transcripts.' % cnt)
 
-logging.info("saving transcripts...")
-transcripts.save()
-logging.info("saving transcripts...done.")
+for corpus in sorted(corpora):
+
+    transcripts = corpora[corpus]
+
+    logging.info("committing results for %s to the review journal..." % corpus)
+    transcripts.commit()
+    logging.info("committing results for %s to the review journal...done." % corpus)
+
+    if options.compact:
+        logging.info("saving transcripts for %s ..." % corpus)
+        transcripts.save()
+        logging.info("saving transcripts for %s ...done." % corpus)
 
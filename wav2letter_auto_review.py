@@ -35,6 +35,7 @@ from nltools.phonetics      import ipa2xsampa
 
 from speech_lexicon         import Lexicon
 from speech_transcripts     import Transcripts
+from speech_tokenizer_cache import tokenize_cached, prefetch_tokens
 
 APP_NAME            = 'wav2letter_auto_review'
 
@@ -135,6 +136,8 @@ logging.info("exporting transcripts from %s ..." % audio_corpus)
 
 transcripts = Transcripts(corpus_name=audio_corpus)
 
+prefetch_tokens([transcripts[utt_id]["prompt"] for utt_id in transcripts], lang=options.lang)
+
 utt_num = 0
 
 destdirfn = '%s/test' % data_dir
@@ -144,7 +147,7 @@ prompts = set()
 for utt_id in transcripts:
 
     ts = transcripts[utt_id]
-    prompts.add(u' '.join(tokenize(transcripts[utt_id]["prompt"], options.lang)))
+    prompts.add(u' '.join(tokenize_cached(transcripts[utt_id]["prompt"], options.lang)))
 
     if ts['quality'] != 0:
         continue
@@ -165,7 +168,7 @@ for utt_id in transcripts:
 
         tkn = u''
         wrd = u''
-        for token in tokenize(ts['prompt'], lang=options.lang):
+        for token in tokenize_cached(ts['prompt'], lang=options.lang):
 
             if not (token in lex):
                 logging.error(u'token %s missing from dict!' % token)
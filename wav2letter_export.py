@@ -31,10 +31,11 @@ from optparse               import OptionParser
 
 from nltools                import misc
 from nltools.tokenizer      import tokenize
-from nltools.phonetics      import ipa2xsampa
 
 from speech_lexicon         import Lexicon
-from speech_transcripts     import Transcripts
+from speech_dict_export     import export_dict, W2LDictWriter
+from speech_tokenizer_cache import tokenize_cached, prefetch_tokens
+from speech_transcripts     import load_transcripts, BACKEND_MMAP, DEFAULT_NUM_CPUS
 
 APP_NAME            = 'speech_wav2letter_export'
 
@@ -56,6 +57,9 @@ parser = OptionParser("usage: %prog [options] <model_name> <dictionary> <languag
 
 parser.add_option ("-d", "--debug", dest="debug", type='int', default=0, help="Limit number of sentences (debug purposes only), default: 0")
 
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                   help="number of cpus to use for loading transcripts in parallel, default: %d" % DEFAULT_NUM_CPUS)
+
 parser.add_option ("-l", "--lang", dest="lang", type = "str", default='de', help="language (default: de)")
 
 parser.add_option ("-p", "--prompt-words", action="store_true", dest="prompt_words", help="Limit dict to tokens covered in prompts")
@@ -149,12 +153,13 @@ def export_audio (train_val, tsdict):
 
     lcnt = 0
 
+    prefetch_tokens([tsdict[utt_id]['ts'] for utt_id in tsdict], lang=options.lang)
 
     for utt_id in tsdict:
 
         ts = tsdict[utt_id]
 
-        tokens = tokenize(ts['ts'], lang=options.lang)
+        tokens = tokenize_cached(ts['ts'], lang=options.lang)
         covered_by_lex = True
         for token in tokens:
             if not (token in lex):
@@ -175,13 +180,7 @@ def export_audio (train_val, tsdict):
             wrd = u''
             for token in tokens:
 
-                ipas = lex[token]['ipa'] 
-                xsr = ipa2xsampa(token, ipas, spaces=True)
-
-                xs = (xsr.replace('-', '')
-                         .replace('\' ', '\'')
-                         .replace('  ', ' ')
-                         .replace('#', 'nC'))
+                xs = lex.xsampa(token)
 
                 if tkn:
                     tkn += u' | '
@@ -210,71 +209,28 @@ def export_audio (train_val, tsdict):
 
 utt_num = { 'train': 0, 'valid': 0 }
 
-for audio_corpus in audio_corpora:
+logging.info("loading transcripts from %s ..." % ', '.join(audio_corpora))
+transcript_objs = load_transcripts(audio_corpora, num_cpus=options.num_cpus, backend=BACKEND_MMAP)
+logging.info("loading transcripts done.")
 
-    logging.info("exporting transcripts from %s ..." % audio_corpus)
+for audio_corpus, transcripts in zip(audio_corpora, transcript_objs):
 
-    transcripts = Transcripts(corpus_name=audio_corpus)
+    logging.info("exporting transcripts from %s ..." % audio_corpus)
 
     ts_all, ts_train, ts_test = transcripts.split(limit=options.debug)
 
     export_audio('train', ts_train)
     export_audio('valid', ts_test)
 
-    logging.info("exported transcripts from %s: %d train, %d test samples." % (audio_corpus, len(ts_train), len(ts_test)))
+    logging.info("exported transcripts from %s: %s." % (audio_corpus, transcripts.format_split_stats()))
 
 #
 # export dict
 #
 
 logging.info("Exporting dictionary...")
-
-utt_dict = {}
-for token in lex:
-    utt_dict[token] = lex.dictionary[token]['ipa']
-
-dictfn = '%s/lexicon.txt' % data_dir
-phoneme_set = set()
-with codecs.open(dictfn, 'w', 'utf8') as dictf:
-
-    for token in sorted(utt_dict):
-
-        ipa = utt_dict[token]
-        xsr = ipa2xsampa(token, ipa, spaces=True)
-
-        xs = (xsr.replace('-', '')
-                 .replace('\' ', '\'')
-                 .replace('  ', ' ')
-                 .replace('#', 'nC'))
-
-        dictf.write(u'%s %s\n' % (token, xs))
-
-        for p in xs.split(' '):
-
-            if len(p) < 1:
-                logging.error(
-                    u"****ERROR: empty phoneme in : '%s' ('%s', ipa: '%s', token: '%s')" % (
-                    xs, xsr, ipa, token))
-
-            phoneme_set.add(p)
-
-logging.info("%s written." % dictfn)
+export_dict(lex, [W2LDictWriter('%s/lexicon.txt' % data_dir, '%s/tokens.txt' % data_dir)])
 logging.info("Exporting dictionary ... done.")
 
-#
-# export phoneme set
-#
-
-tokensfn = '%s/tokens.txt' % data_dir
-
-with codecs.open(tokensfn, 'w', 'utf8') as tokensf:
-
-    tokensf.write('|\n')
-
-    for token in sorted(phoneme_set):
-        tokensf.write(u'%s\n' % token)
-
-logging.info("%s written." % tokensfn)
-
 logging.info ( "All done." )
 
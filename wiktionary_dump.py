@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Guenter Bartsch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# streaming access to mediawiki xml dumps (plain, .bz2 or bz2 multistream)
+#
+# dump_chunks() splits a dump into page aligned chunks which can be handed to
+# worker processes, chunk_pages() then yields the (title, text) of each page
+# in a chunk. For multistream dumps with an index file a chunk is just a range
+# of compressed streams, so reading and decompressing happens in the workers.
+# Chunk boundaries only depend on the dump, so chunk numbers can be used to
+# checkpoint and resume.
+#
+
+import os
+import re
+import bz2
+
+import xml.etree.cElementTree as ET
+
+CHUNK_SIZE        = 8 * 1024 * 1024
+BLOCK_SIZE        = 1024 * 1024
+STREAMS_PER_CHUNK = 50
+
+PAGE_PATTERN = re.compile(r'<page>.*?</page>', re.DOTALL)
+
+def multistream_index(fn):
+
+    """index file of a bz2 multistream dump, if there is one next to it"""
+
+    if not fn.endswith('-multistream.xml.bz2'):
+        return None
+
+    indexfn = fn[:-len('.xml.bz2')] + '-index.txt.bz2'
+
+    return indexfn if os.path.exists(indexfn) else None
+
+def _bz2_blocks(f):
+
+    # concatenated bz2 streams, which bz2.BZ2File does not support
+
+    dec = bz2.BZ2Decompressor()
+
+    while True:
+
+        data = f.read(BLOCK_SIZE)
+        if not data:
+            break
+
+        while data:
+
+            try:
+                out = dec.decompress(data)
+            except EOFError:
+                # previous stream ended exactly at the block boundary
+                dec = bz2.BZ2Decompressor()
+                out = dec.decompress(data)
+
+            data = dec.unused_data
+            if data:
+                dec = bz2.BZ2Decompressor()
+
+            yield out
+
+def _bz2_decompress(data):
+
+    res = []
+    while data:
+        dec = bz2.BZ2Decompressor()
+        res.append(dec.decompress(data))
+        data = dec.unused_data
+
+    return ''.join(res)
+
+def _plain_blocks(f):
+
+    while True:
+        data = f.read(BLOCK_SIZE)
+        if not data:
+            break
+        yield data
+
+def _plain_chunks(fn):
+
+    with open(fn, 'rb') as f:
+
+        blocks = _bz2_blocks(f) if fn.endswith('.bz2') else _plain_blocks(f)
+
+        buf = []
+        l   = 0
+        for block in blocks:
+
+            buf.append(block)
+            l += len(block)
+            if l < CHUNK_SIZE:
+                continue
+
+            data = ''.join(buf)
+            end  = data.rfind('</page>')
+            if end < 0:
+                buf = [data]
+                continue
+
+            end += len('</page>')
+            yield data[:end]
+
+            buf = [data[end:]]
+            l   = len(buf[0])
+
+        data = ''.join(buf)
+        if data:
+            yield data
+
+def _bz2_blocks_lines(f):
+
+    rest = ''
+    for block in _bz2_blocks(f):
+        lines = (rest + block).split('\n')
+        rest  = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if rest:
+        yield rest
+
+def _multistream_chunks(fn, indexfn):
+
+    # index lines look like offset:page id:title, offsets are stream starts
+
+    offsets = set()
+    with open(indexfn, 'rb') as f:
+        for line in _bz2_blocks_lines(f):
+            offsets.add(int(line.split(':', 1)[0]))
+
+    offsets = sorted(offsets)
+    offsets.append(os.path.getsize(fn))
+
+    for i in range(0, len(offsets) - 1, STREAMS_PER_CHUNK):
+        yield (fn, offsets[i], offsets[min(i + STREAMS_PER_CHUNK, len(offsets) - 1)])
+
+def dump_chunks(fn, indexfn=None):
+
+    """
+    page aligned chunks of dump fn, multistream dumps are split along the
+    streams listed in indexfn
+    """
+
+    if indexfn:
+        return _multistream_chunks(fn, indexfn)
+
+    return _plain_chunks(fn)
+
+def chunk_pages(chunk):
+
+    """(title, text) of all pages in a chunk as returned by dump_chunks()"""
+
+    if isinstance(chunk, tuple):
+        fn, start, end = chunk
+        with open(fn, 'rb') as f:
+            f.seek(start)
+            data = _bz2_decompress(f.read(end - start))
+    else:
+        data = chunk
+
+    for m in PAGE_PATTERN.finditer(data):
+
+        page = ET.fromstring(m.group(0))
+
+        texts = page.findall('.//text')
+
+        title = page.findtext('title') or u''
+        text  = texts[-1].text if texts else None
+
+        yield unicode(title), unicode(text or u'')
+
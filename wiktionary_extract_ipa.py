@@ -21,24 +21,33 @@
 #
 # extract pronounciations from (english and german, for now) wiktionary
 #
+# the dump is read in page aligned chunks (see wiktionary_dump.py) which are
+# parsed by a pool of worker processes, results are written in dump order.
+# A checkpoint is written after each chunk so an interrupted run can be
+# resumed (-r).
+#
 
 import os
 import sys
-import xml.sax
 import re
-import string
+import json
+import time
 import codecs
 import logging
+import multiprocessing
 
 from optparse           import OptionParser
 from nltools            import misc
-from functools          import reduce
+
+from wiktionary_dump    import dump_chunks, chunk_pages, multistream_index
 
 PROC_TITLE      = 'wiktionary_extract_ipa'
 # ARTICLE_LIMIT   = 100
 ARTICLE_LIMIT   = 0
 DICTFN          = 'data/dst/speech/%s/dict_wiktionary_%s.txt'
 WORDLISTFN      = 'data/dst/speech/%s/wordlist_wiktionary_%s.txt'
+CHECKPOINTFN    = 'data/dst/speech/%s/wiktionary_extract_%s.ckpt'
+DEFAULT_NUM_CPUS = multiprocessing.cpu_count()
 
 
 IPA_PATTERN = {      # :{{IPA}} {{Lautschrift|çi}}
@@ -47,117 +56,111 @@ IPA_PATTERN = {      # :{{IPA}} {{Lautschrift|çi}}
                'en': re.compile(r"{{IPA\|([^|]+)\|.*lang=en}}"),
               }
 
+# cheap substring tests to skip lines the patterns above cannot match
+
+IPA_MARKER  = {'de': u'{{Lautschrift|',
+               'en': u'{{IPA|'}
+
 ALPHABET    = {'de': set(u"abcdefghijklmnopqrstuvwxyzäöüß"),
                'en': set(u"abcdefghijklmnopqrstuvwxyz'") }
 
 # :ver·rückt, {{Komp.}} ver·rück·ter, {{Sup.}} ver·rück·tes·ten
 HYP_PATTERN = re.compile(r"^:([^,]+)")
 
-article_cnt = 0
-ipa_cnt     = 0
-
-class ArticleExtractor(xml.sax.ContentHandler):
-
-    def __init__(self):
-        xml.sax.ContentHandler.__init__(self)
- 
-    def startElement(self, name, attrs):
-
-        self.ce = name
-
-        if name == 'title':
-            self.title = ''
-        if name == 'text':
-            self.text = ''
-
-        if name == 'page':
-            loc = self._locator
-            if loc is not None:
-                line, col = loc.getLineNumber(), loc.getColumnNumber()
-            else:
-                line, col = 'unknown', 'unknown'
-            logging.debug('page starts at line %s col %s' % (line, col))
-
-    def characters(self, content):
-
-        if self.ce == 'title':
-            self.title += content
-        elif self.ce == 'text':
-            self.text += content 
-
-    def endElement(self, name):
-
-        global article_cnt, ipa_cnt, dictf, options, wordlistf
-
-        #print("endElement '" + name + "'")
-        if name == 'page':
-
-            article_cnt += 1
-
-            title = self.title.lstrip().rstrip()
-            body  = self.text.lstrip().rstrip()
-
-            ipa         = None
-            hyphenation = None
-            hyp_armed   = False
-            german      = False
-
-            for line in body.split('\n'):
-                if not ipa:
-                    for m in IPA_PATTERN[options.lang].findall(line):
-                        ipa = m
-                        break # pick the first one
-                if not hyphenation:
-                    if hyp_armed:
-                        hyp_armed = False
-                        m = HYP_PATTERN.match(line)
-                        if m:
-                            hyphenation = m.group(1)
-                    if u'{{Worttrennung}}' in line:
-                        hyp_armed = True
-                if not german:
-                    if u'{{Sprache|Deutsch}}' in line:
-                        german = True
-
-            if options.lang == 'de':
-                if not german:
-                    logging.debug("%7d %7d %s NOT GERMAN." % (article_cnt, ipa_cnt, title))
-                    return
-                # all characters used in title covered by our alphabet?
-                alphacheck = reduce(lambda t, c: False if not t else c.lower() in ALPHABET[options.lang], title, True)
-                if not alphacheck:
-                    logging.debug("%7d %7d %s NOT COVERED BY ALPHABET." % (article_cnt, ipa_cnt, repr(title)))
-                    return
-                wordlistf.write('%s\n' % title)
-                if not ipa:
-                    logging.debug("%7d %7d %s NO PRONOUNCIATION FOUND." % (article_cnt, ipa_cnt, title))
-                    return
-                if not hyphenation:
-                    logging.debug("%7d %7d %s NO HYPHENTATION   FOUND." % (article_cnt, ipa_cnt, title))
-                    return
-            elif options.lang == 'en':
-                # all characters used in title covered by our alphabet?
-                alphacheck = reduce(lambda t, c: False if not t else c.lower() in ALPHABET[options.lang], title, True)
-                if not alphacheck:
-                    logging.debug("%7d %7d %s NOT COVERED BY ALPHABET." % (article_cnt, ipa_cnt, repr(title)))
-                    return
-
-                wordlistf.write('%s\n' % title)
-
-                if not ipa:
-                    logging.debug("%7d %7d %s NO PRONOUNCIATION FOUND." % (article_cnt, ipa_cnt, title))
-                    return
-
-                hyphenation = title
-
-            ipa_cnt     += 1
-            logging.info(u"%7d %7d %s IPA: %s" % (article_cnt, ipa_cnt, title, ipa))
-
-            dictf.write('%s;%s\n' % (hyphenation, ipa))
-
-            if ARTICLE_LIMIT and article_cnt >= ARTICLE_LIMIT:
-                logging.warn('DEBUG limit of %d reached -> exit.' % ARTICLE_LIMIT)
-                sys.exit(0)
+def extract_article(lang, title, body):
+
+    """
+    returns (wordlist entry, dict entry) for one article, either of which may
+    be None
+    """
+
+    title = title.strip()
+    body  = body.strip()
+
+    if lang == 'de' and not u'{{Sprache|Deutsch}}' in body:
+        logging.debug("%s NOT GERMAN." % title)
+        return None, None
+
+    # all characters used in title covered by our alphabet?
+    alphabet = ALPHABET[lang]
+    for c in title:
+        if not c.lower() in alphabet:
+            logging.debug("%s NOT COVERED BY ALPHABET." % repr(title))
+            return None, None
+
+    ipa         = None
+    hyphenation = None
+    hyp_armed   = False
+    pattern     = IPA_PATTERN[lang]
+    marker      = IPA_MARKER[lang]
+
+    for line in body.split('\n'):
+        if not ipa and marker in line:
+            for m in pattern.findall(line):
+                ipa = m
+                break # pick the first one
+        if not hyphenation:
+            if hyp_armed:
+                hyp_armed = False
+                m = HYP_PATTERN.match(line)
+                if m:
+                    hyphenation = m.group(1)
+            if u'{{Worttrennung}}' in line:
+                hyp_armed = True
+        if ipa and hyphenation:
+            break
+
+    if not ipa:
+        logging.debug("%s NO PRONOUNCIATION FOUND." % title)
+        return title, None
+
+    if lang == 'en':
+        hyphenation = title
+    elif not hyphenation:
+        logging.debug("%s NO HYPHENTATION   FOUND." % title)
+        return title, None
+
+    return title, (hyphenation, ipa)
+
+def _extract_chunk(args):
+
+    lang, chunk = args
+
+    articles = 0
+    words    = []
+    entries  = []
+
+    for title, body in chunk_pages(chunk):
+
+        articles += 1
+
+        word, entry = extract_article(lang, title, body)
+        if word:
+            words.append(word)
+        if entry:
+            entries.append(entry)
+
+    return articles, words, entries
+
+def _enum_chunks(chunks, start, lang):
+
+    # chunks before start have been processed already, for plain dumps they
+    # still have to be read to find the chunk boundaries
+
+    for i, chunk in enumerate(chunks):
+        if i >= start:
+            yield lang, chunk
+
+def _source_id(fn):
+    st = os.stat(fn)
+    return [os.path.realpath(fn), st.st_size, st.st_mtime]
+
+def write_checkpoint(ckptfn, state):
+
+    tmpfn = '%s.tmp' % ckptfn
+    with open(tmpfn, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmpfn, ckptfn)
 
 #
 # init
@@ -174,6 +177,12 @@ parser = OptionParser("usage: %%prog [options]")
 parser.add_option ("-l", "--lang", dest="lang", type = "str", default="de",
                    help="language (default: de)")
 
+parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
+                   help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
+
+parser.add_option ("-r", "--resume", action="store_true", dest="resume",
+                   help="resume an interrupted run from its last checkpoint")
+
 parser.add_option("-v", "--verbose", action="store_true", dest="verbose", 
                   help="enable debug output")
 
@@ -184,9 +193,6 @@ if options.verbose:
 else:
     logging.basicConfig(level=logging.INFO)
 
-for c in ALPHABET[options.lang]:
-    logging.debug(c)
-
 #
 # load config, set up global variables
 #
@@ -195,20 +201,89 @@ config = misc.load_config ('.speechrc')
 
 wikfn  = config.get("speech", "wiktionary_%s" % options.lang)
 
+dictfn     = DICTFN       % (options.lang, options.lang)
+wordlistfn = WORDLISTFN   % (options.lang, options.lang)
+ckptfn     = CHECKPOINTFN % (options.lang, options.lang)
 
 #
-# main program: SAX parsing of wiktionary dump
+# checkpoint
 #
 
-dictf     = codecs.open(DICTFN % (options.lang, options.lang), 'w', 'utf8')
-wordlistf = codecs.open(WORDLISTFN % (options.lang, options.lang), 'w', 'utf8')
+state = {'source': _source_id(wikfn), 'chunks': 0, 'articles': 0, 'ipas': 0, 'dict_pos': 0, 'wordlist_pos': 0}
+mode  = 'w'
+
+if options.resume:
+    if not os.path.exists(ckptfn):
+        logging.warn ('%s not found, starting from scratch.' % ckptfn)
+    else:
+        with open(ckptfn) as f:
+            ckpt = json.load(f)
+        if ckpt['source'] != state['source']:
+            logging.error ('%s belongs to a different dump, refusing to resume.' % ckptfn)
+            sys.exit(1)
+        state = ckpt
+        mode  = 'r+'
+        logging.info ('resuming after chunk %d (%d articles, %d entries).' % (state['chunks'], state['articles'], state['ipas']))
 
-source = codecs.open(wikfn, 'r', 'utf8')
-xml.sax.parse(source, ArticleExtractor())
+#
+# main program: parse dump chunks in parallel, write results in order
+#
+
+dictf     = codecs.open(dictfn, mode, 'utf8')
+wordlistf = codecs.open(wordlistfn, mode, 'utf8')
+
+# drop whatever has been written after the last checkpoint
+
+if mode == 'r+':
+    for f, pos in ((dictf, state['dict_pos']), (wordlistf, state['wordlist_pos'])):
+        f.seek(pos)
+        f.truncate()
+
+indexfn = multistream_index(wikfn)
+if indexfn:
+    logging.info ('reading multistream dump %s (index: %s)' % (wikfn, indexfn))
+else:
+    logging.info ('reading dump %s' % wikfn)
+
+chunks     = _enum_chunks(dump_chunks(wikfn, indexfn), state['chunks'], options.lang)
+pool       = multiprocessing.Pool(options.num_cpus)
+time_start = time.time()
+articles   = 0
+
+try:
+    for cnt, words, entries in pool.imap(_extract_chunk, chunks):
+
+        for word in words:
+            wordlistf.write(u'%s\n' % word)
+        for hyphenation, ipa in entries:
+            logging.debug(u"%s IPA: %s" % (hyphenation, ipa))
+            dictf.write(u'%s;%s\n' % (hyphenation, ipa))
+
+        dictf.flush()
+        wordlistf.flush()
+
+        articles          += cnt
+        state['chunks']   += 1
+        state['articles'] += cnt
+        state['ipas']     += len(entries)
+        state['dict_pos']     = dictf.tell()
+        state['wordlist_pos'] = wordlistf.tell()
+
+        write_checkpoint(ckptfn, state)
+
+        secs = time.time() - time_start
+        logging.info ('chunk %5d: %8d articles, %7d entries, %.0f articles/s' % (state['chunks'], state['articles'], state['ipas'], articles / secs if secs > 0 else 0.0))
+
+        if ARTICLE_LIMIT and state['articles'] >= ARTICLE_LIMIT:
+            logging.warn('DEBUG limit of %d reached -> exit.' % ARTICLE_LIMIT)
+            break
+
+finally:
+    pool.terminate()
+    pool.join()
 
 dictf.close()
 wordlistf.close()
 
-logging.info("%s written." % (DICTFN % (options.lang, options.lang)))
-logging.info("%s written." % (WORDLISTFN % (options.lang, options.lang)))
-
+logging.info("%s written." % dictfn)
+logging.info("%s written." % wordlistfn)
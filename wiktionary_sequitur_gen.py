@@ -25,28 +25,24 @@
 
 import os
 import sys
+import time
 import string
 import codecs
 import logging
 import traceback
+import multiprocessing
 
 from optparse               import OptionParser
 
 from nltools                import misc
 from speech_lexicon         import Lexicon
-from nltools.sequiturclient import sequitur_gen_ipa, sequitur_gen_ipa_multi
-from nltools.phonetics      import xsampa2ipa
 
 
 PROC_TITLE       = 'wiktionary_sequitur_gen'
 DICTFN           = 'data/dst/speech/de/dict_wiktionary_de.txt'
 OUTDICTFN        = 'data/dst/speech/de/dict_wiktionary_gen.txt'
 OUTREJFN         = 'data/dst/speech/de/dict_wiktionary_rej.txt'
-CHUNKINRFN       = 'data/dst/speech/de/dict_wiktionary_chinr_%04d.txt'
-CHUNKINWFN       = 'data/dst/speech/de/dict_wiktionary_chinw_%04d.txt'
-CHUNKOUTRFN      = 'data/dst/speech/de/dict_wiktionary_choutr_%04d.txt'
-CHUNKOUTWFN      = 'data/dst/speech/de/dict_wiktionary_choutw_%04d.txt'
-SCRIPTFN         = 'data/dst/speech/de/dict_wiktionary_run_parallel.sh'
+DONEFN           = 'data/dst/speech/de/dict_wiktionary_done.txt'
 REGULAR_MODEL    = 'data/models/sequitur-dict-de.ipa-latest'
 WIKTIONARY_MODEL = 'data/dst/speech/de/wiktionary_sequitur/model-6'
 TEST_TOKEN       = u'aalbestand'
@@ -77,6 +73,9 @@ parser.add_option ("-F", "--filter", dest="filter_file", type="str",
 parser.add_option ("-n", "--num-cpus", dest="num_cpus", type="int", default=DEFAULT_NUM_CPUS,
                    help="number of cpus to use in parallel, default: %d" % DEFAULT_NUM_CPUS)
 
+parser.add_option ("-r", "--resume", action="store_true", dest="resume",
+                   help="resume an interrupted run, skipping tokens processed already")
+
 parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
                    help="enable verbose logging")
 
@@ -252,134 +251,114 @@ with codecs.open(DICTFN, 'r', 'utf8') as dictf:
 logging.info("loading wiktionary... done. %d entries." % len(wiktionary))
 
 #
-# predict missing entries
+# predict missing entries: a pool of workers, each holding both sequitur
+# models, predicts batches of tokens; results get checked and written as
+# they come in
 #
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
-
-logging.info ('predicting missing entries in parallel...')
-
-num_chunks = 0
-
-with open(SCRIPTFN, 'w') as scriptf:
-
-    for i, chunk in enumerate(chunks(sorted(wiktionary), CHUNK_SIZE)):
-
-        with codecs.open(CHUNKINRFN % i, 'w', 'utf8') as chunkinrf:
-            with codecs.open(CHUNKINWFN % i, 'w', 'utf8') as chunkinwf:
-
-                for token in chunk:
-                    w, ipa = wiktionary[token]
+_models = None
 
-                    chunkinrf.write('%s\n' % token)
-                    chunkinwf.write('%s\n' % ipa)
+def _init_worker(regular_model, wiktionary_model):
 
-        scriptf.write('echo %04d\n' % i)
-        scriptf.write('g2p.py -e utf-8 --model %s --apply %s > %s &\n' % (REGULAR_MODEL, CHUNKINRFN % i, CHUNKOUTRFN % i))
-        scriptf.write('g2p.py -e utf-8 --model %s --apply %s > %s &\n' % (WIKTIONARY_MODEL, CHUNKINWFN % i, CHUNKOUTWFN % i))
-        num_chunks += 1
-        if DEBUG_CHUNK_LIMIT and num_chunks > DEBUG_CHUNK_LIMIT:
-            logging.warn('debug limit reached.')
-            break
+    global _models
 
-        if i % options.num_cpus == (options.num_cpus-1):
-            scriptf.write('wait\n')
+    from seqif import SeqIf
 
-    scriptf.write('wait\n')
+    _models = (SeqIf(regular_model), SeqIf(wiktionary_model))
 
-logging.info ('%s written.' % SCRIPTFN)
-os.system('chmod 700 %s' % SCRIPTFN)
-os.system(SCRIPTFN)
+def _g2p(si, word):
+    try:
+        return si.g2p(word)
+    except:
+        logging.error(u"g2p failed for %s:" % word)
+        logging.error(traceback.format_exc())
+        return None
 
-ipa_r_map = {}
-ipa_w_map = {}
+def _predict(batch):
 
-for chunkidx in range(num_chunks):
+    # batch: [(token, wiktionary ipa)] -> [(token, ipa_r, ipa_w)]
 
-    with codecs.open(CHUNKOUTRFN % chunkidx, 'r', 'utf8') as chunkf:
+    si_r, si_w = _models
 
-        for line in chunkf:
+    return [ (token, _g2p(si_r, token), _g2p(si_w, ipa)) for token, ipa in batch ]
 
-            parts = line.strip().split('\t')
-
-            if len(parts) < 2:
-                continue
-
-            try:
-                word = parts[0]
-                if word in wiktionary:
-
-                    xs = parts[1]
+def chunks(l, n):
+    """Yield successive n-sized chunks from l."""
+    for i in range(0, len(l), n):
+        yield l[i:i + n]
 
-                    ipa = xsampa2ipa(word, xs)
-                    ipa_r_map[word] = ipa
-            except:
-                logging.error("Error processing line %s:" % line)
-                logging.error(traceback.format_exc())
+done = set()
+if options.resume and os.path.exists(DONEFN):
+    with codecs.open(DONEFN, 'r', 'utf8') as donef:
+        for line in donef:
+            done.add(line.strip())
+    logging.info ('resuming, %d tokens have been processed already.' % len(done))
 
-    with codecs.open(CHUNKOUTWFN % chunkidx, 'r', 'utf8') as chunkf:
+todo = [ token for token in sorted(wiktionary) if not token in done ]
 
-        for line in chunkf:
+batches = [ [ (token, wiktionary[token][1]) for token in chunk ] for chunk in chunks(todo, CHUNK_SIZE) ]
+if DEBUG_CHUNK_LIMIT and len(batches) > DEBUG_CHUNK_LIMIT:
+    logging.warn('debug limit reached.')
+    batches = batches[:DEBUG_CHUNK_LIMIT]
 
-            parts = line.strip().split('\t')
+logging.info ('predicting %d missing entries in parallel (%d batches)...' % (len(todo), len(batches)))
 
-            if len(parts) < 2:
-                continue
+mode = 'a' if options.resume else 'w'
 
-            try:
-                ipan = parts[0]
-                if ipan in wiktionary_reverse:
+with codecs.open(OUTDICTFN, mode, 'utf8') as outdictf, \
+     codecs.open(OUTREJFN,  mode, 'utf8') as outrejf,  \
+     codecs.open(DONEFN,    mode, 'utf8') as donef:
 
-                    word = wiktionary_reverse[ipan]
+    cnt_matched = 0
+    cnt         = 0
+    time_start  = time.time()
 
-                    xs = parts[1]
+    pool = multiprocessing.Pool(options.num_cpus, _init_worker, (REGULAR_MODEL, WIKTIONARY_MODEL))
 
-                    ipa = xsampa2ipa(word, xs)
-                    ipa_w_map[word] = ipa
-            except:
-                logging.error("Error processing line %s:" % line)
-                logging.error(traceback.format_exc())
+    try:
+        for results in pool.imap_unordered(_predict, batches):
 
-# print repr(ipa_r_map)
-# print repr(ipa_w_map)
+            for token, ipa_r, ipa_w in results:
 
-with codecs.open(OUTDICTFN, 'w', 'utf8') as outdictf, \
-     codecs.open(OUTREJFN, 'w', 'utf8')  as outrejf:
+                cnt += 1
 
-    cnt_matched = 0
+                if not ipa_r or not ipa_w:
+                    continue
 
-    cnt = 0
+                try:
 
-    for token in ipa_r_map:
+                    ipa_m = merge_check(token, ipa_r, ipa_w)
+                    if ipa_m and (not u"'" in ipa_m): # at least one stress marker is required
+                        ipa_m = None
 
-        if not token in ipa_w_map:
-            continue
+                    # if matched:
+                    if ipa_m:
+                        logging.debug("%6d/%6d %6d %-30s: %s vs %s MATCHED!" % (cnt, len(todo), cnt_matched, token, ipa_r, ipa_w))
+                        cnt_matched += 1
 
-        try:
+                        outdictf.write(u"%s;%s\n" % (token, ipa_m))
 
-            ipa_r = ipa_r_map[token]
-            ipa_w = ipa_w_map[token]
+                    else:
+                        logging.debug("%6d/%6d %6d %-30s: %s vs %s" % (cnt, len(todo), cnt_matched, token, ipa_r, ipa_w))
+                        outrejf.write(u"\n%s\nIPA_R %s\nIPA_W %s\n" % (token, ipa_r.replace(u"-", u""), ipa_w))
+                except:
+                    logging.error(traceback.format_exc())
 
-            ipa_m = merge_check(token, ipa_r, ipa_w)
-            if ipa_m and (not u"'" in ipa_m): # at least one stress marker is required
-                ipa_m = None
+            # checkpoint: mark batch done only after its results have been written
 
-            # if matched:
-            if ipa_m:
-                logging.info("%6d/%6d %6d %-30s: %s vs %s MATCHED!" % (cnt, len(wiktionary), cnt_matched, token, ipa_r, ipa_w))
-                cnt_matched += 1
+            outdictf.flush()
+            outrejf.flush()
+            for token, ipa_r, ipa_w in results:
+                donef.write(u'%s\n' % token)
+            donef.flush()
 
-                outdictf.write(u"%s;%s\n" % (token, ipa_m))
+            secs = time.time() - time_start
+            rate = cnt / secs if secs > 0 else 0.0
+            logging.info ('%6d/%6d tokens, %6d matched, %.1f tokens/s, eta %.0fs' % (cnt, len(todo), cnt_matched, rate, (len(todo) - cnt) / rate if rate > 0 else 0.0))
 
-            else:
-                logging.info("%6d/%6d %6d %-30s: %s vs %s" % (cnt, len(wiktionary), cnt_matched, token, ipa_r, ipa_w))
-                outrejf.write(u"\n%s\nIPA_R %s\nIPA_W %s\n" % (token, ipa_r.replace(u"-", u""), ipa_w))
-        except:
-            logging.error(traceback.format_exc())
+    finally:
+        pool.terminate()
+        pool.join()
 
 logging.info (" %s written." % OUTDICTFN)
 logging.info (" %s written." % OUTREJFN)
-
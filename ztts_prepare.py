@@ -156,15 +156,9 @@ target_data_s  = np.zeros( (1, max_mfc_frames, hparams['num_freq']) , dtype='flo
 target_data_m  = np.zeros( (1, max_mfc_frames, hparams['num_mels']) , dtype='float32')
 target_lengths = np.zeros( (1, ), dtype='int32')
 
-for cfn in transcripts:
+for ts in transcripts.iter(min_quality=MIN_QUALITY, spk=speaker_in):
 
-    ts = transcripts[cfn]
-
-    if ts['quality'] < MIN_QUALITY:
-        continue
-
-    if ts['spk'] != speaker_in:
-        continue
+    cfn = ts['cfn']
 
     ts_orig  = ts['ts']
     ts_clean = cleanup_text(ts_orig, lang, hparams['alphabet'])